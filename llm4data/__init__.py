@@ -1,4 +1,5 @@
 import json
+import importlib
 import dotenv
 
 from pathlib import Path
@@ -9,6 +10,41 @@ dotenv.load_dotenv()
 
 __version__ = "0.0.10"
 
-indicator2name = dict(
-    wdi=json.load((Path(__file__).parent / "wdi2name.json").open("r"))
-)
+# Subpackages and modules are imported on first attribute access so that
+# `import llm4data` stays cheap. Heavy dependencies (torch, langchain, the
+# WDI indicator names) are only loaded by the code paths that need them.
+_LAZY_SUBMODULES = {
+    "augmentation",
+    "configs",
+    "embeddings",
+    "index",
+    "llm",
+    "prompts",
+    "schema",
+    "scripts",
+    "sources",
+    "utils",
+}
+
+
+def _load_indicator2name() -> dict:
+    return dict(
+        wdi=json.load((Path(__file__).parent / "wdi2name.json").open("r"))
+    )
+
+
+def __getattr__(name: str):
+    if name == "indicator2name":
+        value = _load_indicator2name()
+    elif name in _LAZY_SUBMODULES:
+        value = importlib.import_module(f"{__name__}.{name}")
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    # Cache the value so that `__getattr__` is only called once per name.
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | _LAZY_SUBMODULES | {"indicator2name"})
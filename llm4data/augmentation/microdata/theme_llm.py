@@ -24,8 +24,8 @@ from llm4data.utils.microdata.paths import get_idno_fpath
 from llm4data.utils.microdata.helpers import get_label_names
 from llm4data.utils.system.cache import memory
 from llm4data.configs import dirs
+from llm4data.embeddings.microdata import get_microdata_embeddings
 
-embedding_model = INSTRUCTOR("hkunlp/instructor-large")
 INSTRUCTION = "Represent the survey variable label for clustering; Input: "
 JSON_PARSER = SimpleJsonOutputParser()
 
@@ -63,10 +63,16 @@ def build_message(message, system_message=SYSTEM_MESSAGE):
     return messages
 
 
+def get_embedding_model() -> INSTRUCTOR:
+    """Get the INSTRUCTOR model (hkunlp/instructor-large) of the microdata
+    embeddings, so that the model is loaded once for both."""
+    return get_microdata_embeddings().embeddings.client
+
+
 @memory.cache
 def embed_labels(labels):
     prompt_labels = [[INSTRUCTION, label] for label in labels]
-    embeddings = embedding_model.encode(prompt_labels)
+    embeddings = get_embedding_model().encode(prompt_labels)
     return embeddings
 
 
@@ -238,7 +244,7 @@ class ThemeLLM(object):
     def semantic_embedding(self, label_names: dict[str, list]):
         # Generate the embeddings for the labels.
         # prompt_labels = [[INSTRUCTION, label] for label in sorted(label_names.keys())]
-        # embeddings = embedding_model.encode(prompt_labels)
+        # embeddings = get_embedding_model().encode(prompt_labels)
         labels = sorted(label_names.keys())
         embeddings = embed_labels(labels)
 
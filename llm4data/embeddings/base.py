@@ -1,17 +1,23 @@
 """Base classes for embedding models."""
-from typing import Union, Optional
-from langchain_community import embeddings as langchain_embeddings
-from pydantic.main import ModelMetaclass
+import os
+import asyncio
+import threading
+import json
+import hashlib
+from typing import Callable, Dict, List, Union, Optional
+import numpy as np
 from qdrant_client.http import models
-from pydantic.main import ModelMetaclass
 from dataclasses import dataclass, asdict
-import torch
 
-# Make the model atomically available
-LOADED_MODELS: dict = {}
+from llm4data.embeddings.query_cache import get_query_cache
+from llm4data.embeddings.sparse import SPARSE_VECTOR_NAME
+from llm4data.embeddings.registry import ModelKey, get_model_registry
 
 
 def get_device():
+    # Import torch lazily since it is expensive to load.
+    import torch
+
     device = "cpu"
     if torch.cuda.device_count() > 0:
         device = "cuda:0"
@@ -21,6 +27,101 @@ def get_device():
     return device
 
 
+@dataclass
+class CollectionConfig:
+    """Storage, quantization and HNSW options of the Qdrant collection of an
+    embedding model. They are applied when the collection is created or
+    recreated.
+
+    Args:
+        quantization: One of "scalar", "product" or "binary".
+        quantization_always_ram: Keep the quantized vectors in RAM.
+        product_compression: The compression ratio of product quantization.
+        on_disk: Store the original vectors on disk instead of in RAM.
+        on_disk_payload: Store the payloads on disk instead of in RAM.
+        hnsw_m: The number of edges per node in the HNSW graph.
+        hnsw_ef_construct: The size of the candidate list when building the graph.
+        rescore_oversampling: If set, fetch `oversampling * k` candidates with
+            the quantized vectors and rescore them with the original vectors.
+        sparse_vectors: Also store a sparse lexical vector of each point for
+            hybrid search, see `llm4data.embeddings.sparse`.
+        normalize_metadata: Store the document metadata once in a separate
+            collection instead of in every chunk, see `llm4data.index.metadata_store`.
+    """
+
+    quantization: Optional[str] = None
+    quantization_always_ram: bool = True
+    product_compression: str = "x16"
+    on_disk: bool = False
+    on_disk_payload: bool = False
+    hnsw_m: Optional[int] = None
+    hnsw_ef_construct: Optional[int] = None
+    rescore_oversampling: Optional[float] = None
+    sparse_vectors: bool = False
+    normalize_metadata: bool = False
+
+    def __post_init__(self):
+        if self.quantization not in (None, "scalar", "product", "binary"):
+            raise ValueError(
+                f"Unknown quantization `{self.quantization}`, expected one of scalar, product, binary."
+            )
+
+    def vectors_config(self, size: int, distance: models.Distance) -> models.VectorParams:
+        return models.VectorParams(size=size, distance=distance, on_disk=self.on_disk)
+
+    def sparse_vectors_config(self) -> Optional[Dict[str, models.SparseVectorParams]]:
+        if not self.sparse_vectors:
+            return None
+
+        return {
+            SPARSE_VECTOR_NAME: models.SparseVectorParams(
+                index=models.SparseIndexParams(on_disk=self.on_disk)
+            )
+        }
+
+    def quantization_config(self) -> Optional[models.QuantizationConfig]:
+        if self.quantization == "scalar":
+            return models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(
+                    type=models.ScalarType.INT8,
+                    always_ram=self.quantization_always_ram,
+                )
+            )
+
+        if self.quantization == "product":
+            return models.ProductQuantization(
+                product=models.ProductQuantizationConfig(
+                    compression=models.CompressionRatio(self.product_compression),
+                    always_ram=self.quantization_always_ram,
+                )
+            )
+
+        if self.quantization == "binary":
+            return models.BinaryQuantization(
+                binary=models.BinaryQuantizationConfig(
+                    always_ram=self.quantization_always_ram,
+                )
+            )
+
+        return None
+
+    def hnsw_config(self) -> Optional[models.HnswConfigDiff]:
+        if self.hnsw_m is None and self.hnsw_ef_construct is None:
+            return None
+
+        return models.HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct)
+
+    def search_params(self) -> Optional[models.SearchParams]:
+        if self.quantization is None or self.rescore_oversampling is None:
+            return None
+
+        return models.SearchParams(
+            quantization=models.QuantizationSearchParams(
+                rescore=True, oversampling=self.rescore_oversampling
+            )
+        )
+
+
 @dataclass
 class BaseEmbeddingModel:
     model_size = {
@@ -46,12 +147,25 @@ class BaseEmbeddingModel:
     embed_instruction: Optional[str] = None
     query_instruction: Optional[str] = None
 
-    embeddings: Optional[ModelMetaclass] = None
+    device: Optional[str] = None
+    cache_embeddings: bool = True
+
+    collection_config: Optional[Union[dict, CollectionConfig]] = None
 
     @property
     def model_id(self):
         return f"{self.data_type}_{self.model_name.replace('/', '_')}_{self.collection_name}_{self.distance}_{self.size}_{self.max_tokens}_{self.is_instruct}"
 
+    @property
+    def encoder_id(self):
+        """Identify the vectors produced by the model regardless of the
+        collection they are stored in. Unlike `model_id`, this does not
+        change when the data type or collection name changes."""
+        kwargs_hash = hashlib.md5(
+            json.dumps(self.kwargs or {}, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()[:8]
+        return f"{self.model_name.replace('/', '_')}_{self.embedding_cls}_{self.size}_{self.max_tokens}_{kwargs_hash}"
+
     def dict(self):
         return asdict(self)
 
@@ -63,12 +177,378 @@ class EmbeddingModel(BaseEmbeddingModel):
         self._instruct_init()
         self._hf_init()
 
-        self._create_embeddings()
+        # Multi-process encoding pool, see `start_pool`.
+        self._pool: Optional[dict] = None
+        # The pool has one input and one output queue, so concurrent callers
+        # would take each other's results. Encoding with it is serialized.
+        self._pool_lock = threading.Lock()
+
+    @property
+    def model_key(self) -> ModelKey:
+        instructions = tuple(
+            i for i in (self.embed_instruction, self.query_instruction) if i
+        )
+        # Other kwargs such as `quantize` or `encode_kwargs` also change the
+        # loaded model, so they are part of its identity.
+        options = {
+            k: v
+            for k, v in (self.kwargs or {}).items()
+            if k not in ("model_name", "embed_instruction", "query_instruction")
+        }
+        return ModelKey(
+            model_name=self.model_name,
+            embedding_cls=self.embedding_cls,
+            device=self.device,
+            instructions=instructions,
+            options=json.dumps(options, sort_keys=True, default=str),
+        )
+
+    @property
+    def max_seq_length(self) -> int:
+        """The maximum number of tokens of the texts: `max_tokens` if set, else
+        the limit of the model, which loads it. `max_tokens` is left as
+        configured so that the ids of the model do not load it."""
+        if self.max_tokens is not None:
+            return self.max_tokens
+
+        return self.embeddings.client.max_seq_length
+
+    @property
+    def embeddings(self):
+        """The langchain embeddings, loaded on first use and shared through
+        the model registry by all configs that use the same model."""
+        return get_model_registry().get(self.model_key, self._create_embeddings)
+
+    @property
+    def embedding_cache(self):
+        if not self.cache_embeddings:
+            return None
+
+        # Import lazily since the cache depends on the directory configs.
+        from llm4data.embeddings.cache import get_embedding_cache
+
+        return get_embedding_cache(self.encoder_id, size=self.size)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_with_cache(texts, self.embeddings.embed_documents)
+
+    def encode_batch(
+        self,
+        texts: List[str],
+        batch_size: int = 32,
+        sort_by_length: bool = True,
+        token_ids: Optional[List[Optional[List[int]]]] = None,
+    ) -> List[List[float]]:
+        """Encode the texts in batches of similar token length.
+
+        Sorting the texts by token length before batching minimises the
+        padding in each batch. The vectors are returned in the original
+        order of the texts.
+
+        Args:
+            texts (List[str]): The texts to encode.
+            batch_size (int): The number of texts sent to the encoder at once.
+            sort_by_length (bool): If True, group texts of similar token length.
+            token_ids (list): The token ids of the texts, without special
+                tokens, e.g., from the token chunker. The texts with token ids
+                are not tokenized again if the model supports it, see
+                `supports_token_ids`. None for the texts without them.
+        """
+        if token_ids is not None and self.supports_token_ids:
+            ids_by_text = dict(zip(texts, token_ids))
+        else:
+            ids_by_text = {}
+
+        return self._embed_with_cache(
+            texts,
+            lambda missing: self._encode_batches(
+                missing,
+                batch_size=batch_size,
+                sort_by_length=sort_by_length,
+                token_ids=[ids_by_text.get(text) for text in missing] if ids_by_text else None,
+            ),
+        )
+
+    @property
+    def supports_token_ids(self) -> bool:
+        """Whether `encode_batch` can encode token ids directly, which needs a
+        sentence-transformers model without instructions, in this process."""
+        if self.embedding_cls != "HuggingFaceEmbeddings" or self._pool is not None:
+            return False
+
+        from sentence_transformers import SentenceTransformer
+
+        return isinstance(self.embeddings.client, SentenceTransformer)
+
+    def token_lengths(self, texts: List[str]) -> List[int]:
+        """Get the number of tokens of the texts, up to `max_seq_length`."""
+        tokenizer = getattr(self.embeddings.client, "tokenizer", None)
+
+        if tokenizer is None:
+            return [len(text) for text in texts]
+
+        input_ids = tokenizer(
+            texts,
+            add_special_tokens=False,
+            truncation=True,
+            max_length=self.max_seq_length,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )["input_ids"]
+
+        return [len(ids) for ids in input_ids]
+
+    def start_pool(self, workers: int, threads_per_worker: Optional[int] = None):
+        """Start a pool of CPU worker processes used by `encode_batch`.
+
+        This uses the sentence-transformers multi-process pool. Each worker
+        loads its own copy of the model.
+
+        Args:
+            workers (int): The number of worker processes.
+            threads_per_worker (int): The number of torch threads per worker.
+                If None, the torch default is used.
+        """
+        client = self.embeddings.client
+
+        if not hasattr(client, "start_multi_process_pool"):
+            raise ValueError(
+                f"`{self.embedding_cls}` does not support multi-process encoding."
+            )
+
+        if self._pool is not None:
+            self.stop_pool()
+
+        # The workers are spawned, so they read the thread settings
+        # from the environment when they import torch.
+        thread_vars = ["OMP_NUM_THREADS", "MKL_NUM_THREADS"]
+        environ = {var: os.environ.get(var) for var in thread_vars}
+
+        try:
+            if threads_per_worker is not None:
+                for var in thread_vars:
+                    os.environ[var] = str(threads_per_worker)
+
+            self._pool = client.start_multi_process_pool(
+                target_devices=["cpu"] * workers
+            )
+        finally:
+            for var, value in environ.items():
+                if value is None:
+                    os.environ.pop(var, None)
+                else:
+                    os.environ[var] = value
+
+    def stop_pool(self):
+        if self._pool is None:
+            return
+
+        from sentence_transformers import SentenceTransformer
+
+        SentenceTransformer.stop_multi_process_pool(self._pool)
+        self._pool = None
+
+    def _encode_with_pool(self, texts: List[str], batch_size: int) -> List[List[float]]:
+        embeddings = self.embeddings
+
+        # Apply the same preprocessing as the langchain embeddings.
+        if self.embedding_cls == "HuggingFaceInstructEmbeddings":
+            inputs: list = [[embeddings.embed_instruction, text] for text in texts]
+        else:
+            inputs = [text.replace("\n", " ") for text in texts]
+
+        with self._pool_lock:
+            vectors = embeddings.client.encode_multi_process(
+                inputs, self._pool, batch_size=batch_size
+            )
+
+        if getattr(embeddings, "encode_kwargs", {}).get("normalize_embeddings"):
+            vectors = vectors / np.clip(
+                np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None
+            )
+
+        return vectors.tolist()
+
+    def _encode_token_ids(self, token_ids: List[List[int]]) -> List[List[float]]:
+        import torch
+
+        client = self.embeddings.client
+        tokenizer = client.tokenizer
+
+        # Add the special tokens and pad, as the tokenizer would for the texts.
+        features = tokenizer.pad(
+            [
+                tokenizer.prepare_for_model(
+                    ids,
+                    add_special_tokens=True,
+                    truncation=True,
+                    max_length=client.max_seq_length,
+                )
+                for ids in token_ids
+            ],
+            return_tensors="pt",
+        )
+        features = {key: value.to(client.device) for key, value in features.items()}
+
+        client.eval()
+        with torch.no_grad():
+            vectors = client.forward(features)["sentence_embedding"]
+
+        if getattr(self.embeddings, "encode_kwargs", {}).get("normalize_embeddings"):
+            vectors = torch.nn.functional.normalize(vectors, p=2, dim=1)
+
+        return vectors.float().cpu().numpy().tolist()
+
+    def _encode_batches(
+        self,
+        texts: List[str],
+        batch_size: int,
+        sort_by_length: bool,
+        token_ids: Optional[List[Optional[List[int]]]] = None,
+    ) -> List[List[float]]:
+        if token_ids is not None:
+            with_ids = [i for i, ids in enumerate(token_ids) if ids is not None]
+            without_ids = [i for i, ids in enumerate(token_ids) if ids is None]
+
+            results: List = [None] * len(texts)
+            order = sorted(with_ids, key=lambda i: len(token_ids[i])) if sort_by_length else with_ids
+
+            for start in range(0, len(order), batch_size):
+                batch = order[start : start + batch_size]
+                for i, vector in zip(batch, self._encode_token_ids([token_ids[i] for i in batch])):
+                    results[i] = vector
+
+            if without_ids:
+                encoded = self._encode_batches(
+                    [texts[i] for i in without_ids], batch_size, sort_by_length
+                )
+                for i, vector in zip(without_ids, encoded):
+                    results[i] = vector
+
+            return results
+
+        order = list(range(len(texts)))
+
+        if sort_by_length:
+            lengths = self.token_lengths(texts)
+            order.sort(key=lambda i: lengths[i])
+
+        vectors: List = [None] * len(texts)
+
+        if self._pool is not None:
+            # The pool splits the sorted texts into contiguous chunks,
+            # so each worker still gets texts of similar length.
+            encoded = self._encode_with_pool([texts[i] for i in order], batch_size)
+
+            for i, vector in zip(order, encoded):
+                vectors[i] = vector
+
+            return vectors
+
+        for start in range(0, len(order), batch_size):
+            batch = order[start : start + batch_size]
+            encoded = self.embeddings.embed_documents([texts[i] for i in batch])
+
+            for i, vector in zip(batch, encoded):
+                vectors[i] = vector
+
+        return vectors
+
+    def _embed_with_cache(
+        self, texts: List[str], encode: Callable[[List[str]], List[List[float]]]
+    ) -> List[List[float]]:
+        cache = self.embedding_cache
+        if cache is None:
+            return encode(texts)
+
+        # Only encode the texts that are not in the cache yet.
+        vectors = cache.get_many(texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+
+        if missing:
+            # Encode each missing text once, even if repeated in the batch.
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            encoded = encode(unique_texts)
+            cache.put_many(unique_texts, encoded)
+
+            by_text = dict(zip(unique_texts, encoded))
+            for i in missing:
+                vectors[i] = by_text[texts[i]]
+
+        return [list(map(float, vector)) for vector in vectors]
+
+    def embed_query(self, text: str) -> List[float]:
+        # Query vectors are shared by all configs using the same encoder.
+        query_cache = get_query_cache()
+        key = (self.encoder_id, self.query_instruction, text)
+
+        vector = query_cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            query_cache.put(key, vector)
+
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed many queries with one batched call to the model.
+
+        Cached queries are not encoded again, and the encoded ones are added
+        to the query cache.
+        """
+        query_cache = get_query_cache()
+        vectors = {}
+
+        for text in texts:
+            vector = query_cache.get((self.encoder_id, self.query_instruction, text))
+            if vector is not None:
+                vectors[text] = vector
+
+        missing = [text for text in dict.fromkeys(texts) if text not in vectors]
+        if missing:
+            for text, vector in zip(missing, self._encode_queries(missing)):
+                query_cache.put((self.encoder_id, self.query_instruction, text), vector)
+                vectors[text] = vector
+
+        return [vectors[text] for text in texts]
+
+    def _encode_queries(self, texts: List[str]) -> List[List[float]]:
+        embeddings = self.embeddings
+
+        if self.embedding_cls == "HuggingFaceInstructEmbeddings":
+            # Same as `embed_query`, for a batch of instruction pairs.
+            return embeddings.client.encode(
+                [[embeddings.query_instruction, text] for text in texts],
+                **embeddings.encode_kwargs,
+            ).tolist()
+
+        if self.embedding_cls in ("HuggingFaceEmbeddings", "ONNXEmbeddings"):
+            # These embed a query as a document.
+            return embeddings.embed_documents(texts)
+
+        return [embeddings.embed_query(text) for text in texts]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.embed_documents, texts
+        )
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.embed_query, text
+        )
 
     def _common_init(self):
         if self.kwargs is None:
             self.kwargs = {}
 
+        if self.device is None:
+            self.device = get_device()
+
+        if self.collection_config is None:
+            self.collection_config = CollectionConfig()
+        elif isinstance(self.collection_config, dict):
+            self.collection_config = CollectionConfig(**self.collection_config)
+
         if isinstance(self.distance, str):
             self.distance = models.Distance(self.distance)
 
@@ -100,7 +580,7 @@ class EmbeddingModel(BaseEmbeddingModel):
     def _hf_init(self):
         assert isinstance(self.kwargs, dict)
 
-        if self.embedding_cls == "HuggingFaceEmbeddings":
+        if self.embedding_cls in ("HuggingFaceEmbeddings", "ONNXEmbeddings"):
             self.kwargs = {
                 **self.kwargs,
                 "model_name": self.model_name,
@@ -110,9 +590,16 @@ class EmbeddingModel(BaseEmbeddingModel):
         if not isinstance(self.kwargs, dict):
             raise ValueError("`config.kwargs` must be a dict")
 
-        self.embeddings = getattr(langchain_embeddings, self.embedding_cls)(
-            **{"model_kwargs": {"device": get_device()}, **self.kwargs}
-        )
+        if self.embedding_cls == "ONNXEmbeddings":
+            from llm4data.embeddings.onnx import ONNXEmbeddings
 
-        if self.max_tokens is None and self.embeddings:
-            self.max_tokens = self.embeddings.client.max_seq_length
+            embeddings_cls = ONNXEmbeddings
+        else:
+            # Import langchain lazily since it is expensive to load.
+            from langchain_community import embeddings as langchain_embeddings
+
+            embeddings_cls = getattr(langchain_embeddings, self.embedding_cls)
+
+        return embeddings_cls(
+            **{"model_kwargs": {"device": self.device}, **self.kwargs}
+        )
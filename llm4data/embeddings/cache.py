@@ -0,0 +1,199 @@
+"""Persistent, content-addressed cache of document embeddings.
+
+Each encoder gets its own directory under `<LLM4DATA_CACHE_DIR>/embeddings`
+holding two append-only files:
+
+- `vectors.f32`: a float32 matrix with one row per cached text, read back
+  through a memory map.
+- `index.tsv`: the offset index mapping the uuid of a text to its row.
+
+Rows are always written before their index entries, so an interrupted write
+can at worst leave unreferenced rows at the end of the matrix.
+
+Several processes may share a cache, e.g., parallel indexing jobs. Writes
+hold an exclusive `fcntl` lock on the `lock` file of the directory, and
+reads of the row count and the index hold a shared one. On platforms
+without `fcntl`, the cache is only safe within a process.
+"""
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+from llm4data.configs import dirs
+from llm4data.utils.system.cache import get_uuid
+
+EMBEDDING_CACHES: Dict[str, "EmbeddingCache"] = {}
+_EMBEDDING_CACHES_LOCK = threading.Lock()
+
+
+class EmbeddingCache:
+    dtype = np.dtype("float32")
+    vectors_fname = "vectors.f32"
+    index_fname = "index.tsv"
+    lock_fname = "lock"
+
+    def __init__(self, cache_dir: Union[str, Path], size: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.size = size
+
+        self.vectors_path = self.cache_dir / self.vectors_fname
+        self.index_path = self.cache_dir / self.index_fname
+        self.lock_path = self.cache_dir / self.lock_fname
+
+        self._offsets: Dict[str, int] = {}
+        # The position up to which the index file has been read.
+        self._index_pos = 0
+        self._matrix: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+
+        with self._file_lock(exclusive=False):
+            self._load_index()
+
+    @property
+    def row_bytes(self) -> int:
+        return self.size * self.dtype.itemsize
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __contains__(self, text: str) -> bool:
+        return get_uuid(text) in self._offsets
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        """Lock the cache against the other processes using it."""
+        if fcntl is None:
+            yield
+            return
+
+        with self.lock_path.open("a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _num_rows(self) -> int:
+        if not self.vectors_path.exists():
+            return 0
+
+        return self.vectors_path.stat().st_size // self.row_bytes
+
+    def _load_index(self):
+        """Read the index entries added since the last read, e.g., by other processes.
+
+        Must be called with the file lock held.
+        """
+        num_rows = self._num_rows()
+
+        if not self.index_path.exists():
+            return
+
+        with self.index_path.open("rb") as f:
+            f.seek(self._index_pos)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # A partially written line, completed by the next write.
+                    break
+
+                self._index_pos += len(line)
+                parts = line.decode("utf-8").rstrip("\n").split("\t")
+                if len(parts) != 2:
+                    continue
+
+                key, row = parts[0], int(parts[1])
+                if row < num_rows:
+                    self._offsets[key] = row
+
+    def _get_matrix(self) -> Optional[np.memmap]:
+        num_rows = self._num_rows()
+
+        if num_rows == 0:
+            return None
+
+        if self._matrix is None or self._matrix.shape[0] < num_rows:
+            self._matrix = np.memmap(
+                self.vectors_path, dtype=self.dtype, mode="r", shape=(num_rows, self.size)
+            )
+
+        return self._matrix
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Get the cached vectors of the texts, or None for the texts not in the cache."""
+        with self._lock:
+            rows = [self._offsets.get(get_uuid(text)) for text in texts]
+
+            if all(row is None for row in rows):
+                return [None] * len(texts)
+
+            with self._file_lock(exclusive=False):
+                matrix = self._get_matrix()
+
+            return [None if row is None else np.array(matrix[row]) for row in rows]
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """Append the vectors of the texts not yet in the cache."""
+        if len(texts) != len(vectors):
+            raise ValueError("`texts` and `vectors` must have the same length.")
+
+        with self._lock, self._file_lock(exclusive=True):
+            # Pick up the texts cached by other processes since the last write.
+            self._load_index()
+
+            keys: List[str] = []
+            seen = set()
+            new_vectors = []
+
+            for text, vector in zip(texts, vectors):
+                key = get_uuid(text)
+                if key in self._offsets or key in seen:
+                    continue
+
+                seen.add(key)
+                keys.append(key)
+                new_vectors.append(vector)
+
+            if not keys:
+                return
+
+            matrix = np.asarray(new_vectors, dtype=self.dtype)
+            if matrix.shape[1] != self.size:
+                raise ValueError(
+                    f"Expected vectors of size {self.size}, got {matrix.shape[1]}."
+                )
+
+            start = self._num_rows()
+            with self.vectors_path.open("ab") as f:
+                # Drop a trailing partial row left by an interrupted write.
+                f.truncate(start * self.row_bytes)
+                f.write(matrix.tobytes())
+
+            with self.index_path.open("ab") as f:
+                # Drop a partial line left by an interrupted write.
+                f.truncate(self._index_pos)
+                entries = "".join(f"{key}\t{start + i}\n" for i, key in enumerate(keys))
+                f.write(entries.encode("utf-8"))
+                self._index_pos += len(entries.encode("utf-8"))
+
+            for i, key in enumerate(keys):
+                self._offsets[key] = start + i
+
+
+def get_embedding_cache(encoder_id: str, size: int) -> EmbeddingCache:
+    """Get the embedding cache of an encoder, shared within the process."""
+    with _EMBEDDING_CACHES_LOCK:
+        if encoder_id not in EMBEDDING_CACHES:
+            EMBEDDING_CACHES[encoder_id] = EmbeddingCache(
+                dirs.llm4data_cache_dir / "embeddings" / encoder_id, size=size
+            )
+
+    return EMBEDDING_CACHES[encoder_id]
@@ -1,6 +1,7 @@
+import os
 from typing import Optional
 from dataclasses import dataclass
-from llm4data.embeddings.base import EmbeddingModel
+from llm4data.embeddings.base import CollectionConfig, EmbeddingModel
 
 DOCS_EMBEDDINGS: Optional[EmbeddingModel] = None
 
@@ -14,11 +15,23 @@ def get_docs_embeddings():
     global DOCS_EMBEDDINGS
 
     if DOCS_EMBEDDINGS is None:
+        # Storing the metadata of a document once, not in every chunk, is
+        # opt-in since it changes the layout of the collection.
+        normalize_metadata = os.getenv("LLM4DATA_DOCS_NORMALIZE_METADATA", "false").strip().lower() in ("1", "true", "yes")
+
         DOCS_EMBEDDINGS = DocsEmbedding(
             model_name="avsolatorio/GIST-small-Embedding-v0",
             distance="Cosine",
             embedding_cls="HuggingFaceEmbeddings",
             is_instruct=False,
+            # Keep int8 quantized vectors in RAM and the original vectors
+            # on disk for rescoring, since the docs collection is large.
+            collection_config=CollectionConfig(
+                quantization="scalar",
+                on_disk=True,
+                rescore_oversampling=2.0,
+                normalize_metadata=normalize_metadata,
+            ),
         )
 
     return DOCS_EMBEDDINGS
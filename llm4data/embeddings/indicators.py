@@ -1,6 +1,6 @@
 from typing import Optional
 from dataclasses import dataclass
-from llm4data.embeddings.base import EmbeddingModel
+from llm4data.embeddings.base import CollectionConfig, EmbeddingModel
 
 INDICATORS_EMBEDDINGS: Optional[EmbeddingModel] = None
 
@@ -27,6 +27,8 @@ def get_indicators_embeddings():
             distance="Cosine",
             embedding_cls="HuggingFaceEmbeddings",
             is_instruct=False,
+            # Sparse vectors let series codes and exact names match in hybrid search.
+            collection_config=CollectionConfig(sparse_vectors=True),
         )
 
     return INDICATORS_EMBEDDINGS
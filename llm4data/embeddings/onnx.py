@@ -0,0 +1,269 @@
+"""ONNX Runtime backend for sentence-transformers embedding models.
+
+The configured sentence-transformer is exported to ONNX once and cached on
+disk, optionally dynamically quantized to int8. Inference then runs through
+onnxruntime on the CPU, and torch is only needed for the export.
+
+Use it by setting `embedding_cls="ONNXEmbeddings"` in an `EmbeddingModel`
+config, with `kwargs=dict(quantize=True)` to use the int8 model.
+
+This backend requires the `onnxruntime` and `onnx` packages, installed with
+the `onnx` extra:
+
+    pip install "llm4data[onnx]"
+"""
+import inspect
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+ONNX_MODEL_FNAME = "model.onnx"
+ONNX_QUANTIZED_MODEL_FNAME = "model-int8.onnx"
+ONNX_CONFIG_FNAME = "llm4data_onnx.json"
+
+
+def _import_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ImportError(
+            "The `ONNXEmbeddings` backend requires onnxruntime and onnx. Install them with the `onnx` extra: `pip install \"llm4data[onnx]\"`."
+        )
+
+    return onnxruntime
+
+
+def get_onnx_dir(model_name: str, cache_folder: Optional[Union[str, Path]] = None) -> Path:
+    if cache_folder is None:
+        from llm4data.configs import dirs
+
+        cache_folder = dirs.llm4data_cache_dir / "onnx"
+
+    return Path(cache_folder) / model_name.replace("/", "_")
+
+
+def export_sentence_transformer(model_name: str, onnx_dir: Union[str, Path]) -> Path:
+    """Export a sentence-transformer model to ONNX.
+
+    The transformer is exported with dynamic batch and sequence axes. The
+    tokenizer and the pooling configuration are stored next to the model so
+    that loading it later does not need torch.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling, Transformer
+
+    onnx_dir = Path(onnx_dir)
+    onnx_dir.mkdir(parents=True, exist_ok=True)
+
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = next(m for m in st_model.modules() if isinstance(m, Transformer))
+    pooling = next(m for m in st_model.modules() if isinstance(m, Pooling))
+
+    pooling_config = pooling.get_config_dict()
+    if pooling_config.get("pooling_mode_cls_token"):
+        pooling_mode = "cls"
+    elif pooling_config.get("pooling_mode_max_tokens"):
+        pooling_mode = "max"
+    else:
+        pooling_mode = "mean"
+
+    tokenizer = transformer.tokenizer
+    input_names = [
+        name
+        for name in ["input_ids", "attention_mask", "token_type_ids"]
+        if name in tokenizer.model_input_names
+    ]
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs)))[0]
+
+    sample = tokenizer(["llm4data"], return_tensors="pt")
+    dynamic_axes: Dict[str, Dict[int, str]] = {
+        name: {0: "batch", 1: "sequence"} for name in input_names
+    }
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    export_kwargs: Dict[str, Any] = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # Newer torch versions default to the dynamo exporter.
+        export_kwargs["dynamo"] = False
+
+    model_path = onnx_dir / ONNX_MODEL_FNAME
+    with torch.no_grad():
+        torch.onnx.export(
+            LastHiddenState(transformer.auto_model.eval()),
+            tuple(sample[name] for name in input_names),
+            str(model_path),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+            **export_kwargs,
+        )
+
+    tokenizer.save_pretrained(str(onnx_dir))
+    (onnx_dir / ONNX_CONFIG_FNAME).write_text(
+        json.dumps(
+            dict(
+                model_name=model_name,
+                pooling_mode=pooling_mode,
+                normalize=any(isinstance(m, Normalize) for m in st_model.modules()),
+                max_seq_length=transformer.max_seq_length,
+            ),
+            indent=2,
+        )
+    )
+
+    return model_path
+
+
+def quantize_onnx_model(model_path: Union[str, Path], quantized_path: Union[str, Path]) -> Path:
+    """Dynamically quantize the weights of an ONNX model to int8."""
+    _import_onnxruntime()
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(str(model_path), str(quantized_path), weight_type=QuantType.QInt8)
+
+    return Path(quantized_path)
+
+
+class ONNXEncoder:
+    """Encode texts with an exported sentence-transformer through onnxruntime.
+
+    It mirrors the parts of the `SentenceTransformer` API used in llm4data:
+    `encode`, `tokenizer` and `max_seq_length`.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        quantize: bool = False,
+        cache_folder: Optional[Union[str, Path]] = None,
+        num_threads: Optional[int] = None,
+    ):
+        onnxruntime = _import_onnxruntime()
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.quantize = quantize
+        self.onnx_dir = get_onnx_dir(model_name, cache_folder)
+
+        model_path = self.onnx_dir / ONNX_MODEL_FNAME
+        if not model_path.exists():
+            export_sentence_transformer(model_name, self.onnx_dir)
+
+        if quantize:
+            quantized_path = self.onnx_dir / ONNX_QUANTIZED_MODEL_FNAME
+            if not quantized_path.exists():
+                quantize_onnx_model(model_path, quantized_path)
+            model_path = quantized_path
+
+        self.model_path = model_path
+
+        config = json.loads((self.onnx_dir / ONNX_CONFIG_FNAME).read_text())
+        self.pooling_mode = config["pooling_mode"]
+        self.normalize = config["normalize"]
+        self.max_seq_length = config["max_seq_length"]
+        self.tokenizer = AutoTokenizer.from_pretrained(str(self.onnx_dir))
+
+        options = onnxruntime.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+
+        self.session = onnxruntime.InferenceSession(
+            str(model_path), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    @property
+    def memory_bytes(self) -> int:
+        return self.model_path.stat().st_size
+
+    def _pool(self, hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        if self.pooling_mode == "cls":
+            return hidden[:, 0]
+
+        mask = attention_mask[..., None].astype(hidden.dtype)
+
+        if self.pooling_mode == "max":
+            return np.where(mask > 0, hidden, -1e9).max(axis=1)
+
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(
+        self,
+        sentences: Union[str, List[str]],
+        batch_size: int = 32,
+        normalize_embeddings: bool = False,
+        **kwargs: Any,
+    ) -> np.ndarray:
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        outputs = []
+        for start in range(0, len(sentences), batch_size):
+            features = self.tokenizer(
+                sentences[start : start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            hidden = self.session.run(
+                None, {name: features[name].astype(np.int64) for name in self.input_names}
+            )[0]
+            outputs.append(self._pool(hidden, features["attention_mask"]))
+
+        embeddings = (
+            np.concatenate(outputs)
+            if outputs
+            else np.zeros((0, self.session.get_outputs()[0].shape[-1]), dtype=np.float32)
+        )
+
+        if self.normalize or normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.clip(norms, 1e-12, None)
+
+        return embeddings[0] if single else embeddings
+
+
+class ONNXEmbeddings:
+    """Embeddings with the same interface as langchain's `HuggingFaceEmbeddings`
+    running on the `ONNXEncoder`."""
+
+    def __init__(
+        self,
+        model_name: str,
+        quantize: bool = False,
+        cache_folder: Optional[Union[str, Path]] = None,
+        num_threads: Optional[int] = None,
+        model_kwargs: Optional[dict] = None,
+        encode_kwargs: Optional[dict] = None,
+    ):
+        # `model_kwargs` is accepted for compatibility with the langchain
+        # embeddings. The ONNX backend always runs on the CPU.
+        self.model_name = model_name
+        self.model_kwargs = model_kwargs or {}
+        self.encode_kwargs = encode_kwargs or {}
+        self.client = ONNXEncoder(
+            model_name,
+            quantize=quantize,
+            cache_folder=cache_folder,
+            num_threads=num_threads,
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = [text.replace("\n", " ") for text in texts]
+        return self.client.encode(texts, **self.encode_kwargs).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
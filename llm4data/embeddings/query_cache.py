@@ -0,0 +1,82 @@
+"""Bounded LRU cache of query vectors.
+
+The cache is keyed by (encoder_id, query_instruction, text) so collections
+that use the same model share the cached vectors of a prompt. The size is
+read from the `LLM4DATA_QUERY_CACHE_SIZE` environment variable (default 1024),
+and a size of 0 disables the cache.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+QUERY_CACHE: Optional["QueryCache"] = None
+
+QueryKey = Tuple[str, Optional[str], str]
+
+
+class QueryCache:
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._vectors: "OrderedDict[QueryKey, Tuple[float, ...]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._vectors)
+
+    def get(self, key: QueryKey) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._vectors.get(key)
+
+            if vector is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._vectors.move_to_end(key)
+
+        return list(vector)
+
+    def put(self, key: QueryKey, vector: List[float]):
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._vectors[key] = tuple(vector)
+            self._vectors.move_to_end(key)
+
+            while len(self._vectors) > self.maxsize:
+                self._vectors.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hit_rate,
+            size=len(self),
+            maxsize=self.maxsize,
+        )
+
+    def clear(self):
+        with self._lock:
+            self._vectors.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def get_query_cache() -> QueryCache:
+    global QUERY_CACHE
+
+    if QUERY_CACHE is None:
+        QUERY_CACHE = QueryCache(
+            maxsize=int(os.getenv("LLM4DATA_QUERY_CACHE_SIZE", "1024"))
+        )
+
+    return QUERY_CACHE
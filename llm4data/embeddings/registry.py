@@ -0,0 +1,158 @@
+"""Process-wide registry of the loaded embedding models.
+
+Identical models are loaded once and shared by every caller that asks for the
+same (model_name, embedding_cls, device, instructions, options) key, where
+the options hold the remaining backend kwargs. When a memory
+budget is set, the least recently used models are unloaded whenever loading a
+new model makes the registry exceed the budget.
+
+The budget is read from the `LLM4DATA_EMBEDDINGS_MEMORY_BUDGET_MB` environment
+variable and can be changed at runtime with `ModelRegistry.set_memory_budget`.
+"""
+import gc
+import os
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+MODEL_REGISTRY: Optional["ModelRegistry"] = None
+
+
+@dataclass(frozen=True)
+class ModelKey:
+    model_name: str
+    embedding_cls: str
+    device: str
+    instructions: Tuple[str, ...] = ()
+    options: str = ""
+
+
+def estimate_model_bytes(model: Any) -> int:
+    """Estimate the memory used by the weights of a loaded model.
+
+    The langchain wrappers keep the underlying sentence-transformers
+    model in the `client` attribute. Models that are not torch modules
+    can report their own size with a `memory_bytes` attribute.
+    """
+    if hasattr(model, "memory_bytes"):
+        return int(model.memory_bytes)
+
+    client = getattr(model, "client", model)
+
+    if hasattr(client, "memory_bytes"):
+        return int(client.memory_bytes)
+
+    if not hasattr(client, "parameters"):
+        return 0
+
+    size = sum(p.numel() * p.element_size() for p in client.parameters())
+    if hasattr(client, "buffers"):
+        size += sum(b.numel() * b.element_size() for b in client.buffers())
+
+    return size
+
+
+class ModelRegistry:
+    def __init__(self, memory_budget_mb: Optional[float] = None):
+        self.memory_budget_mb = memory_budget_mb
+        self._models: "OrderedDict[ModelKey, Any]" = OrderedDict()
+        self._sizes: Dict[ModelKey, int] = {}
+        self._lock = threading.RLock()
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(self._sizes.values())
+
+    def __contains__(self, key: ModelKey) -> bool:
+        return key in self._models
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+    def get(self, key: ModelKey, loader: Callable[[], Any]) -> Any:
+        """Get the model for the key, loading it with `loader` if needed.
+
+        Args:
+            key (ModelKey): The identity of the model.
+            loader (Callable): A function that loads and returns the model.
+        """
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+
+            model = loader()
+            self._models[key] = model
+            self._sizes[key] = estimate_model_bytes(model)
+            self._evict(keep=key)
+
+            return model
+
+    def set_memory_budget(self, memory_budget_mb: Optional[float]):
+        with self._lock:
+            self.memory_budget_mb = memory_budget_mb
+            self._evict()
+
+    def unload(self, key: ModelKey) -> bool:
+        with self._lock:
+            if key not in self._models:
+                return False
+
+            del self._models[key]
+            del self._sizes[key]
+
+        self._free_memory()
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._sizes.clear()
+
+        self._free_memory()
+
+    def _evict(self, keep: Optional[ModelKey] = None):
+        if self.memory_budget_mb is None:
+            return
+
+        budget = self.memory_budget_mb * 1024 * 1024
+        evicted = False
+
+        # Iterate from the least recently used model. The model that was
+        # just loaded is never evicted, even if it alone exceeds the budget.
+        for key in list(self._models):
+            if self.memory_bytes <= budget:
+                break
+
+            if key == keep:
+                continue
+
+            del self._models[key]
+            del self._sizes[key]
+            evicted = True
+
+        if evicted:
+            self._free_memory()
+
+    @staticmethod
+    def _free_memory():
+        gc.collect()
+
+        # Only touch torch if it has already been imported by a model.
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+def get_model_registry() -> ModelRegistry:
+    global MODEL_REGISTRY
+
+    if MODEL_REGISTRY is None:
+        budget = os.getenv("LLM4DATA_EMBEDDINGS_MEMORY_BUDGET_MB")
+        MODEL_REGISTRY = ModelRegistry(
+            memory_budget_mb=float(budget) if budget else None
+        )
+
+    return MODEL_REGISTRY
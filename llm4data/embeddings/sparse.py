@@ -0,0 +1,107 @@
+"""Sparse lexical vectors for hybrid search.
+
+The documents are encoded with BM25 term-frequency saturation and length
+normalization, and the queries with a unit weight per term, so the dot
+product scored by Qdrant ranks exact matches of codes and names first. The
+terms are hashed into the sparse vector indices, so there is no vocabulary to
+fit or store, and everything runs on CPU.
+
+Dotted codes such as `NY.GDP.PCAP.CD` are kept as one term, in addition to
+their parts, so that an exact series code outranks partial matches.
+"""
+import re
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional
+
+from qdrant_client.http import models
+
+SPARSE_ENCODER: Optional["SparseEncoder"] = None
+
+# The name of the sparse vector in the collections with `sparse_vectors`.
+SPARSE_VECTOR_NAME = "text-sparse"
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[._-][a-z0-9]+)*")
+
+# Dotted codes as written in a text, e.g., `NY.GDP.PCAP.CD`.
+CODE_PATTERN = re.compile(r"\w+(?:\.\w+)+")
+
+STOPWORDS = frozenset(
+    """a an and are as at be by for from has in is it of on or that the to
+    was were what which with""".split()
+)
+
+
+class SparseEncoder:
+    def __init__(self, k1: float = 1.2, b: float = 0.75, avg_doc_length: float = 64.0):
+        self.k1 = k1
+        self.b = b
+        self.avg_doc_length = avg_doc_length
+
+    def tokenize(self, text: str) -> List[str]:
+        tokens = []
+        for token in TOKEN_PATTERN.findall(text.lower()):
+            if token in STOPWORDS:
+                continue
+
+            tokens.append(token)
+
+            parts = re.split(r"[._-]", token)
+            if len(parts) > 1:
+                tokens.extend(part for part in parts if part not in STOPWORDS)
+
+        return tokens
+
+    @staticmethod
+    def token_index(token: str) -> int:
+        return zlib.crc32(token.encode("utf-8")) & 0x7FFFFFFF
+
+    def _to_sparse_vector(self, weights: Dict[int, float]) -> models.SparseVector:
+        indices = sorted(weights)
+        return models.SparseVector(
+            indices=indices, values=[float(weights[i]) for i in indices]
+        )
+
+    def encode_document(self, text: str) -> models.SparseVector:
+        tokens = self.tokenize(text)
+        norm = self.k1 * (1 - self.b + self.b * len(tokens) / self.avg_doc_length)
+
+        weights: Dict[int, float] = {}
+        for token, tf in Counter(tokens).items():
+            index = self.token_index(token)
+            # Hash collisions add up.
+            weights[index] = weights.get(index, 0.0) + tf * (self.k1 + 1) / (tf + norm)
+
+        return self._to_sparse_vector(weights)
+
+    def encode_documents(self, texts: List[str]) -> List[models.SparseVector]:
+        return [self.encode_document(text) for text in texts]
+
+    def encode_query(self, text: str) -> models.SparseVector:
+        return self._to_sparse_vector(
+            {self.token_index(token): 1.0 for token in set(self.tokenize(text))}
+        )
+
+
+def get_code_terms(text: str) -> List[str]:
+    """Get the dotted codes in a text, as written and uppercased, to match
+    keyword fields such as series codes exactly. Numbers are not codes."""
+    codes: List[str] = []
+    for code in CODE_PATTERN.findall(text):
+        if not any(c.isalpha() for c in code):
+            continue
+
+        for value in (code, code.upper()):
+            if value not in codes:
+                codes.append(value)
+
+    return codes
+
+
+def get_sparse_encoder() -> SparseEncoder:
+    global SPARSE_ENCODER
+
+    if SPARSE_ENCODER is None:
+        SPARSE_ENCODER = SparseEncoder()
+
+    return SPARSE_ENCODER
@@ -1,7 +1,10 @@
 from .qdrant import get_docs_index, get_indicators_index, get_microdata_index
+from .registry import IndexRegistry, get_index_registry
 
 __all__ = [
     "get_docs_index",
     "get_indicators_index",
     "get_microdata_index",
+    "IndexRegistry",
+    "get_index_registry",
 ]
@@ -0,0 +1,142 @@
+"""Store of document metadata for collections with a normalized layout.
+
+In a collection created with `CollectionConfig(normalize_metadata=True)`,
+the chunk payloads only hold the text, the page and the id of the document
+under `DOC_ID_KEY`. The metadata of each document is stored once in a
+vectorless `<collection_name>_metadata` collection, and joined back into the
+search results with `join_metadata`, using one batched lookup.
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from qdrant_client.http import models
+
+from ..utils.system.cache import get_uuid
+from .qdrant import collection_exists, get_client_key, get_index_client
+
+# The payload key of the document id in the chunks of a normalized collection.
+DOC_ID_KEY = "doc_id"
+
+_STORES: Dict[Tuple, "MetadataStore"] = {}
+_STORES_LOCK = threading.Lock()
+
+
+class MetadataStore:
+    def __init__(
+        self,
+        collection_name: str,
+        path: Optional[str] = None,
+        url: Optional[str] = None,
+        prefer_grpc: Optional[bool] = None,
+        cache_size: int = 1024,
+    ):
+        self.client_kwargs = dict(path=path, url=url, prefer_grpc=prefer_grpc)
+        self.client = get_index_client(**self.client_kwargs)
+        self.collection_name = collection_name
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, recreate: bool = False):
+        # The collection only holds payloads, so it has no vectors.
+        if recreate:
+            self.client.recreate_collection(self.collection_name, vectors_config={})
+        elif not collection_exists(self.collection_name, **self.client_kwargs):
+            self.client.create_collection(self.collection_name, vectors_config={})
+
+    def put(self, doc_id: str, metadata: dict):
+        self.client.upsert(
+            self.collection_name,
+            points=[
+                models.PointStruct(
+                    id=get_uuid(doc_id),
+                    vector={},
+                    payload={DOC_ID_KEY: doc_id, "metadata": metadata},
+                )
+            ],
+        )
+
+        with self._lock:
+            self._cache.pop(doc_id, None)
+
+    def get_many(self, doc_ids: Iterable[str]) -> Dict[str, dict]:
+        """Get the metadata of the documents, fetching the uncached ones in one request."""
+        found: Dict[str, dict] = {}
+        missing: List[str] = []
+
+        with self._lock:
+            for doc_id in dict.fromkeys(doc_ids):
+                if doc_id in self._cache:
+                    self._cache.move_to_end(doc_id)
+                    found[doc_id] = self._cache[doc_id]
+                else:
+                    missing.append(doc_id)
+
+        if missing:
+            records = self.client.retrieve(
+                self.collection_name,
+                ids=[get_uuid(doc_id) for doc_id in missing],
+                with_payload=True,
+                with_vectors=False,
+            )
+
+            with self._lock:
+                for record in records:
+                    doc_id = record.payload[DOC_ID_KEY]
+                    found[doc_id] = record.payload["metadata"]
+                    self._cache[doc_id] = found[doc_id]
+
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return found
+
+
+def get_metadata_collection_name(collection_name: str) -> str:
+    return f"{collection_name}_metadata"
+
+
+def get_metadata_store(
+    collection_name: str,
+    path: Optional[str] = None,
+    url: Optional[str] = None,
+    prefer_grpc: Optional[bool] = None,
+) -> MetadataStore:
+    """Get the metadata store of a collection, creating it on first use."""
+    key = get_client_key(path=path, url=url, prefer_grpc=prefer_grpc)
+
+    with _STORES_LOCK:
+        if (key, collection_name) not in _STORES:
+            store = MetadataStore(
+                get_metadata_collection_name(collection_name),
+                path=path,
+                url=url,
+                prefer_grpc=prefer_grpc,
+            )
+            store.create()
+            _STORES[(key, collection_name)] = store
+
+    return _STORES[(key, collection_name)]
+
+
+def join_metadata(documents: Iterable, collection_name: str, metadata_key: str, **client_kwargs):
+    """Set the document metadata of normalized chunks under `metadata_key`, in place.
+
+    Chunks that already hold their metadata are left as they are.
+    """
+    documents = [
+        doc
+        for doc in documents
+        if metadata_key not in doc.metadata and DOC_ID_KEY in doc.metadata
+    ]
+    if not documents:
+        return
+
+    metadata = get_metadata_store(collection_name, **client_kwargs).get_many(
+        doc.metadata[DOC_ID_KEY] for doc in documents
+    )
+
+    for doc in documents:
+        if doc.metadata[DOC_ID_KEY] in metadata:
+            doc.metadata[metadata_key] = metadata[doc.metadata[DOC_ID_KEY]]
@@ -0,0 +1,166 @@
+"""Declarative payload indexes of the collections.
+
+Filtered searches on fields without a payload index make Qdrant scan every
+point. The fields that are filtered on are declared here per data type, and
+the indexes are created with the collections. Existing collections can be
+brought in line with the spec with `reconcile_payload_indexes`, e.g.:
+
+    python -m llm4data.scripts.indexing.create_field_index --data_type=docs
+"""
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from qdrant_client.http import models
+from qdrant_client.local.qdrant_local import QdrantLocal
+
+logger = logging.getLogger(__name__)
+
+# The field schemas supported by the spec. `datetime` needs a Qdrant server
+# and client that support datetime indexes (>= 1.8).
+FIELD_SCHEMAS = ("keyword", "integer", "float", "bool", "datetime", "text")
+
+
+@dataclass(frozen=True)
+class PayloadIndex:
+    """A payload index on a field of the langchain document metadata.
+
+    Args:
+        field_name (str): The dotted path of the field.
+        field_schema (str): One of `FIELD_SCHEMAS`.
+        in_schema (bool): If True, the path is relative to the metadata
+            stored under `configs.METADATA_KEY`. Otherwise, it is relative
+            to the document metadata, e.g., the `page` set by the PDF loader.
+    """
+
+    field_name: str
+    field_schema: str
+    in_schema: bool = True
+
+    def __post_init__(self):
+        if self.field_schema not in FIELD_SCHEMAS:
+            raise ValueError(
+                f"Unknown field schema `{self.field_schema}`, expected one of {FIELD_SCHEMAS}"
+            )
+
+    @property
+    def key(self) -> str:
+        """The payload key of the field in the collection."""
+        if not self.in_schema:
+            return f"metadata.{self.field_name}"
+
+        from llm4data import configs
+
+        return f"metadata.{configs.METADATA_KEY}.{self.field_name}"
+
+
+PAYLOAD_INDEXES: Dict[str, List[PayloadIndex]] = {
+    "docs": [
+        PayloadIndex("document_description.title_statement.idno", "keyword"),
+        PayloadIndex("document_description.title_statement.title", "text"),
+        PayloadIndex("document_description.type", "keyword"),
+        PayloadIndex("document_description.date_published", "datetime"),
+        PayloadIndex("page", "integer", in_schema=False),
+        # The document id of the chunks in a normalized collection.
+        PayloadIndex("doc_id", "keyword", in_schema=False),
+    ],
+    "indicators": [
+        PayloadIndex("series_code", "keyword"),
+        PayloadIndex("name", "text"),
+    ],
+    "microdata": [
+        PayloadIndex("study_desc.title_statement.idno", "keyword"),
+        PayloadIndex("study_desc.title_statement.title", "text"),
+        PayloadIndex("study_desc.study_info.nation.name", "keyword"),
+    ],
+}
+
+
+def get_payload_indexes(data_type: Optional[str]) -> List[PayloadIndex]:
+    return PAYLOAD_INDEXES.get(data_type, [])
+
+
+def _supported_schemas() -> set:
+    return {schema.value for schema in models.PayloadSchemaType}
+
+
+def create_payload_index(client, collection_name: str, index: PayloadIndex, wait: bool = True) -> bool:
+    """Create a payload index, skipping schemas the installed client does not support.
+
+    Payload indexes have no effect in the local storage, so nothing is
+    created for local clients.
+
+    Returns:
+        bool: Whether the index was created.
+    """
+    if isinstance(getattr(client, "_client", None), QdrantLocal):
+        return False
+
+    if index.field_schema not in _supported_schemas():
+        logger.warning(
+            "Skipping the `%s` index on `%s`: not supported by this qdrant-client version.",
+            index.field_schema,
+            index.key,
+        )
+        return False
+
+    client.create_payload_index(
+        collection_name,
+        field_name=index.key,
+        field_schema=models.PayloadSchemaType(index.field_schema),
+        wait=wait,
+    )
+
+    return True
+
+
+def apply_payload_indexes(client, collection_name: str, data_type: Optional[str]) -> List[str]:
+    """Create all the payload indexes of the data type on a new collection.
+
+    Returns:
+        List[str]: The keys of the created indexes.
+    """
+    return [
+        index.key
+        for index in get_payload_indexes(data_type)
+        if create_payload_index(client, collection_name, index)
+    ]
+
+
+def reconcile_payload_indexes(client, collection_name: str, data_type: Optional[str], prune: bool = False) -> dict:
+    """Bring the payload indexes of an existing collection in line with the spec.
+
+    Missing indexes are created, and indexes with a different schema are
+    recreated. Indexes that are not in the spec are only deleted if `prune`.
+
+    Returns:
+        dict: The keys of the created, recreated and deleted indexes.
+    """
+    payload_schema = client.get_collection(collection_name).payload_schema or {}
+    existing = {
+        key: getattr(info.data_type, "value", info.data_type)
+        for key, info in payload_schema.items()
+    }
+
+    report: dict = dict(created=[], recreated=[], deleted=[])
+    specified = set()
+
+    for index in get_payload_indexes(data_type):
+        specified.add(index.key)
+        current = existing.get(index.key)
+
+        if current == index.field_schema:
+            continue
+
+        if current is not None:
+            client.delete_payload_index(collection_name, field_name=index.key, wait=True)
+
+        if create_payload_index(client, collection_name, index):
+            report["recreated" if current is not None else "created"].append(index.key)
+
+    if prune:
+        for key in sorted(set(existing) - specified):
+            client.delete_payload_index(collection_name, field_name=key, wait=True)
+            report["deleted"].append(key)
+
+    return report
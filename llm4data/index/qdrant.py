@@ -1,69 +1,936 @@
 import os
-from typing import Optional, Union
-from langchain_community.vectorstores import Qdrant
+import json
+import uuid
+import asyncio
+import functools
+import shutil
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Union
+import numpy as np
 import qdrant_client
 from qdrant_client.http import models
+from qdrant_client.local.qdrant_local import QdrantLocal
 
+from ..embeddings.base import EmbeddingModel
 from ..embeddings.docs import get_docs_embeddings
 from ..embeddings.indicators import get_indicators_embeddings
 from ..embeddings.microdata import get_microdata_embeddings
+from ..embeddings.sparse import SPARSE_VECTOR_NAME
+from .payload_index import apply_payload_indexes
 
-_CLIENT = None
+# Clients are pooled by location so that different paths or urls get
+# their own client. Each client keeps a cache of the collections known
+# to exist, which is updated when collections are created or recreated,
+# and of the existing collections whose config has been checked.
+ClientKey = Tuple[str, str, bool]
 
+_CLIENTS: Dict[ClientKey, qdrant_client.QdrantClient] = {}
+_ASYNC_CLIENTS: Dict[ClientKey, qdrant_client.AsyncQdrantClient] = {}
+_KNOWN_COLLECTIONS: Dict[ClientKey, Set[str]] = {}
+_CHECKED_COLLECTIONS: Dict[ClientKey, Set[str]] = {}
+_CLIENTS_LOCK = threading.Lock()
 
-def collection_exists(collection_name: str) -> bool:
-    colls = get_index_client().get_collections()
-    return collection_name in [i.name for i in colls.collections]
 
+def _env_flag(name: str, default: bool = False) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
 
-def get_index_client(path: Optional[str] = None):
-    global _CLIENT
-    if _CLIENT is None:
-        if path is not None:
-            _CLIENT = qdrant_client.QdrantClient(path=path, prefer_grpc=True)
-        else:
-            url = os.environ.get("QDRANT_URL")
-            if url is not None:
-                port = os.environ.get("QDRANT_PORT")
-                if port is not None:
-                    url += f":{port}"
-                _CLIENT = qdrant_client.QdrantClient(url=url, prefer_grpc=False)
-            else:
-                path = os.environ.get("QDRANT_PATH")
-                if path is not None:
-                    _CLIENT = qdrant_client.QdrantClient(path=path, prefer_grpc=True)
-                else:
-                    raise ValueError("QDRANT_URL or QDRANT_PATH not set in the environment")
+    return value.strip().lower() in ("1", "true", "yes")
+
+
+def get_client_key(
+    path: Optional[str] = None,
+    url: Optional[str] = None,
+    prefer_grpc: Optional[bool] = None,
+) -> ClientKey:
+    """Resolve the location of the Qdrant client from the arguments or the environment.
+
+    An explicit `path` or `url` takes precedence over the `QDRANT_URL`,
+    `QDRANT_PORT` and `QDRANT_PATH` environment variables. For url-based
+    clients, gRPC is used if `prefer_grpc` is True or, when it is None, if
+    the `QDRANT_PREFER_GRPC` environment variable is set to true.
+    """
+    if path is not None:
+        return ("path", str(path), True)
+
+    if url is None:
+        url = os.environ.get("QDRANT_URL")
+        if url is not None:
+            port = os.environ.get("QDRANT_PORT")
+            if port is not None:
+                url += f":{port}"
+
+    if url is not None:
+        if prefer_grpc is None:
+            prefer_grpc = _env_flag("QDRANT_PREFER_GRPC")
+        return ("url", url, prefer_grpc)
+
+    path = os.environ.get("QDRANT_PATH")
+    if path is not None:
+        return ("path", path, True)
+
+    raise ValueError("QDRANT_URL or QDRANT_PATH not set in the environment")
+
+
+def _create_client(key: ClientKey) -> qdrant_client.QdrantClient:
+    kind, location, prefer_grpc = key
+
+    if kind == "path":
+        return qdrant_client.QdrantClient(path=location, prefer_grpc=prefer_grpc)
+
+    return qdrant_client.QdrantClient(
+        url=location,
+        prefer_grpc=prefer_grpc,
+        grpc_port=int(os.environ.get("QDRANT_GRPC_PORT", 6334)),
+    )
 
-    return _CLIENT
 
+def get_index_client(
+    path: Optional[str] = None,
+    url: Optional[str] = None,
+    prefer_grpc: Optional[bool] = None,
+):
+    key = get_client_key(path=path, url=url, prefer_grpc=prefer_grpc)
 
-def get_index_collection(embeddings, path: Optional[str] = None, recreate: bool = False):
-    client = get_index_client(path=path)
+    with _CLIENTS_LOCK:
+        if key not in _CLIENTS:
+            _CLIENTS[key] = _create_client(key)
+            _KNOWN_COLLECTIONS.setdefault(key, set())
+            _CHECKED_COLLECTIONS.setdefault(key, set())
+
+    return _CLIENTS[key]
+
+
+def collection_exists(
+    collection_name: str,
+    path: Optional[str] = None,
+    url: Optional[str] = None,
+    prefer_grpc: Optional[bool] = None,
+) -> bool:
+    """Check if the collection exists, using the cache of known collections.
+
+    The collections are only listed from the server when the name is not
+    in the cache. Missing collections are not cached since they may be
+    created by another process.
+    """
+    key = get_client_key(path=path, url=url, prefer_grpc=prefer_grpc)
+    client = get_index_client(path=path, url=url, prefer_grpc=prefer_grpc)
+    known = _KNOWN_COLLECTIONS[key]
+
+    if collection_name in known:
+        return True
+
+    colls = client.get_collections()
+    known.update(i.name for i in colls.collections)
+
+    return collection_name in known
+
+
+def forget_collection(
+    collection_name: str,
+    path: Optional[str] = None,
+    url: Optional[str] = None,
+    prefer_grpc: Optional[bool] = None,
+):
+    """Remove a collection from the cache of known collections, e.g., after deleting it."""
+    key = get_client_key(path=path, url=url, prefer_grpc=prefer_grpc)
+    _KNOWN_COLLECTIONS.get(key, set()).discard(collection_name)
+    _CHECKED_COLLECTIONS.get(key, set()).discard(collection_name)
+
+
+def get_collection_kwargs(embeddings) -> dict:
+    """Get the arguments used to create the collection of an embedding model."""
+    config = embeddings.collection_config
+
+    return dict(
+        collection_name=embeddings.collection_name,
+        vectors_config=config.vectors_config(embeddings.size, embeddings.distance),
+        on_disk_payload=config.on_disk_payload,
+        hnsw_config=config.hnsw_config(),
+        quantization_config=config.quantization_config(),
+        sparse_vectors_config=config.sparse_vectors_config(),
+    )
+
+
+def needs_collection_check(embeddings, key: ClientKey) -> bool:
+    """Whether the config of the existing collection must be fetched for
+    `check_collection_info`, i.e., it needs sparse vectors and has not been
+    checked, created nor recreated by this process."""
+    return (
+        embeddings.collection_config.sparse_vectors
+        and embeddings.collection_name not in _CHECKED_COLLECTIONS[key]
+    )
+
+
+def check_collection_info(info: models.CollectionInfo, embeddings):
+    """Raise a ValueError if an existing collection lacks the sparse vectors
+    enabled by the collection config, which would fail every upsert."""
+    if not embeddings.collection_config.sparse_vectors:
+        return
+
+    if SPARSE_VECTOR_NAME not in (info.config.params.sparse_vectors or {}):
+        raise ValueError(
+            f"The collection `{embeddings.collection_name}` was created without the `{SPARSE_VECTOR_NAME}` "
+            "sparse vectors enabled by its `CollectionConfig(sparse_vectors=True)`. Recreate it, "
+            "e.g., with `get_index_collection(embeddings, recreate=True)`, and index it again, "
+            "or set `sparse_vectors=False` in the collection config."
+        )
+
+
+def _get_langchain_qdrant():
+    # Import langchain lazily since it is expensive to load.
+    from langchain_community.vectorstores import Qdrant
+    from langchain_core.embeddings import Embeddings
+
+    # The embedding models implement the langchain `Embeddings` interface
+    # on top of the shared model registry.
+    Embeddings.register(EmbeddingModel)
+
+    return Qdrant
+
+
+def get_index_collection(
+    embeddings,
+    path: Optional[str] = None,
+    recreate: bool = False,
+    url: Optional[str] = None,
+    prefer_grpc: Optional[bool] = None,
+):
+    Qdrant = _get_langchain_qdrant()
+
+    client_kwargs = dict(path=path, url=url, prefer_grpc=prefer_grpc)
+    client = get_index_client(**client_kwargs)
+    key = get_client_key(**client_kwargs)
+    known = _KNOWN_COLLECTIONS[key]
+    checked = _CHECKED_COLLECTIONS[key]
+
+    collection_kwargs = get_collection_kwargs(embeddings)
 
     if recreate:
-        client.recreate_collection(
-            collection_name=embeddings.collection_name,
-            vectors_config=models.VectorParams(
-                size=embeddings.size, distance=embeddings.distance
-            ),
+        client.recreate_collection(**collection_kwargs)
+        apply_payload_indexes(client, embeddings.collection_name, embeddings.data_type)
+        known.add(embeddings.collection_name)
+        checked.add(embeddings.collection_name)
+
+    if not collection_exists(embeddings.collection_name, **client_kwargs):
+        client.create_collection(**collection_kwargs)
+        apply_payload_indexes(client, embeddings.collection_name, embeddings.data_type)
+        known.add(embeddings.collection_name)
+        checked.add(embeddings.collection_name)
+    elif needs_collection_check(embeddings, key):
+        check_collection_info(client.get_collection(embeddings.collection_name), embeddings)
+        checked.add(embeddings.collection_name)
+
+    return Qdrant(
+        client=client,
+        collection_name=embeddings.collection_name,
+        embeddings=embeddings,
+    )
+
+
+def get_async_index_client(
+    path: Optional[str] = None,
+    url: Optional[str] = None,
+    prefer_grpc: Optional[bool] = None,
+):
+    """Get the pooled `AsyncQdrantClient` of a Qdrant server.
+
+    Async clients are only available for url-based locations. A local
+    storage path can only be opened by one client, which is the sync one.
+    """
+    key = get_client_key(path=path, url=url, prefer_grpc=prefer_grpc)
+    kind, location, prefer_grpc = key
+
+    if kind != "url":
+        raise ValueError(
+            f"Async clients need a Qdrant server url, got the local path {location}"
         )
 
-    if not collection_exists(embeddings.collection_name):
-        client.create_collection(
-            collection_name=embeddings.collection_name,
-            vectors_config=models.VectorParams(
-                size=embeddings.size, distance=embeddings.distance
-            ),
+    with _CLIENTS_LOCK:
+        if key not in _ASYNC_CLIENTS:
+            _ASYNC_CLIENTS[key] = qdrant_client.AsyncQdrantClient(
+                url=location,
+                prefer_grpc=prefer_grpc,
+                grpc_port=int(os.environ.get("QDRANT_GRPC_PORT", 6334)),
+            )
+            _KNOWN_COLLECTIONS.setdefault(key, set())
+            _CHECKED_COLLECTIONS.setdefault(key, set())
+
+    return _ASYNC_CLIENTS[key]
+
+
+async def acollection_exists(
+    collection_name: str,
+    path: Optional[str] = None,
+    url: Optional[str] = None,
+    prefer_grpc: Optional[bool] = None,
+) -> bool:
+    """Async variant of `collection_exists`, sharing the same cache."""
+    key = get_client_key(path=path, url=url, prefer_grpc=prefer_grpc)
+    client = get_async_index_client(path=path, url=url, prefer_grpc=prefer_grpc)
+    known = _KNOWN_COLLECTIONS[key]
+
+    if collection_name in known:
+        return True
+
+    colls = await client.get_collections()
+    known.update(i.name for i in colls.collections)
+
+    return collection_name in known
+
+
+async def aget_index_collection(
+    embeddings,
+    path: Optional[str] = None,
+    recreate: bool = False,
+    url: Optional[str] = None,
+    prefer_grpc: Optional[bool] = None,
+):
+    """Async variant of `get_index_collection`.
+
+    The returned store has an `AsyncQdrantClient` attached, so its async
+    search methods do not block the event loop. For a local storage path,
+    the store falls back to running the sync client in an executor.
+    """
+    client_kwargs = dict(path=path, url=url, prefer_grpc=prefer_grpc)
+
+    if get_client_key(**client_kwargs)[0] != "url":
+        return await asyncio.get_running_loop().run_in_executor(
+            None,
+            functools.partial(get_index_collection, embeddings, recreate=recreate, **client_kwargs),
         )
 
+    Qdrant = _get_langchain_qdrant()
+
+    async_client = get_async_index_client(**client_kwargs)
+    key = get_client_key(**client_kwargs)
+    known = _KNOWN_COLLECTIONS[key]
+    checked = _CHECKED_COLLECTIONS[key]
+
+    collection_kwargs = get_collection_kwargs(embeddings)
+
+    # The payload indexes are created with the sync client in an executor.
+    create_payload_indexes = functools.partial(
+        apply_payload_indexes,
+        get_index_client(**client_kwargs),
+        embeddings.collection_name,
+        embeddings.data_type,
+    )
+
+    if recreate:
+        await async_client.recreate_collection(**collection_kwargs)
+        await asyncio.get_running_loop().run_in_executor(None, create_payload_indexes)
+        known.add(embeddings.collection_name)
+        checked.add(embeddings.collection_name)
+
+    if not await acollection_exists(embeddings.collection_name, **client_kwargs):
+        await async_client.create_collection(**collection_kwargs)
+        await asyncio.get_running_loop().run_in_executor(None, create_payload_indexes)
+        known.add(embeddings.collection_name)
+        checked.add(embeddings.collection_name)
+    elif needs_collection_check(embeddings, key):
+        check_collection_info(await async_client.get_collection(embeddings.collection_name), embeddings)
+        checked.add(embeddings.collection_name)
+
     return Qdrant(
-        client=client,
+        client=get_index_client(**client_kwargs),
+        async_client=async_client,
         collection_name=embeddings.collection_name,
-        embeddings=embeddings.embeddings,
+        embeddings=embeddings,
+    )
+
+
+def get_point_bytes(payload: dict, vector: Sequence[float]) -> int:
+    """Estimate the size of a point sent to Qdrant."""
+    return len(json.dumps(payload, default=str).encode("utf-8")) + 4 * len(vector)
+
+
+def get_byte_batches(point_bytes: Sequence[int], max_batch_bytes: int, max_batch_size: int) -> List[Tuple[int, int]]:
+    """Split the points into (start, end) batches of at most `max_batch_bytes`.
+
+    A point larger than `max_batch_bytes` is sent in a batch of its own.
+    """
+    batches = []
+    start = 0
+    size = 0
+
+    for i, nbytes in enumerate(point_bytes):
+        if i > start and (size + nbytes > max_batch_bytes or i - start >= max_batch_size):
+            batches.append((start, i))
+            start = i
+            size = 0
+
+        size += nbytes
+
+    if start < len(point_bytes):
+        batches.append((start, len(point_bytes)))
+
+    return batches
+
+
+def add_documents_with_vectors(
+    index,
+    documents: Sequence,
+    vectors: Sequence[Sequence[float]],
+    ids: Optional[Sequence[str]] = None,
+    batch_size: int = 256,
+    max_batch_bytes: int = 4 * 1024 * 1024,
+    parallel: int = 1,
+    sparse_vectors: Optional[Sequence[models.SparseVector]] = None,
+) -> List[str]:
+    """Upsert documents with precomputed vectors into a langchain Qdrant index.
+
+    The payloads follow the layout used by the langchain Qdrant store so the
+    points can be retrieved with its search methods. Passing deterministic
+    ids, e.g., from `llm4data.utils.system.cache.get_uuid`, makes re-adding
+    the same documents overwrite the existing points instead of duplicating
+    them.
+
+    Args:
+        index: The langchain Qdrant index.
+        documents: The langchain documents to add.
+        vectors: The vectors of the documents, in the same order.
+        ids: The point ids. Random uuids are generated if not provided.
+        batch_size: The maximum number of points sent per upsert request.
+        max_batch_bytes: The maximum estimated size of an upsert request.
+        parallel: The number of upsert requests sent concurrently. Local
+            storage clients always upsert sequentially.
+        sparse_vectors: The sparse vectors of the documents, for collections
+            created with `CollectionConfig(sparse_vectors=True)`.
+    """
+    if len(documents) != len(vectors):
+        raise ValueError("`documents` and `vectors` must have the same length.")
+
+    if sparse_vectors is not None and len(sparse_vectors) != len(vectors):
+        raise ValueError("`sparse_vectors` and `vectors` must have the same length.")
+
+    if ids is None:
+        ids = [uuid.uuid4().hex for _ in documents]
+
+    payloads = [
+        {
+            index.content_payload_key: doc.page_content,
+            index.metadata_payload_key: doc.metadata,
+        }
+        for doc in documents
+    ]
+
+    point_bytes = [get_point_bytes(payload, vector) for payload, vector in zip(payloads, vectors)]
+    if sparse_vectors is not None:
+        point_bytes = [
+            nbytes + 8 * len(sparse.indices)
+            for nbytes, sparse in zip(point_bytes, sparse_vectors)
+        ]
+
+    batches = get_byte_batches(
+        point_bytes,
+        max_batch_bytes=max_batch_bytes,
+        max_batch_size=batch_size,
+    )
+
+    def get_points(start: int, end: int):
+        if sparse_vectors is None:
+            return models.Batch(
+                ids=list(ids[start:end]),
+                vectors=[list(v) for v in vectors[start:end]],
+                payloads=payloads[start:end],
+            )
+
+        # The dense vector is the unnamed one used by the langchain store.
+        return [
+            models.PointStruct(
+                id=ids[i],
+                vector={"": [float(x) for x in vectors[i]], SPARSE_VECTOR_NAME: sparse_vectors[i]},
+                payload=payloads[i],
+            )
+            for i in range(start, end)
+        ]
+
+    def upsert(batch: Tuple[int, int]):
+        index.client.upsert(
+            collection_name=index.collection_name,
+            points=get_points(*batch),
+        )
+
+    # The local storage is not safe to write from several threads.
+    if parallel > 1 and len(batches) > 1 and not isinstance(index.client._client, QdrantLocal):
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            # Consume the results to raise any upsert error.
+            list(executor.map(upsert, batches))
+    else:
+        for batch in batches:
+            upsert(batch)
+
+    return list(ids)
+
+
+def delete_points_by_payload(index, payload: Dict[str, Union[str, int]], keep_ids: Optional[Sequence[str]] = None, wait: bool = True):
+    """Delete the points of a langchain Qdrant index whose payload matches
+    all the values in `payload`, e.g., `{"metadata.doc_id": "D1"}`.
+
+    Args:
+        keep_ids: The ids of the points to keep even if they match, e.g., the
+            points just upserted for a re-indexed document, so that only its
+            stale points are deleted.
+    """
+    if not payload:
+        raise ValueError("The payload to match is empty, which would delete all the points.")
+
+    index.client.delete(
+        collection_name=index.collection_name,
+        points_selector=models.FilterSelector(
+            filter=models.Filter(
+                must=[
+                    models.FieldCondition(key=key, match=models.MatchValue(value=value))
+                    for key, value in payload.items()
+                ],
+                must_not=[models.HasIdCondition(has_id=list(keep_ids))] if keep_ids else None,
+            )
+        ),
+        wait=wait,
     )
 
 
+def reciprocal_rank_fusion(rankings: Sequence[Sequence], k: int, rrf_k: int = 60) -> List:
+    """Fuse ranked lists of scored points by summing `1 / (rrf_k + rank)` per point id."""
+    scores: Dict = {}
+    points: Dict = {}
+
+    for ranking in rankings:
+        for rank, point in enumerate(ranking):
+            scores[point.id] = scores.get(point.id, 0.0) + 1.0 / (rrf_k + rank + 1)
+            points.setdefault(point.id, point)
+
+    fused = sorted(scores, key=lambda point_id: scores[point_id], reverse=True)[:k]
+
+    return [points[point_id] for point_id in fused]
+
+
+def _get_qdrant_filter(index, filter: Optional[Union[dict, models.Filter]]) -> Optional[models.Filter]:
+    if isinstance(filter, dict):
+        return index._qdrant_filter_from_dict(filter)
+
+    return filter
+
+
+def _get_hybrid_requests(
+    index,
+    vector: Sequence[float],
+    sparse_vector: models.SparseVector,
+    limit: int,
+    filter: Optional[Union[dict, models.Filter]] = None,
+    search_params: Optional[models.SearchParams] = None,
+    pin_key: Optional[str] = None,
+    pin_values: Optional[Sequence[str]] = None,
+) -> List[models.SearchRequest]:
+    filter = _get_qdrant_filter(index, filter)
+
+    requests = [
+        models.SearchRequest(
+            vector=list(vector),
+            filter=filter,
+            params=search_params,
+            limit=limit,
+            with_payload=True,
+        ),
+        models.SearchRequest(
+            vector=models.NamedSparseVector(name=SPARSE_VECTOR_NAME, vector=sparse_vector),
+            filter=filter,
+            limit=limit,
+            with_payload=True,
+        ),
+    ]
+
+    if pin_key is not None and pin_values:
+        # The points whose keyword field equals one of the values exactly,
+        # e.g., a series code in the prompt, ranked first by the fusion.
+        pin_condition = models.FieldCondition(key=pin_key, match=models.MatchAny(any=list(pin_values)))
+        requests.append(
+            models.SearchRequest(
+                vector=list(vector),
+                filter=models.Filter(must=[pin_condition] + ([filter] if filter is not None else [])),
+                limit=len(pin_values),
+                with_payload=True,
+            )
+        )
+
+    return requests
+
+
+def _to_documents(index, points: Sequence[models.ScoredPoint]) -> List:
+    return [
+        index._document_from_scored_point(
+            point,
+            index.collection_name,
+            index.content_payload_key,
+            index.metadata_payload_key,
+        )
+        for point in points
+    ]
+
+
+def _fuse_hybrid_results(index, results: List[List[models.ScoredPoint]], k: int, group_sizes: Sequence[int]) -> List[List]:
+    """Fuse the results of the hybrid requests of each query, grouped by
+    `group_sizes`: the dense and the sparse search, then the optional pinned
+    search, whose points are placed first."""
+    fused = []
+    start = 0
+
+    for size in group_sizes:
+        group = results[start : start + size]
+        start += size
+
+        pinned = group[2][:k] if size > 2 else []
+        pinned_ids = {point.id for point in pinned}
+        ranked = [
+            point
+            for point in reciprocal_rank_fusion(group[:2], k + len(pinned))
+            if point.id not in pinned_ids
+        ]
+        fused.append(_to_documents(index, (pinned + ranked)[:k]))
+
+    return fused
+
+
+def search_batch_by_vectors(
+    index,
+    vectors: Sequence[Sequence[float]],
+    k: int = 4,
+    filter: Optional[Union[dict, models.Filter]] = None,
+    search_params: Optional[models.SearchParams] = None,
+) -> List[List]:
+    """Search a collection for many query vectors in one `search_batch` request.
+
+    Returns:
+        List[List[Document]]: The documents found for each vector, as
+            returned by `similarity_search_by_vector`.
+    """
+    if isinstance(index, NumpyIndex):
+        return [index.similarity_search_by_vector(vector, k=k, filter=filter) for vector in vectors]
+
+    filter = _get_qdrant_filter(index, filter)
+    requests = [
+        models.SearchRequest(
+            vector=list(vector),
+            filter=filter,
+            params=search_params,
+            limit=k,
+            with_payload=True,
+        )
+        for vector in vectors
+    ]
+    results = index.client.search_batch(index.collection_name, requests)
+
+    return [_to_documents(index, points) for points in results]
+
+
+def hybrid_search_batch_by_vectors(
+    index,
+    vectors: Sequence[Sequence[float]],
+    sparse_vectors: Sequence[models.SparseVector],
+    k: int = 4,
+    filter: Optional[Union[dict, models.Filter]] = None,
+    search_params: Optional[models.SearchParams] = None,
+    candidates: Optional[int] = None,
+    pin_key: Optional[str] = None,
+    pin_values: Optional[Sequence[Sequence[str]]] = None,
+) -> List[List]:
+    """Batch variant of `hybrid_search_by_vector`, sending all the dense and
+    sparse searches in one `search_batch` request.
+
+    `pin_values` holds the values to pin for each query, see `hybrid_search_by_vector`.
+
+    A `NumpyIndex` has no sparse vectors, so it falls back to the dense search.
+    """
+    if isinstance(index, NumpyIndex):
+        warnings.warn(
+            f"The numpy index of `{index.collection_name}` has no sparse vectors, falling back to the dense search."
+        )
+        return search_batch_by_vectors(index, vectors, k=k, filter=filter, search_params=search_params)
+
+    requests = []
+    group_sizes = []
+    for i, (vector, sparse_vector) in enumerate(zip(vectors, sparse_vectors)):
+        group = _get_hybrid_requests(
+            index,
+            vector,
+            sparse_vector,
+            candidates or 2 * k,
+            filter,
+            search_params,
+            pin_key=pin_key,
+            pin_values=pin_values[i] if pin_values is not None else None,
+        )
+        requests.extend(group)
+        group_sizes.append(len(group))
+    results = index.client.search_batch(index.collection_name, requests)
+
+    return _fuse_hybrid_results(index, results, k, group_sizes)
+
+
+def hybrid_search_by_vector(
+    index,
+    vector: Sequence[float],
+    sparse_vector: models.SparseVector,
+    k: int = 4,
+    filter: Optional[Union[dict, models.Filter]] = None,
+    search_params: Optional[models.SearchParams] = None,
+    candidates: Optional[int] = None,
+    pin_key: Optional[str] = None,
+    pin_values: Optional[Sequence[str]] = None,
+) -> List:
+    """Search the dense and the sparse vectors of a collection in one request
+    and fuse the rankings with reciprocal rank fusion.
+
+    The fusion does not guarantee that an exact match of a code ranks first,
+    so the points whose keyword field `pin_key` equals one of `pin_values`,
+    e.g., the series codes in the prompt, are searched too and placed first.
+
+    The collection must have been created with `CollectionConfig(sparse_vectors=True)`.
+    A `NumpyIndex` falls back to the dense search, with a warning.
+
+    Args:
+        index: The langchain Qdrant index.
+        vector: The dense query vector.
+        sparse_vector: The sparse query vector, see `SparseEncoder.encode_query`.
+        k: The number of documents to return.
+        filter: A langchain metadata filter or a Qdrant filter.
+        search_params: The search params of the dense search.
+        candidates: The number of candidates from each search. Defaults to `2 * k`.
+        pin_key: The payload key of a keyword field to match exactly.
+        pin_values: The values of `pin_key` whose points are ranked first.
+    """
+    return hybrid_search_batch_by_vectors(
+        index,
+        [vector],
+        [sparse_vector],
+        k=k,
+        filter=filter,
+        search_params=search_params,
+        candidates=candidates,
+        pin_key=pin_key,
+        pin_values=[pin_values] if pin_values is not None else None,
+    )[0]
+
+
+async def ahybrid_search_by_vector(
+    index,
+    vector: Sequence[float],
+    sparse_vector: models.SparseVector,
+    k: int = 4,
+    filter: Optional[Union[dict, models.Filter]] = None,
+    search_params: Optional[models.SearchParams] = None,
+    candidates: Optional[int] = None,
+    pin_key: Optional[str] = None,
+    pin_values: Optional[Sequence[str]] = None,
+) -> List:
+    """Async variant of `hybrid_search_by_vector`."""
+    if getattr(index, "async_client", None) is None:
+        return await asyncio.get_running_loop().run_in_executor(
+            None,
+            functools.partial(
+                hybrid_search_by_vector,
+                index,
+                vector,
+                sparse_vector,
+                k=k,
+                filter=filter,
+                search_params=search_params,
+                candidates=candidates,
+                pin_key=pin_key,
+                pin_values=pin_values,
+            ),
+        )
+
+    requests = _get_hybrid_requests(
+        index,
+        vector,
+        sparse_vector,
+        candidates or 2 * k,
+        filter,
+        search_params,
+        pin_key=pin_key,
+        pin_values=pin_values,
+    )
+    results = await index.async_client.search_batch(index.collection_name, requests)
+
+    return _fuse_hybrid_results(index, results, k, [len(requests)])[0]
+
+
+def get_numpy_index_dir(collection_name: str) -> Path:
+    from llm4data.configs import dirs
+
+    return dirs.llm4data_cache_dir / "numpy_index" / collection_name
+
+
+class NumpyIndex:
+    """Brute-force, in-process index of a small collection.
+
+    The vectors are memory-mapped from a float32 or float16 matrix and the
+    payloads are held in a list, so a top-k query is one matrix product with
+    no call to Qdrant. The index is a read-only copy of a Qdrant collection,
+    written by `sync_numpy_index`, and implements the search methods of the
+    langchain Qdrant store that `get_contexts` uses.
+    """
+
+    def __init__(self, directory: Union[str, Path], embeddings):
+        directory = Path(directory)
+        meta_path = directory / "meta.json"
+        if not meta_path.exists():
+            raise ValueError(
+                f"No numpy index in {directory}, sync it with `python -m llm4data.scripts.indexing.sync_numpy_index`."
+            )
+
+        self.meta = json.loads(meta_path.read_text())
+        if self.meta["model_id"] != embeddings.model_id:
+            raise ValueError(
+                f"The numpy index in {directory} was synced for {self.meta['model_id']}, not {embeddings.model_id}. Sync it again."
+            )
+
+        self.embeddings = embeddings
+        self.collection_name = self.meta["collection_name"]
+        self.distance = self.meta["distance"]
+        self.vectors = np.load(directory / "vectors.npy", mmap_mode="r")
+
+        self.ids = []
+        self.payloads = []
+        with open(directory / "payloads.jsonl", "r") as f:
+            for line in f:
+                record = json.loads(line)
+                self.ids.append(record["id"])
+                self.payloads.append(record["payload"])
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, vector: Sequence[float], k: int = 4) -> List[Tuple[int, float]]:
+        """Get the (row, score) of the top-k points, best first."""
+        # A float32 query also upcasts a float16 matrix, so the product runs in BLAS.
+        query = np.asarray(vector, dtype=np.float32)
+
+        if self.distance == models.Distance.EUCLID:
+            # Rank by the negated squared distance, dropping the constant |q|^2.
+            scores = 2 * (self.vectors @ query) - np.einsum("ij,ij->i", self.vectors, self.vectors)
+        else:
+            if self.distance == models.Distance.COSINE:
+                # Qdrant stores normalized vectors for cosine collections.
+                query = query / max(np.linalg.norm(query), 1e-12)
+            scores = self.vectors @ query
+
+        scores = scores.astype(np.float32, copy=False)
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return [(int(i), float(scores[i])) for i in top]
+
+    def similarity_search_with_score_by_vector(self, embedding: Sequence[float], k: int = 4, filter=None, **kwargs):
+        from langchain_core.documents import Document
+
+        if filter is not None:
+            raise ValueError("The numpy index does not support filters.")
+
+        results = []
+        for row, score in self.search(embedding, k=k):
+            payload = self.payloads[row]
+            metadata = dict(payload.get("metadata") or {})
+            metadata["_id"] = self.ids[row]
+            metadata["_collection_name"] = self.collection_name
+            results.append(
+                (Document(page_content=payload.get("page_content", ""), metadata=metadata), score)
+            )
+
+        return results
+
+    def similarity_search_by_vector(self, embedding: Sequence[float], k: int = 4, filter=None, **kwargs):
+        return [
+            doc
+            for doc, _ in self.similarity_search_with_score_by_vector(
+                embedding, k=k, filter=filter
+            )
+        ]
+
+    async def asimilarity_search_by_vector(self, embedding: Sequence[float], k: int = 4, filter=None, **kwargs):
+        # The search is in-process and fast enough to run on the event loop.
+        return self.similarity_search_by_vector(embedding, k=k, filter=filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter=None, **kwargs):
+        return self.similarity_search_by_vector(
+            self.embeddings.embed_query(query), k=k, filter=filter
+        )
+
+
+def sync_numpy_index(index, dtype: str = "float32", batch_size: int = 1024, directory: Optional[Union[str, Path]] = None) -> dict:
+    """Copy the points of a Qdrant collection into a numpy index.
+
+    The files are written to a temporary directory that replaces the
+    previous index at the end, so readers never see a partial index.
+
+    Args:
+        index: The langchain Qdrant index of the collection.
+        dtype: The dtype of the vectors, float32 or float16.
+        batch_size: The number of points scrolled per request.
+        directory: Defaults to `get_numpy_index_dir(index.collection_name)`.
+    """
+    if dtype not in ("float32", "float16"):
+        raise ValueError(f"Unsupported dtype `{dtype}`, expected float32 or float16.")
+
+    directory = Path(directory or get_numpy_index_dir(index.collection_name))
+    tmp_dir = directory.with_name(directory.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    vectors = []
+    offset = None
+
+    with open(tmp_dir / "payloads.jsonl", "w") as f:
+        while True:
+            records, offset = index.client.scroll(
+                index.collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+
+            for record in records:
+                vector = record.vector
+                if isinstance(vector, dict):
+                    vector = vector[""]
+                vectors.append(np.asarray(vector, dtype=dtype))
+                f.write(json.dumps(dict(id=record.id, payload=record.payload), default=str) + "\n")
+
+            if offset is None:
+                break
+
+    embeddings = index.embeddings
+    matrix = np.stack(vectors) if vectors else np.zeros((0, embeddings.size), dtype=dtype)
+    np.save(tmp_dir / "vectors.npy", matrix)
+
+    meta = dict(
+        collection_name=index.collection_name,
+        model_id=embeddings.model_id,
+        distance=getattr(embeddings.distance, "value", embeddings.distance),
+        dtype=dtype,
+        count=len(vectors),
+        synced_at=datetime.now().isoformat(),
+    )
+    (tmp_dir / "meta.json").write_text(json.dumps(meta, indent=2))
+
+    shutil.rmtree(directory, ignore_errors=True)
+    tmp_dir.rename(directory)
+
+    return meta
+
+
 def get_docs_index(path: Optional[str] = None, recreate: bool = False):
     return get_index_collection(get_docs_embeddings(), path=path, recreate=recreate)
 
@@ -78,3 +945,16 @@ def get_microdata_index(path: Optional[str] = None, recreate: bool = False):
     return get_index_collection(
         get_microdata_embeddings(), path=path, recreate=recreate
     )
+
+
+def get_numpy_index(data_type: str, directory: Optional[Union[str, Path]] = None) -> NumpyIndex:
+    """Load the numpy index of a data type synced with `sync_numpy_index`."""
+    embeddings = {
+        "docs": get_docs_embeddings,
+        "indicators": get_indicators_embeddings,
+        "microdata": get_microdata_embeddings,
+    }[data_type]()
+
+    return NumpyIndex(
+        directory or get_numpy_index_dir(embeddings.collection_name), embeddings
+    )
@@ -0,0 +1,145 @@
+"""Lazily initialised registry of the vector index collections.
+
+Modules that need an index get it from the registry instead of creating it
+at import time. The embedding model and the Qdrant client are only loaded
+the first time an index is requested, and are then shared by all callers.
+
+The data types listed in the `LLM4DATA_NUMPY_INDEXES` environment variable,
+e.g., `indicators`, are served from an in-process `NumpyIndex` synced from
+Qdrant instead of the Qdrant collection.
+"""
+import os
+import asyncio
+import threading
+from typing import Callable, Dict, Optional, Sequence
+
+from ..embeddings.docs import get_docs_embeddings
+from ..embeddings.indicators import get_indicators_embeddings
+from ..embeddings.microdata import get_microdata_embeddings
+from .qdrant import (
+    aget_index_collection,
+    get_docs_index,
+    get_indicators_index,
+    get_microdata_index,
+    get_numpy_index,
+)
+
+INDEX_REGISTRY: Optional["IndexRegistry"] = None
+
+
+class IndexRegistry:
+    factories: Dict[str, Callable] = {
+        "docs": get_docs_index,
+        "indicators": get_indicators_index,
+        "microdata": get_microdata_index,
+    }
+    embeddings_factories: Dict[str, Callable] = {
+        "docs": get_docs_embeddings,
+        "indicators": get_indicators_embeddings,
+        "microdata": get_microdata_embeddings,
+    }
+
+    def __init__(self, path: Optional[str] = None, numpy_data_types: Optional[Sequence[str]] = None):
+        self.path = path
+
+        if numpy_data_types is None:
+            numpy_data_types = [
+                i.strip()
+                for i in os.getenv("LLM4DATA_NUMPY_INDEXES", "").split(",")
+                if i.strip()
+            ]
+        self.numpy_data_types = set(numpy_data_types)
+
+        self._indexes: dict = {}
+        self._lock = threading.Lock()
+        self._async_indexes: dict = {}
+        self._async_lock: Optional[asyncio.Lock] = None
+
+    def get(self, data_type: str, recreate: bool = False):
+        """Get the index for the data type, creating it on first use.
+
+        Args:
+            data_type (str): One of the keys in `IndexRegistry.factories`.
+            recreate (bool): If True, recreate the underlying collection.
+        """
+        if data_type not in self.factories:
+            raise ValueError(
+                f"Unknown data type `{data_type}`, expected one of {list(self.factories)}"
+            )
+
+        with self._lock:
+            if recreate or data_type not in self._indexes:
+                self._indexes[data_type] = self._create(data_type, recreate)
+
+        return self._indexes[data_type]
+
+    def _create(self, data_type: str, recreate: bool = False):
+        if data_type not in self.numpy_data_types:
+            return self.factories[data_type](path=self.path, recreate=recreate)
+
+        if recreate:
+            raise ValueError(
+                f"The `{data_type}` numpy index is read-only. Recreate the Qdrant collection and sync the index instead."
+            )
+
+        return get_numpy_index(data_type)
+
+    async def aget(self, data_type: str):
+        """Async variant of `get`, returning an index with an async Qdrant client.
+
+        The embedding model is loaded in an executor so that the event
+        loop is not blocked while the model loads.
+        """
+        if data_type not in self.embeddings_factories:
+            raise ValueError(
+                f"Unknown data type `{data_type}`, expected one of {list(self.embeddings_factories)}"
+            )
+
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+
+        async with self._async_lock:
+            if data_type in self.numpy_data_types:
+                # The numpy index has no client, so the sync one is shared.
+                if data_type not in self._async_indexes:
+                    self._async_indexes[data_type] = await asyncio.get_running_loop().run_in_executor(
+                        None, self.get, data_type
+                    )
+            elif data_type not in self._async_indexes:
+                embeddings = await asyncio.get_running_loop().run_in_executor(
+                    None, self.embeddings_factories[data_type]
+                )
+                self._async_indexes[data_type] = await aget_index_collection(
+                    embeddings, path=self.path
+                )
+
+        return self._async_indexes[data_type]
+
+    def is_loaded(self, data_type: str) -> bool:
+        return data_type in self._indexes
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+            self._async_indexes.clear()
+
+    @property
+    def docs(self):
+        return self.get("docs")
+
+    @property
+    def indicators(self):
+        return self.get("indicators")
+
+    @property
+    def microdata(self):
+        return self.get("microdata")
+
+
+def get_index_registry() -> IndexRegistry:
+    global INDEX_REGISTRY
+
+    if INDEX_REGISTRY is None:
+        INDEX_REGISTRY = IndexRegistry()
+
+    return INDEX_REGISTRY
@@ -1,12 +1,22 @@
 import json
-from llm4data.index import get_docs_index, get_indicators_index
+import asyncio
+from typing import List
+from llm4data.index import get_index_registry
+from llm4data.index.metadata_store import DOC_ID_KEY, join_metadata
+from llm4data.embeddings.query_cache import get_query_cache
+from llm4data.embeddings.sparse import get_code_terms, get_sparse_encoder
+from llm4data.index.qdrant import (
+    ahybrid_search_by_vector,
+    hybrid_search_batch_by_vectors,
+    hybrid_search_by_vector,
+    search_batch_by_vectors,
+)
 from llm4data import configs
 from hashlib import md5
 from llm4data.schema.schema2info import get_doc_id, get_doc_title, get_doc_authors
 from langchain.docstore.document import Document
+from qdrant_client.http import models
 
-indicators = get_indicators_index()
-docs = get_docs_index()
 
 def get_hash_id(text: str):
     return md5(text.encode("utf-8")).hexdigest()
@@ -23,14 +33,134 @@ def get_page(doc: Document, offset=0, default=-1):
 
 
 
-def get_contexts(prompt: str, k_docs: int = 5, k_indicators: int = 10, doc_id: str = None):
+def get_docs_filter(doc_id: str = None, normalized: bool = False):
+    if doc_id is None:
+        return None
+
+    if normalized:
+        # A collection switched to the normalized layout may still hold
+        # chunks indexed with their metadata, so match either layout.
+        return models.Filter(
+            should=[
+                models.FieldCondition(key=f"metadata.{DOC_ID_KEY}", match=models.MatchValue(value=doc_id)),
+                models.FieldCondition(
+                    key=f"metadata.{configs.METADATA_KEY}.document_description.title_statement.idno",
+                    match=models.MatchValue(value=doc_id),
+                ),
+            ]
+        )
+
+    return {configs.METADATA_KEY: {"document_description": {"title_statement": {"idno": doc_id}}}}
+
+
+def join_docs_metadata(docs, docs_result: list):
+    """Join the document metadata into the chunks of a normalized docs collection."""
+    if docs.embeddings.collection_config.normalize_metadata:
+        join_metadata(docs_result, docs.collection_name, configs.METADATA_KEY, path=get_index_registry().path)
+
+
+# "hybrid" fuses the dense search with a sparse lexical search, so that
+# series codes and exact indicator names in the prompt are matched.
+SEARCH_MODES = ("dense", "hybrid")
+
+
+# The hybrid search ranks the indicators whose series code is in the prompt first.
+SERIES_CODE_KEY = f"metadata.{configs.METADATA_KEY}.series_code"
+
+
+def check_search_mode(mode: str):
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode `{mode}`, expected one of {SEARCH_MODES}")
+
+
+def get_contexts(prompt: str, k_docs: int = 5, k_indicators: int = 10, doc_id: str = None, indicators_mode: str = "dense"):
+    check_search_mode(indicators_mode)
+
+    # The indexes are created on first use and shared across calls.
+    registry = get_index_registry()
+    docs = registry.docs
+    indicators = registry.indicators
+
+    # Embed the prompt once per model. The query vectors are cached, so
+    # collections sharing the same model reuse the same vector.
+    docs_vector = docs.embeddings.embed_query(prompt)
+    indicators_vector = indicators.embeddings.embed_query(prompt)
+
+    # Rescore quantized candidates if the collection config asks for it.
+    docs_search_params = docs.embeddings.collection_config.search_params()
+    indicators_search_params = indicators.embeddings.collection_config.search_params()
+
     # Search for documents
-    if doc_id is not None:
-        docs_result = docs.similarity_search(prompt, k=k_docs, filter={configs.METADATA_KEY: {"document_description": {"title_statement": {"idno": doc_id}}}})
+    docs_result = docs.similarity_search_by_vector(docs_vector, k=k_docs, filter=get_docs_filter(doc_id, docs.embeddings.collection_config.normalize_metadata), search_params=docs_search_params)
+    join_docs_metadata(docs, docs_result)
+    if indicators_mode == "hybrid":
+        indicators_result = hybrid_search_by_vector(indicators, indicators_vector, get_sparse_encoder().encode_query(prompt), k=k_indicators, search_params=indicators_search_params, pin_key=SERIES_CODE_KEY, pin_values=get_code_terms(prompt))
     else:
-        docs_result = docs.similarity_search(prompt, k=k_docs)
-    indicators_result = indicators.similarity_search(prompt, k=k_indicators)
+        indicators_result = indicators.similarity_search_by_vector(indicators_vector, k=k_indicators, search_params=indicators_search_params)
+
+    return build_contexts(docs_result, indicators_result)
+
+
+def get_contexts_batch(prompts: List[str], k_docs: int = 5, k_indicators: int = 10, doc_id: str = None, indicators_mode: str = "dense") -> List[dict]:
+    """Batch variant of `get_contexts` for many prompts.
+
+    The prompts are embedded in one batched call per model, and the docs
+    and the indicators are each searched with one `search_batch` request.
+    The contexts are returned in the order of the prompts.
+    """
+    check_search_mode(indicators_mode)
 
+    registry = get_index_registry()
+    docs = registry.docs
+    indicators = registry.indicators
+
+    docs_vectors = docs.embeddings.embed_queries(prompts)
+    indicators_vectors = indicators.embeddings.embed_queries(prompts)
+
+    docs_results = search_batch_by_vectors(docs, docs_vectors, k=k_docs, filter=get_docs_filter(doc_id, docs.embeddings.collection_config.normalize_metadata), search_params=docs.embeddings.collection_config.search_params())
+    # One metadata lookup for the chunks of all the prompts.
+    join_docs_metadata(docs, [doc for docs_result in docs_results for doc in docs_result])
+
+    indicators_search_params = indicators.embeddings.collection_config.search_params()
+    if indicators_mode == "hybrid":
+        sparse_vectors = [get_sparse_encoder().encode_query(prompt) for prompt in prompts]
+        indicators_results = hybrid_search_batch_by_vectors(indicators, indicators_vectors, sparse_vectors, k=k_indicators, search_params=indicators_search_params, pin_key=SERIES_CODE_KEY, pin_values=[get_code_terms(prompt) for prompt in prompts])
+    else:
+        indicators_results = search_batch_by_vectors(indicators, indicators_vectors, k=k_indicators, search_params=indicators_search_params)
+
+    return [
+        build_contexts(docs_result, indicators_result)
+        for docs_result, indicators_result in zip(docs_results, indicators_results)
+    ]
+
+
+async def aget_contexts(prompt: str, k_docs: int = 5, k_indicators: int = 10, doc_id: str = None, indicators_mode: str = "dense"):
+    """Async variant of `get_contexts` that searches the docs and indicators concurrently."""
+    check_search_mode(indicators_mode)
+
+    registry = get_index_registry()
+    docs, indicators = await asyncio.gather(registry.aget("docs"), registry.aget("indicators"))
+
+    # The second call is a query cache hit when both use the same model.
+    docs_vector = await docs.embeddings.aembed_query(prompt)
+    indicators_vector = await indicators.embeddings.aembed_query(prompt)
+
+    indicators_search_params = indicators.embeddings.collection_config.search_params()
+    if indicators_mode == "hybrid":
+        indicators_search = ahybrid_search_by_vector(indicators, indicators_vector, get_sparse_encoder().encode_query(prompt), k=k_indicators, search_params=indicators_search_params, pin_key=SERIES_CODE_KEY, pin_values=get_code_terms(prompt))
+    else:
+        indicators_search = indicators.asimilarity_search_by_vector(indicators_vector, k=k_indicators, search_params=indicators_search_params)
+
+    docs_result, indicators_result = await asyncio.gather(
+        docs.asimilarity_search_by_vector(docs_vector, k=k_docs, filter=get_docs_filter(doc_id, docs.embeddings.collection_config.normalize_metadata), search_params=docs.embeddings.collection_config.search_params()),
+        indicators_search,
+    )
+    await asyncio.get_running_loop().run_in_executor(None, join_docs_metadata, docs, docs_result)
+
+    return build_contexts(docs_result, indicators_result)
+
+
+def build_contexts(docs_result: list, indicators_result: list):
     doc_context = []
     indicators_context = []
 
@@ -38,11 +168,18 @@ def get_contexts(prompt: str, k_docs: int = 5, k_indicators: int = 10, doc_id: s
     indicators_context_records = []
 
     for doc in docs_result:
-        doc_id = get_doc_id(doc.metadata[configs.METADATA_KEY])
-        doc_context.append("<h1>Title: " + get_doc_title(doc.metadata[configs.METADATA_KEY]) + "</h1>")
+        metadata = doc.metadata.get(configs.METADATA_KEY)
+
+        if metadata:
+            doc_id = get_doc_id(metadata)
+            doc_context.append("<h1>Title: " + get_doc_title(metadata) + "</h1>")
 
-        if doc.metadata[configs.METADATA_KEY].get("authors"):
-            doc_context.append("<h1>Author: " + json.dumps(get_doc_authors(doc.metadata[configs.METADATA_KEY])) + "</h1>")
+            if metadata.get("authors"):
+                doc_context.append("<h1>Author: " + json.dumps(get_doc_authors(metadata)) + "</h1>")
+        else:
+            # A document indexed without metadata, or whose metadata is
+            # missing from the metadata store of a normalized collection.
+            doc_id = doc.metadata.get(DOC_ID_KEY)
 
         if doc_id is not None:
             doc_context.append(f"<p>(id: {doc_id}) (page: {get_page(doc, offset=1)}) {doc.page_content}</p>")
@@ -67,3 +204,8 @@ def get_contexts(prompt: str, k_docs: int = 5, k_indicators: int = 10, doc_id: s
         doc_context_records=doc_context_records,
         indicators_context_records=indicators_context_records,
     )
+
+
+def get_query_cache_stats() -> dict:
+    """Get the hit-rate stats of the query embedding cache."""
+    return get_query_cache().stats()
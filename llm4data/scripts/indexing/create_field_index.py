@@ -1,46 +1,84 @@
-from llm4data.index import get_docs_index
-from llm4data import configs
+from typing import Optional
+from llm4data.index import get_index_registry
+from llm4data.index.payload_index import (
+    PayloadIndex,
+    create_payload_index,
+    reconcile_payload_indexes,
+)
 import fire
 
 
-def create_doc_index(field_name: str, field_schema: str):
+def create_field_index(data_type: str, field_name: str, field_schema: str, in_schema: bool = True):
     """
-    Create a field index for the docs collection.
+    Create a field index on the collection of a data type.
 
     Args:
-        field_name (str): The name of the field to index.
+        data_type (str): One of docs, indicators or microdata.
+        field_name (str): The dotted path of the field to index.
         field_schema (str): The schema of the field to index.
+        in_schema (bool): If True, the field is relative to the llm4data metadata.
 
     Returns:
-        dict: The response from the Qdrant server.
+        bool: Whether the index was created.
+
+    Examples:
+        >>> from llm4data.scripts.indexing.create_field_index import create_field_index
+        >>> create_field_index("docs", "document_description.title_statement.idno", "keyword")
+    """
+    index = get_index_registry().get(data_type)
+
+    return create_payload_index(
+        index.client,
+        index.collection_name,
+        PayloadIndex(field_name, field_schema, in_schema=in_schema),
+    )
+
+
+def create_doc_index(field_name: str, field_schema: str):
+    """
+    Create a field index for the docs collection.
 
     Examples:
         >>> from llm4data.scripts.indexing.create_field_index import create_doc_index
-        >>> from llm4data import configs
         >>> create_doc_index("document_description.title_statement.idno", "keyword")
     """
+    return create_field_index("docs", field_name, field_schema)
 
-    # Check that the field name starts with "document_description." since that is the
-    # expected metadata key for the docs schema.
-    assert field_name.startswith("document_description."), f"Field name must start with 'document_description.' but got {field_name}"
-    doc_index = get_docs_index()
 
-    indexed = doc_index.client.create_payload_index(
-        doc_index.collection_name,
-        field_name=f"metadata.{configs.METADATA_KEY}.{field_name}",
-        field_schema=field_schema,
-    )
+def reconcile_field_indexes(data_type: str, prune: bool = False):
+    """
+    Bring the payload indexes of an existing collection in line with the ones
+    declared in `llm4data.index.payload_index`.
+
+    The missing indexes are created. The indexes whose schema differs from
+    the declared one, e.g., `keyword` instead of `text`, are dropped and
+    recreated, so the field is not indexed until the new index is built.
+
+    Args:
+        data_type (str): One of docs, indicators or microdata.
+        prune (bool): If True, delete the indexes that are not declared.
 
-    return indexed
+    Returns:
+        dict: The keys of the created, recreated and deleted indexes.
+    """
+    index = get_index_registry().get(data_type)
+
+    return reconcile_payload_indexes(
+        index.client, index.collection_name, data_type, prune=prune
+    )
 
 
-def main(data_type: str, field_name: str, field_schema: str):
-    if data_type == "docs":
-        create_doc_index(field_name, field_schema)
+def main(data_type: str, field_name: Optional[str] = None, field_schema: Optional[str] = None, in_schema: bool = True, prune: bool = False):
+    # Without a field name, the declared payload indexes of the data type are reconciled.
+    if field_name is None:
+        print(reconcile_field_indexes(data_type, prune=prune))
     else:
-        raise ValueError(f"Unknown data type {data_type}")
+        assert field_schema is not None, "A field schema is required with a field name."
+        create_field_index(data_type, field_name, field_schema, in_schema=in_schema)
 
 
 if __name__ == "__main__":
+    # python -m llm4data.scripts.indexing.create_field_index --data_type=docs
+    # python -m llm4data.scripts.indexing.create_field_index --data_type=indicators --prune
     # python -m llm4data.scripts.indexing.create_field_index --data_type=docs --field_name="document_description.title_statement.idno" --field_schema=keyword
     fire.Fire(main)
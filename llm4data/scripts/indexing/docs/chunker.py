@@ -0,0 +1,140 @@
+"""Single-pass token chunker for documents.
+
+`TokenChunker` tokenizes each page once with a fast tokenizer, and cuts the
+chunks directly in token space, using the offset mapping of the tokens to
+slice the text of each chunk from the page. This avoids the repeated
+tokenization of candidate pieces done by
+`RecursiveCharacterTextSplitter.from_huggingface_tokenizer`.
+
+The token ids of each chunk are kept in the chunk metadata under
+`TOKEN_IDS_KEY`, so that the embedding stage does not tokenize the chunks
+again. They are removed from the metadata before the chunks are indexed, see
+`pop_token_ids`.
+"""
+from typing import List, Optional, Tuple
+
+from langchain.docstore.document import Document
+
+# The metadata key of the token ids of a chunk, without special tokens.
+TOKEN_IDS_KEY = "_token_ids"
+
+
+class TokenChunker:
+    def __init__(self, tokenizer, max_tokens: int, chunk_overlap: int = 32, boundary_lookback: Optional[int] = None):
+        """
+        Args:
+            tokenizer: A fast huggingface tokenizer, which provides the offset mapping.
+            max_tokens: The maximum number of tokens of a chunk, without special tokens.
+            chunk_overlap: The minimum number of tokens shared by consecutive chunks.
+            boundary_lookback: The number of tokens a chunk may be shortened
+                by to end at a word boundary. Defaults to an eighth of `max_tokens`.
+        """
+        if not getattr(tokenizer, "is_fast", False):
+            raise ValueError("The token chunker needs a fast tokenizer for the offset mapping.")
+
+        if not 0 <= chunk_overlap < max_tokens:
+            raise ValueError(
+                f"The chunk overlap ({chunk_overlap}) must be smaller than max_tokens ({max_tokens})."
+            )
+
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.chunk_overlap = chunk_overlap
+        self.boundary_lookback = max_tokens // 8 if boundary_lookback is None else boundary_lookback
+
+    @staticmethod
+    def _starts_word(offsets: List[Tuple[int, int]], text: str, i: int) -> bool:
+        """Whether the i-th token starts a word, i.e., is not a subword continuation."""
+        if i == 0:
+            return True
+
+        previous_end, start = offsets[i - 1][1], offsets[i][0]
+        return start > previous_end or text[start].isspace()
+
+    def _spans(self, offsets: List[Tuple[int, int]], text: str) -> List[Tuple[int, int]]:
+        """Get the [start, end) token spans of the chunks."""
+        n_tokens = len(offsets)
+        spans = []
+        start = 0
+
+        while start < n_tokens:
+            end = min(start + self.max_tokens, n_tokens)
+
+            if end < n_tokens:
+                # End the chunk before a token that starts a word,
+                # rather than in the middle of a word.
+                lowest = max(end - self.boundary_lookback, start + self.chunk_overlap + 1)
+                for cut in range(end, lowest - 1, -1):
+                    if self._starts_word(offsets, text, cut):
+                        end = cut
+                        break
+
+            spans.append((start, end))
+
+            if end == n_tokens:
+                break
+
+            # Start the next chunk at a word too, extending the overlap.
+            next_start = end - self.chunk_overlap
+            for cut in range(next_start, max(next_start - self.boundary_lookback, start + 1) - 1, -1):
+                if self._starts_word(offsets, text, cut):
+                    next_start = cut
+                    break
+
+            start = next_start
+
+        return spans
+
+    def split_text_with_ids(self, text: str) -> List[Tuple[str, List[int]]]:
+        """Split a text into chunks, returned with their token ids."""
+        encoding = self.tokenizer(
+            text,
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+            verbose=False,
+        )
+        input_ids = encoding["input_ids"]
+        offsets = encoding["offset_mapping"]
+
+        chunks = []
+        for start, end in self._spans(offsets, text):
+            chunk = text[offsets[start][0] : offsets[end - 1][1]].strip()
+            if chunk:
+                chunks.append((chunk, input_ids[start:end]))
+
+        return chunks
+
+    def split_text(self, text: str) -> List[str]:
+        return [chunk for chunk, _ in self.split_text_with_ids(text)]
+
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        """Split the documents, e.g., the pages of a PDF, keeping their metadata.
+
+        This has the interface of the langchain text splitters, so it can be
+        passed to `load_and_split`.
+        """
+        chunks = []
+        for document in documents:
+            for chunk, token_ids in self.split_text_with_ids(document.page_content):
+                metadata = dict(document.metadata)
+                metadata[TOKEN_IDS_KEY] = token_ids
+                chunks.append(Document(page_content=chunk, metadata=metadata))
+
+        return chunks
+
+
+def pop_token_ids(documents: List[Document]) -> Optional[List[Optional[List[int]]]]:
+    """Remove the token ids from the metadata of the chunks.
+
+    Returns:
+        The token ids of each chunk, None for the chunks without them,
+        or None if no chunk has token ids.
+    """
+    token_ids = [doc.metadata.pop(TOKEN_IDS_KEY, None) for doc in documents]
+
+    if all(ids is None for ids in token_ids):
+        return None
+
+    return token_ids
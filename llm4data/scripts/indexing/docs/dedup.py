@@ -0,0 +1,343 @@
+"""Near-duplicate chunk suppression for the docs ingestion.
+
+Each chunk gets a MinHash signature of its word shingles, and the signatures
+are indexed with locality-sensitive hashing (LSH): the signature is cut into
+bands, and chunks that share a band bucket are candidate duplicates. A
+candidate is a duplicate if the estimated Jaccard similarity of the shingles,
+i.e., the fraction of equal MinHash values, is at least the threshold.
+
+The signatures and the band buckets of the indexed chunks are stored in a
+SQLite database, in WAL mode, so that duplicates are found across runs and
+across the whole corpus. Duplicate chunks are not embedded nor indexed. They
+are linked to the indexed chunk they duplicate, whose id is the id of its
+point in the collection, in the `duplicates` table.
+
+The signatures and links of a document are only stored by `commit`, once its
+chunks are upserted. Until then, they are pending in memory, and the chunks of
+the other documents being indexed, e.g., in the pipeline, are also compared
+with them, so that the boilerplate shared by these documents is indexed once.
+A document that fails to index is dropped with `discard`.
+
+Re-indexing a document first removes its signatures and links, so that its
+chunks are not found as duplicates of themselves. The chunks of the other
+documents that duplicated one of its removed chunks, or one of the chunks of
+a discarded document, are then left without an indexed copy:
+`get_orphaned_sources` finds their documents to re-index them.
+"""
+import hashlib
+import re
+import sqlite3
+import threading
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from langchain.docstore.document import Document
+
+# A Mersenne prime larger than the shingle hashes modulo it, small enough
+# that the permutations do not overflow 64 bits.
+_PRIME = (1 << 31) - 1
+
+WORD_PATTERN = re.compile(r"\w+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS signatures (
+    chunk_id TEXT PRIMARY KEY,
+    doc_key TEXT NOT NULL,
+    signature BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS signatures_doc_key ON signatures (doc_key);
+CREATE TABLE IF NOT EXISTS bands (
+    bucket INTEGER NOT NULL,
+    chunk_id TEXT NOT NULL,
+    doc_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bands_bucket ON bands (bucket);
+CREATE INDEX IF NOT EXISTS bands_doc_key ON bands (doc_key);
+CREATE TABLE IF NOT EXISTS duplicates (
+    chunk_id TEXT NOT NULL,
+    doc_key TEXT NOT NULL,
+    page INTEGER,
+    duplicate_of TEXT NOT NULL,
+    similarity REAL NOT NULL,
+    source TEXT,
+    PRIMARY KEY (doc_key, chunk_id)
+);
+CREATE INDEX IF NOT EXISTS duplicates_duplicate_of ON duplicates (duplicate_of);
+"""
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, _PRIME, size=(num_perm, 1)).astype(np.uint64)
+        self.b = rng.randint(0, _PRIME, size=(num_perm, 1)).astype(np.uint64)
+
+    def words(self, text: str) -> List[str]:
+        return WORD_PATTERN.findall(text.lower())
+
+    def shingle_hashes(self, words: Sequence[str]) -> np.ndarray:
+        k = self.shingle_size
+        shingles = {" ".join(words[i : i + k]) for i in range(max(1, len(words) - k + 1))}
+
+        return np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) % _PRIME for shingle in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+
+    def signature(self, words: Sequence[str]) -> np.ndarray:
+        """Get the MinHash signature of the word shingles, as `num_perm` uint32 values."""
+        hashes = self.shingle_hashes(words)[None, :]
+        permuted = (self.a * hashes + self.b) % _PRIME
+
+        return permuted.min(axis=1).astype(np.uint32)
+
+
+def get_similarity(signature: np.ndarray, other: np.ndarray) -> float:
+    """Estimate the Jaccard similarity of the shingles from their signatures."""
+    return float(np.mean(signature == other))
+
+
+class DuplicateDetector:
+    def __init__(
+        self,
+        path: Union[str, Path],
+        threshold: float = 0.85,
+        num_perm: int = 128,
+        bands: int = 16,
+        shingle_size: int = 5,
+        min_words: int = 10,
+        timeout: float = 60.0,
+    ):
+        """
+        Args:
+            path: The path of the SQLite signature store.
+            threshold: The minimum estimated Jaccard similarity of duplicates.
+            num_perm: The number of MinHash permutations.
+            bands: The number of LSH bands, which must divide `num_perm`.
+                More bands find candidates of lower similarity.
+            shingle_size: The number of words per shingle.
+            min_words: Chunks with fewer words, e.g., titles, are never duplicates.
+        """
+        if num_perm % bands:
+            raise ValueError(f"The number of bands ({bands}) must divide num_perm ({num_perm}).")
+
+        self.path = Path(path)
+        self.threshold = threshold
+        self.bands = bands
+        self.min_words = min_words
+        self.timeout = timeout
+        self.hasher = MinHasher(num_perm=num_perm, shingle_size=shingle_size)
+
+        self._local = threading.local()
+        # The signatures and links of the documents being indexed, by doc_key,
+        # and the pending signatures by bucket.
+        self._pending: Dict[str, Dict[str, list]] = {}
+        self._pending_buckets: Dict[int, Dict[str, np.ndarray]] = {}
+        # Finding the duplicates of the chunks and adding the others to the
+        # pending or stored signatures is atomic, so that concurrent
+        # documents with the same chunks do not both index them.
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self.connection
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+
+        return conn
+
+    def get_buckets(self, signature: np.ndarray) -> List[int]:
+        """Get the LSH bucket of each band of the signature."""
+        buckets = []
+        for band, rows in enumerate(np.split(signature, self.bands)):
+            digest = hashlib.blake2b(band.to_bytes(2, "little") + rows.tobytes(), digest_size=8).digest()
+            buckets.append(int.from_bytes(digest, "little", signed=True))
+
+        return buckets
+
+    def _find_duplicate(self, conn: sqlite3.Connection, signature: np.ndarray, buckets: List[int]) -> Optional[Tuple[str, float]]:
+        placeholders = ",".join("?" * len(buckets))
+        rows = conn.execute(
+            f"SELECT chunk_id, signature FROM signatures WHERE chunk_id IN "
+            f"(SELECT chunk_id FROM bands WHERE bucket IN ({placeholders}))",
+            buckets,
+        ).fetchall()
+
+        best = None
+        for chunk_id, other in rows:
+            similarity = get_similarity(signature, np.frombuffer(other, dtype=np.uint32))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (chunk_id, similarity)
+
+        return best
+
+    def _find_pending_duplicate(self, signature: np.ndarray, buckets: List[int]) -> Optional[Tuple[str, float]]:
+        candidates: Dict[str, np.ndarray] = {}
+        for bucket in buckets:
+            candidates.update(self._pending_buckets.get(bucket, {}))
+
+        best = None
+        for chunk_id, other in candidates.items():
+            similarity = get_similarity(signature, other)
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (chunk_id, similarity)
+
+        return best
+
+    def _pop_pending(self, doc_key: str) -> Optional[Dict[str, list]]:
+        """Remove the pending signatures and links of a document. Must be called with the lock held."""
+        pending = self._pending.pop(doc_key, None)
+
+        if pending is not None:
+            for chunk_id, _, buckets in pending["signatures"]:
+                for bucket in buckets:
+                    chunks = self._pending_buckets[bucket]
+                    chunks.pop(chunk_id, None)
+                    if not chunks:
+                        del self._pending_buckets[bucket]
+
+        return pending
+
+    def filter_duplicates(self, doc_key: str, documents: List[Document], chunk_ids: List[str], source: Optional[str] = None) -> Tuple[List[Document], int]:
+        """Drop the chunks that duplicate an indexed chunk, a pending chunk of
+        a document being indexed, or a previous chunk of the document.
+
+        The kept chunks are pending until they are upserted and `commit` is
+        called, or `discard` if they are not.
+
+        Args:
+            doc_key: The key of the document.
+            documents: The chunks of the document.
+            chunk_ids: The point ids of the chunks.
+            source: The path of the document, to re-index it if the chunks
+                its duplicates are linked to are removed.
+
+        Returns:
+            The chunks to index and the number of duplicates.
+        """
+        signatures: List[Optional[np.ndarray]] = []
+        for doc in documents:
+            words = self.hasher.words(doc.page_content)
+            signatures.append(self.hasher.signature(words) if len(words) >= self.min_words else None)
+
+        kept_documents = []
+        n_duplicates = 0
+
+        with self._lock:
+            conn = self.connection
+            pending = self._pending.setdefault(doc_key, dict(signatures=[], links=[]))
+
+            for doc, chunk_id, signature in zip(documents, chunk_ids, signatures):
+                if signature is None:
+                    kept_documents.append(doc)
+                    continue
+
+                buckets = self.get_buckets(signature)
+                duplicate = self._find_duplicate(conn, signature, buckets)
+
+                pending_duplicate = self._find_pending_duplicate(signature, buckets)
+                if pending_duplicate is not None and (duplicate is None or pending_duplicate[1] > duplicate[1]):
+                    duplicate = pending_duplicate
+
+                if duplicate is not None:
+                    # A chunk with the same id is the same point, so it needs no link.
+                    if duplicate[0] != chunk_id:
+                        pending["links"].append(
+                            (chunk_id, doc_key, doc.metadata.get("page"), *duplicate, source)
+                        )
+                    n_duplicates += 1
+                    continue
+
+                pending["signatures"].append((chunk_id, signature, buckets))
+                for bucket in buckets:
+                    self._pending_buckets.setdefault(bucket, {})[chunk_id] = signature
+                kept_documents.append(doc)
+
+        return kept_documents, n_duplicates
+
+    def commit(self, doc_key: str):
+        """Store the signatures and links of the chunks filtered since the last
+        commit, once the kept chunks are upserted."""
+        with self._lock:
+            pending = self._pending.get(doc_key)
+
+            if pending is None:
+                return
+
+            conn = self.connection
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO signatures VALUES (?, ?, ?)",
+                    [(chunk_id, doc_key, signature.tobytes()) for chunk_id, signature, _ in pending["signatures"]],
+                )
+                conn.executemany(
+                    "INSERT INTO bands VALUES (?, ?, ?)",
+                    [
+                        (bucket, chunk_id, doc_key)
+                        for chunk_id, _, buckets in pending["signatures"]
+                        for bucket in buckets
+                    ],
+                )
+                conn.executemany("INSERT OR REPLACE INTO duplicates VALUES (?, ?, ?, ?, ?, ?)", pending["links"])
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+            # The chunks are now found in the store.
+            self._pop_pending(doc_key)
+
+    def discard(self, doc_key: str):
+        """Forget the chunks filtered since the last commit, e.g., if they
+        failed to index. The duplicates of other documents linked to them
+        are then found by `get_orphaned_sources`."""
+        with self._lock:
+            self._pop_pending(doc_key)
+
+    def remove_document(self, doc_key: str):
+        """Remove the signatures and the duplicate links of a document, before it is re-indexed."""
+        with self._lock:
+            self._pop_pending(doc_key)
+
+            conn = self.connection
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for table in ("bands", "signatures", "duplicates"):
+                    conn.execute(f"DELETE FROM {table} WHERE doc_key = ?", (doc_key,))
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def get_orphaned_sources(self) -> List[str]:
+        """Get the documents with duplicates of chunks that are not indexed,
+        e.g., removed from a changed document or discarded. Re-indexing them
+        indexes these chunks, or links them to another copy."""
+        rows = self.connection.execute(
+            "SELECT DISTINCT source FROM duplicates WHERE source IS NOT NULL "
+            "AND duplicate_of NOT IN (SELECT chunk_id FROM signatures) ORDER BY source"
+        )
+        return [source for source, in rows]
+
+    def get_duplicates(self, doc_key: str) -> List[Dict]:
+        """Get the chunks of a document that were not indexed, with the chunk they duplicate."""
+        cursor = self.connection.execute(
+            "SELECT chunk_id, page, duplicate_of, similarity FROM duplicates WHERE doc_key = ?",
+            (doc_key,),
+        )
+        return [dict(zip([c[0] for c in cursor.description], row)) for row in cursor]
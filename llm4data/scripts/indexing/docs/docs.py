@@ -1,4 +1,9 @@
-from typing import Optional, Union
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple, Union
 from pathlib import Path
 from langchain.docstore.document import Document
 from langchain_community.document_loaders import PyMuPDFLoader
@@ -9,45 +14,448 @@ from langchain.text_splitter import (
 )
 
 from llm4data.embeddings.docs import get_docs_embeddings
-from llm4data import index
+from llm4data.index import get_index_registry
+from llm4data.index.metadata_store import DOC_ID_KEY, get_metadata_store
+from llm4data.index.qdrant import add_documents_with_vectors
 from llm4data import configs
-from llm4data.schema.schema2info import get_doc_title
+from llm4data.schema.schema2info import get_doc_id, get_doc_title
+from llm4data.utils.system.cache import get_uuid
+from .chunker import TOKEN_IDS_KEY, TokenChunker, pop_token_ids
+from .dedup import DuplicateDetector
 
-# Get the docs embeddings
-docs_embeddings = get_docs_embeddings()
+chunk_overlap = 32
 
-# Get access to the Qdrant docs collection
-docs_index = index.get_docs_index()
+# `recursive` for the langchain recursive splitter, or `token` for the
+# single-pass `TokenChunker`.
+CHUNKERS = ("recursive", "token")
 
-chunk_overlap = 32
-chunk_size = docs_embeddings.max_tokens + chunk_overlap
+TEXT_SPLITTER: Optional[Union[RecursiveCharacterTextSplitter, TokenChunker]] = None
+
+
+def get_chunker_name() -> str:
+    chunker = os.getenv("LLM4DATA_DOCS_CHUNKER", "recursive") or "recursive"
+
+    if chunker not in CHUNKERS:
+        raise ValueError(f"Unknown docs chunker `{chunker}`, expected one of {CHUNKERS}")
+
+    return chunker
+
+
+def build_text_splitter(tokenizer, chunk_size: int, chunk_overlap: int, chunker: str = "recursive"):
+    if chunker == "token":
+        return TokenChunker(tokenizer, max_tokens=chunk_size, chunk_overlap=chunk_overlap)
+
+    return RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        tokenizer,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+    )
+
+
+def get_text_splitter():
+    """Create the text splitter on first use since it needs the
+    tokenizer of the docs embedding model."""
+    global TEXT_SPLITTER
+
+    if TEXT_SPLITTER is None:
+        config = get_text_splitter_config()
+
+        # Create a text splitter
+        TEXT_SPLITTER = build_text_splitter(
+            get_docs_embeddings().embeddings.client.tokenizer,
+            chunk_size=config["chunk_size"],
+            chunk_overlap=config["chunk_overlap"],
+            chunker=config["chunker"],
+        )
+        # TEXT_SPLITTER = NLTKTextSplitter()
+
+    return TEXT_SPLITTER
+
+
+def get_chunk_ids(documents: List[Document], doc_key: str) -> List[str]:
+    """Derive the point ids of the chunks from the document key, page and text
+    so that re-indexing a document overwrites its points."""
+    return [
+        get_uuid(f"{doc_key}:{doc.metadata.get('page', -1)}:{doc.page_content}")
+        for doc in documents
+    ]
+
+
+def get_text_splitter_config() -> dict:
+    """Get the arguments of `init_text_splitter` that rebuild the text splitter,
+    e.g., in a worker process, without loading the embedding model."""
+    docs_embeddings = get_docs_embeddings()
+    tokenizer = docs_embeddings.embeddings.client.tokenizer
+    chunker = get_chunker_name()
+
+    if chunker == "token":
+        # The token chunks fit in the model input with the special tokens,
+        # so they are not truncated when encoded.
+        chunk_size = docs_embeddings.max_seq_length - tokenizer.num_special_tokens_to_add()
+    else:
+        chunk_size = docs_embeddings.max_seq_length + chunk_overlap
+
+    return dict(
+        tokenizer_name=tokenizer.name_or_path,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        chunker=chunker,
+    )
+
+
+def init_text_splitter(tokenizer_name: str, chunk_size: int, chunk_overlap: int, chunker: str = "recursive"):
+    global TEXT_SPLITTER
+
+    from transformers import AutoTokenizer
+
+    TEXT_SPLITTER = build_text_splitter(
+        AutoTokenizer.from_pretrained(tokenizer_name),
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        chunker=chunker,
+    )
 
-# Create a text splitter
-text_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
-    docs_index.embeddings.client.tokenizer,
-    chunk_size=chunk_size,
-    chunk_overlap=chunk_overlap,
-)
-# text_splitter = NLTKTextSplitter()
 
+def get_doc_key(path: Union[str, Path], metadata: Optional[dict] = None) -> str:
+    return get_doc_id(metadata) if metadata is not None else Path(path).name
 
-def add_pdf_document(path: Union[str, Path], metadata: Optional[dict] = None):
+
+def get_doc_points_filter(path: Union[str, Path], metadata: Optional[dict] = None, normalize_metadata: bool = False) -> dict:
+    """Get the payload values that select all the chunks of a document,
+    for `llm4data.index.qdrant.delete_points_by_payload`."""
+    if metadata is None:
+        # The chunks keep the metadata of the PDF loader.
+        return {"metadata.source": str(path)}
+
+    if normalize_metadata:
+        return {f"metadata.{DOC_ID_KEY}": get_doc_key(path, metadata)}
+
+    return {
+        f"metadata.{configs.METADATA_KEY}.document_description.title_statement.idno": get_doc_id(metadata)
+    }
+
+
+def apply_doc_metadata(path: Union[str, Path], documents: List[Document], metadata: Optional[dict] = None, normalize_metadata: bool = False) -> List[Document]:
+    """Set the document metadata of the chunks following the collection layout."""
+    if metadata is None:
+        return documents
+
+    if normalize_metadata:
+        # The chunks only reference the document, whose metadata is stored once.
+        doc_key = get_doc_key(path, metadata)
+        return [
+            Document(
+                page_content=doc.page_content,
+                metadata={
+                    "page": doc.metadata.get("page"),
+                    DOC_ID_KEY: doc_key,
+                    # Kept until the chunks are embedded.
+                    **({TOKEN_IDS_KEY: doc.metadata[TOKEN_IDS_KEY]} if TOKEN_IDS_KEY in doc.metadata else {}),
+                },
+            )
+            for doc in documents
+        ]
+
+    for doc in documents:
+        doc.metadata[configs.METADATA_KEY] = metadata
+
+    return documents
+
+
+def get_title_metadata(first_chunk: Document) -> dict:
+    """Get the metadata of the title chunk from the first chunk of the document."""
+    return {k: v for k, v in first_chunk.metadata.items() if k != TOKEN_IDS_KEY}
+
+
+def split_pdf_document(path: Union[str, Path], metadata: Optional[dict] = None, normalize_metadata: bool = False) -> List[Document]:
+    """Parse and split a PDF into the chunks to index.
+
+    This does not need the embedding model once the text splitter is
+    initialized, so it can run in a worker process.
+    """
     # Load the document
-    documents = PyMuPDFLoader(str(path)).load_and_split(text_splitter=text_splitter)
+    documents = PyMuPDFLoader(str(path)).load_and_split(text_splitter=get_text_splitter())
 
     # Add document metadata
-    if metadata is not None:
-        if len(documents):
-            # Index the title of the document
-            documents.append(
-                Document(page_content=get_doc_title(metadata), metadata=documents[0].metadata)
+    if metadata is not None and len(documents):
+        # Index the title of the document
+        documents.append(
+            Document(page_content=get_doc_title(metadata), metadata=get_title_metadata(documents[0]))
+        )
+
+    return apply_doc_metadata(path, documents, metadata, normalize_metadata)
+
+
+def get_pdf_page_count(path: Union[str, Path]) -> int:
+    import fitz
+
+    with fitz.open(str(path)) as pdf:
+        return len(pdf)
+
+
+def iter_pdf_pages(path: Union[str, Path], start: int = 0, end: Optional[int] = None) -> Iterator[Document]:
+    """Lazily yield the pages of a PDF in [start, end), with the same
+    content and metadata as the pages of `PyMuPDFLoader`."""
+    import fitz
+
+    with fitz.open(str(path)) as pdf:
+        pdf_metadata = {
+            k: v for k, v in pdf.metadata.items() if type(v) in [str, int]
+        }
+
+        for number in range(start, min(end or len(pdf), len(pdf))):
+            yield Document(
+                page_content=pdf[number].get_text(),
+                metadata=dict(
+                    {
+                        "source": str(path),
+                        "file_path": str(path),
+                        "page": number,
+                        "total_pages": len(pdf),
+                    },
+                    **pdf_metadata,
+                ),
             )
 
-        for doc in documents:
-            doc.metadata[configs.METADATA_KEY] = metadata
+
+def split_pdf_pages(path: Union[str, Path], start: int, end: int) -> List[Document]:
+    """Split the pages in [start, end) of a PDF. The chunks are the same as
+    the ones of `load_and_split`, since pages are split separately."""
+    return get_text_splitter().split_documents(list(iter_pdf_pages(path, start, end)))
+
+
+def get_text_splitter_pool(workers: int) -> ProcessPoolExecutor:
+    """Get a pool of processes that split PDFs with the configured text splitter.
+
+    The workers are spawned since forking a process that has loaded the
+    embedding model is not safe, so the pool should be created once and
+    shared by the documents.
+    """
+    splitter_config = get_text_splitter_config()
+
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_text_splitter,
+        initargs=(
+            splitter_config["tokenizer_name"],
+            splitter_config["chunk_size"],
+            splitter_config["chunk_overlap"],
+            splitter_config["chunker"],
+        ),
+    )
+
+
+def iter_pdf_windows(path: Union[str, Path], window_pages: int = 32, page_workers: int = 0, page_pool: Optional[ProcessPoolExecutor] = None) -> Iterator[List[Document]]:
+    """Yield the chunks of a PDF in windows of `window_pages` pages.
+
+    With `page_workers`, the windows are split in a pool of processes, with
+    at most two windows per worker in flight. The windows are yielded in
+    page order either way.
+
+    Args:
+        page_pool: The pool of `page_workers` processes, from
+            `get_text_splitter_pool`, shared by the documents. If None, a
+            pool is started for this document.
+    """
+    page_count = get_pdf_page_count(path)
+    windows = [(start, min(start + window_pages, page_count)) for start in range(0, page_count, window_pages)]
+
+    if page_workers <= 0:
+        for start, end in windows:
+            yield split_pdf_pages(path, start, end)
+        return
+
+    own_pool = page_pool is None
+    pool = get_text_splitter_pool(page_workers) if own_pool else page_pool
+    futures: deque = deque()
+
+    try:
+        for start, end in windows:
+            futures.append(pool.submit(split_pdf_pages, str(path), start, end))
+
+            if len(futures) >= 2 * page_workers:
+                yield futures.popleft().result()
+
+        while futures:
+            yield futures.popleft().result()
+    finally:
+        # Do not leave the windows of an abandoned document in a shared pool.
+        for future in futures:
+            future.cancel()
+
+        if own_pool:
+            pool.shutdown(cancel_futures=True)
+
+
+def dedup_pdf_chunks(doc_key: str, documents: List[Document], dedup: Optional[DuplicateDetector] = None, source: Optional[str] = None) -> Tuple[List[Document], int]:
+    """Drop the chunks that are near-duplicates of indexed chunks. The kept
+    chunks are recorded by `dedup.commit` once they are upserted.
+
+    Returns:
+        The chunks to index and the number of duplicates.
+    """
+    if dedup is None:
+        return documents, 0
+
+    return dedup.filter_duplicates(doc_key, documents, get_chunk_ids(documents, doc_key), source=source)
+
+
+def embed_pdf_chunks(documents: List[Document], embed_batch_size: int = 32) -> List[List[float]]:
+    # Encode all the chunks of the document at once so that chunks
+    # of similar length are batched together. The token ids of the token
+    # chunker are removed here so that they are not indexed.
+    return get_docs_embeddings().encode_batch(
+        [doc.page_content for doc in documents],
+        batch_size=embed_batch_size,
+        token_ids=pop_token_ids(documents),
+    )
+
+
+def upsert_pdf_chunks(doc_key: str, metadata: Optional[dict], documents: List[Document], vectors: List[List[float]], upload_workers: int = 1, store_metadata: bool = True) -> List[str]:
+    """Upsert the chunks of a document and return their point ids."""
+    embeddings = get_docs_embeddings()
+
+    if store_metadata and metadata is not None and embeddings.collection_config.normalize_metadata:
+        get_metadata_store(
+            embeddings.collection_name, path=get_index_registry().path
+        ).put(doc_key, metadata)
 
     # Add the document to the collection
     # Load the documens in batches
-    batch_size = 100
-    for i in range(0, len(documents), batch_size):
-        docs_index.add_documents(documents[i : i + batch_size])
+    return add_documents_with_vectors(
+        get_index_registry().docs,
+        documents,
+        vectors,
+        ids=get_chunk_ids(documents, doc_key),
+        parallel=upload_workers,
+    )
+
+
+def add_pdf_document(path: Union[str, Path], metadata: Optional[dict] = None, embed_batch_size: int = 32, upload_workers: int = 1, dedup: Optional[DuplicateDetector] = None) -> dict:
+    """Index a PDF.
+
+    Args:
+        dedup: If given, the near-duplicates of indexed chunks are not indexed.
+
+    Returns:
+        dict: The number of indexed and duplicate chunks, the duration of
+            each stage in seconds and the ids of the upserted points.
+    """
+    doc_key = get_doc_key(path, metadata)
+    durations = {}
+
+    start = time.perf_counter()
+    documents = split_pdf_document(
+        path, metadata, get_docs_embeddings().collection_config.normalize_metadata
+    )
+    durations["parse"] = time.perf_counter() - start
+
+    duplicate_count = 0
+    if dedup is not None:
+        start = time.perf_counter()
+        dedup.remove_document(doc_key)
+        documents, duplicate_count = dedup_pdf_chunks(doc_key, documents, dedup, source=str(path))
+        durations["dedup"] = time.perf_counter() - start
+
+    try:
+        start = time.perf_counter()
+        vectors = embed_pdf_chunks(documents, embed_batch_size=embed_batch_size)
+        durations["embed"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        point_ids = upsert_pdf_chunks(doc_key, metadata, documents, vectors, upload_workers=upload_workers)
+        durations["upsert"] = time.perf_counter() - start
+    except BaseException:
+        if dedup is not None:
+            dedup.discard(doc_key)
+        raise
+
+    if dedup is not None:
+        dedup.commit(doc_key)
+
+    return dict(chunk_count=len(documents), duplicate_count=duplicate_count, durations=durations, point_ids=point_ids)
+
+
+def add_pdf_document_streaming(path: Union[str, Path], metadata: Optional[dict] = None, window_pages: int = 32, page_workers: int = 0, embed_batch_size: int = 32, upload_workers: int = 1, dedup: Optional[DuplicateDetector] = None, page_pool: Optional[ProcessPoolExecutor] = None) -> dict:
+    """Index a PDF window by window, so that memory is bounded by the window
+    size rather than the size of the document.
+
+    The indexed chunks are the same as with `add_pdf_document`.
+
+    Returns:
+        dict: The number of indexed and duplicate chunks, the total duration
+            of each stage in seconds and the ids of the upserted points.
+    """
+    normalize_metadata = get_docs_embeddings().collection_config.normalize_metadata
+    doc_key = get_doc_key(path, metadata)
+    first_page_metadata = None
+    chunk_count = 0
+    duplicate_count = 0
+    durations = dict(parse=0.0, embed=0.0, upsert=0.0)
+    point_ids: List[str] = []
+
+    if dedup is not None:
+        durations["dedup"] = 0.0
+        dedup.remove_document(doc_key)
+
+    def add_chunks(documents: List[Document], store_metadata: bool) -> int:
+        nonlocal duplicate_count
+
+        if dedup is not None:
+            start = time.perf_counter()
+            documents, duplicates = dedup_pdf_chunks(doc_key, documents, dedup, source=str(path))
+            duplicate_count += duplicates
+            durations["dedup"] += time.perf_counter() - start
+
+        try:
+            start = time.perf_counter()
+            vectors = embed_pdf_chunks(documents, embed_batch_size=embed_batch_size)
+            durations["embed"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            point_ids.extend(
+                upsert_pdf_chunks(doc_key, metadata, documents, vectors, upload_workers=upload_workers, store_metadata=store_metadata)
+            )
+            durations["upsert"] += time.perf_counter() - start
+        except BaseException:
+            if dedup is not None:
+                dedup.discard(doc_key)
+            raise
+
+        if dedup is not None:
+            # The later windows are compared with the chunks of this one.
+            dedup.commit(doc_key)
+
+        return len(documents)
+
+    windows = iter_pdf_windows(path, window_pages=window_pages, page_workers=page_workers, page_pool=page_pool)
+    while True:
+        start = time.perf_counter()
+        documents = next(windows, None)
+        durations["parse"] += time.perf_counter() - start
+
+        if documents is None:
+            break
+        if not documents:
+            continue
+
+        # The document metadata is only stored with the first window.
+        store_metadata = first_page_metadata is None
+        if store_metadata:
+            first_page_metadata = get_title_metadata(documents[0])
+
+        documents = apply_doc_metadata(path, documents, metadata, normalize_metadata)
+        chunk_count += add_chunks(documents, store_metadata=store_metadata)
+
+    # Index the title of the document
+    if metadata is not None and first_page_metadata is not None:
+        documents = apply_doc_metadata(
+            path,
+            [Document(page_content=get_doc_title(metadata), metadata=first_page_metadata)],
+            metadata,
+            normalize_metadata,
+        )
+        chunk_count += add_chunks(documents, store_metadata=False)
+
+    return dict(chunk_count=chunk_count, duplicate_count=duplicate_count, durations=durations, point_ids=point_ids)
@@ -1,15 +1,128 @@
-from typing import Optional, Union
+from typing import Dict, List, Optional, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from tqdm.auto import tqdm
 import json
+import threading
 import fire
 
-from .docs import add_pdf_document, docs_index
+from llm4data.embeddings.docs import get_docs_embeddings
+from llm4data.index import get_index_registry
+from llm4data.index.qdrant import delete_points_by_payload
+from llm4data.scripts.indexing.manifest import MANIFEST_NAME, STATUS_INDEXED, IngestionManifest, get_content_hash, get_file_hash
+from .dedup import DuplicateDetector
+from .docs import add_pdf_document, add_pdf_document_streaming, get_doc_points_filter, get_text_splitter_pool
+from .pipeline import run_pipeline
 
 SUPPORTED_EXTENSIONS = ["pdf"]
 
 
-def load_doc_to_index(doc_path: Path, metadata: Optional[dict] = None, strict: bool = False):
+def load_doc_metadata(doc_path: Path, strict: bool = False) -> Optional[dict]:
+    metadata = None
+
+    # Try to load the metadata from the file
+    # following the convention <doc_path>.metadata.json
+    # in the same folder.
+    metadata_path = doc_path.with_suffix(".metadata.json")
+
+    if not metadata_path.exists():
+        # If no metadata is present in the same folder
+        # try to load it from the metadata folder.
+        metadata_path = doc_path.parent / "metadata" / metadata_path.name
+
+        if not metadata_path.exists():
+            # If no metadata is present in the same folder
+            # try to load it from the sibling of the parent folder.
+            metadata_path = doc_path.parent.parent / "metadata" / metadata_path.name
+
+    if metadata_path.exists():
+        metadata = json.load(metadata_path.open())
+
+    if strict:
+        assert metadata is not None, f"Metadata not found for {doc_path}"
+
+    return metadata
+
+
+def get_doc_hash(doc_path: Path, metadata: Optional[dict] = None) -> str:
+    """Hash the content of the PDF and its metadata."""
+    return get_content_hash(get_file_hash(doc_path), metadata)
+
+
+def get_duplicate_detector(docs_dir: Path, threshold: float = 0.85) -> DuplicateDetector:
+    """Get the detector of near-duplicate chunks, with the signatures of the
+    chunks indexed in the docs collection from the documents of `docs_dir`."""
+    cname = get_index_registry().docs.collection_name
+    return DuplicateDetector(docs_dir.parent / f"chunk_signatures-{cname}.sqlite", threshold=threshold)
+
+
+def get_pending_docs(
+    doc_paths: List[Path],
+    doc_records: Dict[str, dict],
+    incremental: bool = False,
+    normalize_metadata: bool = False,
+) -> Tuple[List[Path], Dict[str, dict], Dict[str, Tuple[Optional[dict], Optional[str]]], Dict[str, str]]:
+    """Find the documents to index given their records in the manifest.
+
+    Returns:
+        The paths of the documents to index; the points filters of those
+        with points of a previous version, i.e., the changed documents and
+        the failed documents indexed before, whose stale points are deleted
+        once the new version is upserted; the metadata and content hash of
+        the changed documents; and the current hashes of the indexed
+        documents with an unknown hash.
+    """
+    doc_states: Dict[str, Tuple[Optional[dict], Optional[str]]] = {}
+    stale_filters: Dict[str, dict] = {}
+    unknown_hashes: Dict[str, str] = {}
+
+    pending_paths = []
+    for doc_path in doc_paths:
+        record = doc_records.get(str(doc_path))
+        if record is None or record["status"] != STATUS_INDEXED:
+            # A failed document keeps the points filter of its indexed version.
+            if record is not None and record["points_filter"] is not None:
+                stale_filters[str(doc_path)] = record["points_filter"]
+            pending_paths.append(doc_path)
+            continue
+
+        if not incremental:
+            continue
+
+        try:
+            metadata = load_doc_metadata(doc_path)
+            content_hash = get_doc_hash(doc_path, metadata)
+        except Exception:
+            # The error is recorded when the document is indexed.
+            metadata, content_hash = None, None
+
+        if record["content_hash"] is None:
+            # Imported from a text log: assume the document is unchanged
+            # and record its hash, so that later changes are detected.
+            if content_hash is not None:
+                unknown_hashes[str(doc_path)] = content_hash
+            continue
+
+        if content_hash is None or content_hash != record["content_hash"]:
+            stale_filters[str(doc_path)] = record["points_filter"] or get_doc_points_filter(
+                doc_path, metadata, normalize_metadata
+            )
+            doc_states[str(doc_path)] = (metadata, content_hash)
+            pending_paths.append(doc_path)
+
+    return pending_paths, stale_filters, doc_states, unknown_hashes
+
+
+def load_doc_to_index(
+    doc_path: Path,
+    metadata: Optional[dict] = None,
+    strict: bool = False,
+    upload_workers: int = 1,
+    window_pages: Optional[int] = None,
+    page_workers: int = 0,
+    dedup: Optional[DuplicateDetector] = None,
+    page_pool: Optional[ProcessPoolExecutor] = None,
+) -> dict:
     assert (
         doc_path.exists() and doc_path.is_file()
     ), f"Invalid document path: {doc_path}"
@@ -18,33 +131,40 @@ def load_doc_to_index(doc_path: Path, metadata: Optional[dict] = None, strict: b
     ), f"Invalid document extension: {doc_path.suffix}, expected .pdf"
 
     if metadata is None:
-        # Try to load the metadata from the file
-        # following the convention <doc_path>.metadata.json
-        # in the same folder.
-        metadata_path = doc_path.with_suffix(".metadata.json")
+        metadata = load_doc_metadata(doc_path, strict=strict)
 
-        if not metadata_path.exists():
-            # If no metadata is present in the same folder
-            # try to load it from the metadata folder.
-            metadata_path = doc_path.parent / "metadata" / metadata_path.name
-
-            if not metadata_path.exists():
-                # If no metadata is present in the same folder
-                # try to load it from the sibling of the parent folder.
-                metadata_path = doc_path.parent.parent / "metadata" / metadata_path.name
-
-        if metadata_path.exists():
-            metadata = json.load(metadata_path.open())
-
-    if strict:
-        assert metadata is not None, f"Metadata not found for {doc_path}"
+    if window_pages:
+        return add_pdf_document_streaming(
+            str(doc_path),
+            metadata,
+            window_pages=window_pages,
+            page_workers=page_workers,
+            upload_workers=upload_workers,
+            dedup=dedup,
+            page_pool=page_pool,
+        )
 
-    add_pdf_document(str(doc_path), metadata)
+    return add_pdf_document(str(doc_path), metadata, upload_workers=upload_workers, dedup=dedup)
 
 
-def load_docs_to_index(docs_dir: Path, strict: bool = False):
+def load_docs_to_index(
+    docs_dir: Path,
+    strict: bool = False,
+    upload_workers: int = 1,
+    pipeline: bool = True,
+    parse_workers: int = 2,
+    embed_concurrency: int = 1,
+    upsert_concurrency: int = 2,
+    queue_size: int = 8,
+    window_pages: Optional[int] = None,
+    page_workers: int = 0,
+    incremental: bool = False,
+    dedup: Optional[DuplicateDetector] = None,
+):
     # Load the previously indexed documents.
-    cname = docs_index.collection_name
+    docs = get_index_registry().docs
+    cname = docs.collection_name
+    normalize_metadata = docs.embeddings.collection_config.normalize_metadata
     extension = docs_dir.name
 
     if extension not in SUPPORTED_EXTENSIONS:
@@ -52,19 +172,24 @@ def load_docs_to_index(docs_dir: Path, strict: bool = False):
             f"Invalid extension: {extension}, expected one of {SUPPORTED_EXTENSIONS}"
         )
 
-    indexed_docs_path = docs_dir.parent / f"indexed_docs-{cname}.txt"
-    failed_docs_path = docs_dir.parent / f"failed_docs-{cname}.txt"
+    manifest = IngestionManifest(
+        docs_dir.parent / MANIFEST_NAME,
+        collection_name=cname,
+        model_id=get_docs_embeddings().model_id,
+    )
+
+    print("Manifest path:", manifest.path)
 
-    print("Indexed docs path:", indexed_docs_path)
+    # Carry over the log of the previous versions.
+    imported = manifest.import_text_log(docs_dir.parent / f"indexed_docs-{cname}.txt")
+    if imported:
+        print("Imported indexed docs from the text log:", imported)
 
-    indexed_docs = set()
-    if indexed_docs_path.exists():
-        print("Loading indexed docs...")
-        with open(indexed_docs_path, "r") as f:
-            for line in f:
-                indexed_docs.add(line.strip())
+    # The failed docs are included, as they may have points of a
+    # version indexed before they failed.
+    doc_records = manifest.get_records()
 
-    print("Indexed docs:", len(indexed_docs))
+    print("Indexed docs:", sum(record["status"] == STATUS_INDEXED for record in doc_records.values()))
 
     doc_paths = sorted(
         docs_dir.glob(f"*.{extension}"),
@@ -74,37 +199,205 @@ def load_docs_to_index(docs_dir: Path, strict: bool = False):
 
     print("Total docs:", len(doc_paths))
 
-    for doc_path in tqdm(doc_paths):
-        if str(doc_path) in indexed_docs:
-            continue
+    pending_paths, stale_filters, doc_states, unknown_hashes = get_pending_docs(
+        doc_paths, doc_records, incremental=incremental, normalize_metadata=normalize_metadata
+    )
 
-        try:
-            load_doc_to_index(doc_path, strict=strict)
-            # Log documents that were indexed successfully in a file.
+    if incremental:
+        # Only the changed docs have a known state before they are indexed.
+        print("Changed docs:", len(doc_states))
 
-            with open(indexed_docs_path, "a+") as f:
-                f.write(f"{doc_path}\n")
+    if unknown_hashes:
+        print("Recorded the hash of the docs indexed without one:", manifest.set_content_hashes(unknown_hashes))
 
-        except KeyboardInterrupt:
-            raise KeyboardInterrupt
-        except Exception as e:
-            with open(failed_docs_path, "a+") as f:
-                # Log the file path and the error message.
-                f.write(f"{doc_path}\t{e}\n")
+    doc_paths = pending_paths
+    progress = tqdm(total=len(doc_paths))
+    progress_lock = threading.Lock()
 
-            continue
+    def prepare(doc_path: Path) -> Optional[dict]:
+        """Load the metadata of a document and hash its content."""
+        metadata = load_doc_metadata(doc_path, strict=strict)
+        content_hash = doc_states.get(str(doc_path), (None, None))[1]
+        if content_hash is None:
+            content_hash = get_doc_hash(doc_path, metadata)
+
+        doc_states[str(doc_path)] = (metadata, content_hash)
 
+        return metadata
 
-def main(path: Union[str, Path], strict: bool = False):
+    def on_indexed(doc_path: Path, stats: dict):
+        stale_filter = stale_filters.pop(str(doc_path), None)
+        if stale_filter is not None:
+            # The new version is upserted, so delete the points of the
+            # previous version that it did not overwrite. A document that
+            # fails before this point keeps serving its previous version.
+            try:
+                delete_points_by_payload(docs, stale_filter, keep_ids=stats["point_ids"])
+            except Exception as e:
+                # Leave the manifest as it is, so the next incremental
+                # run indexes the document again and retries the deletion.
+                doc_states.pop(str(doc_path), None)
+                print(f"Failed to delete the stale points of {doc_path}: {e}")
+                with progress_lock:
+                    progress.update()
+                return
+
+        metadata, content_hash = doc_states.pop(str(doc_path))
+        manifest.mark_indexed(
+            doc_path,
+            content_hash=content_hash,
+            chunk_count=stats["chunk_count"],
+            durations=stats["durations"],
+            points_filter=get_doc_points_filter(doc_path, metadata, normalize_metadata),
+        )
+        with progress_lock:
+            progress.update()
+
+    def on_failed(doc_path: Path, e: Exception):
+        doc_states.pop(str(doc_path), None)
+        manifest.mark_failed(doc_path, e)
+        with progress_lock:
+            progress.update()
+
+    # The page workers are spawned once and shared by the documents.
+    page_pool = get_text_splitter_pool(page_workers) if window_pages and page_workers > 0 else None
+
+    def index_docs(doc_paths):
+        # Streaming bounds the memory per document, so the documents
+        # are indexed one at a time.
+        if pipeline and not window_pages:
+            run_pipeline(
+                doc_paths,
+                load_metadata=prepare,
+                on_indexed=on_indexed,
+                on_failed=on_failed,
+                parse_workers=parse_workers,
+                embed_concurrency=embed_concurrency,
+                upsert_concurrency=upsert_concurrency,
+                queue_size=queue_size,
+                upload_workers=upload_workers,
+                dedup=dedup,
+            )
+            return
+
+        for doc_path in doc_paths:
+            try:
+                stats = load_doc_to_index(
+                    doc_path,
+                    metadata=prepare(doc_path),
+                    strict=strict,
+                    upload_workers=upload_workers,
+                    window_pages=window_pages,
+                    page_workers=page_workers,
+                    dedup=dedup,
+                    page_pool=page_pool,
+                )
+                on_indexed(doc_path, stats)
+
+            except KeyboardInterrupt:
+                raise KeyboardInterrupt
+            except Exception as e:
+                on_failed(doc_path, e)
+
+                continue
+
+    try:
+        index_docs(doc_paths)
+
+        if dedup is not None:
+            # The chunks that duplicated a chunk removed from a re-indexed
+            # document, or of a failed document, have no indexed copy:
+            # re-index their documents.
+            orphaned_paths = [
+                doc_path
+                for doc_path in map(Path, dedup.get_orphaned_sources())
+                if doc_path.parent == docs_dir and doc_path.exists()
+            ]
+            if orphaned_paths:
+                print("Docs with duplicates of removed chunks:", len(orphaned_paths))
+                progress.total += len(orphaned_paths)
+                progress.refresh()
+                index_docs(orphaned_paths)
+    finally:
+        if page_pool is not None:
+            page_pool.shutdown(cancel_futures=True)
+
+    progress.close()
+
+
+def main(
+    path: Union[str, Path],
+    strict: bool = False,
+    embed_workers: int = 0,
+    embed_threads: Optional[int] = None,
+    upload_workers: int = 1,
+    pipeline: bool = True,
+    parse_workers: int = 2,
+    embed_concurrency: int = 1,
+    upsert_concurrency: int = 2,
+    queue_size: int = 8,
+    window_pages: Optional[int] = None,
+    page_workers: int = 0,
+    incremental: bool = False,
+    dedup: bool = False,
+    dedup_threshold: float = 0.85,
+):
     # strict: if True, the script will fail if the document metadata is not found.
+    # embed_workers: if > 0, encode the chunks with a pool of CPU worker processes.
+    # embed_threads: the number of torch threads per embedding worker.
+    # upload_workers: the number of concurrent upsert requests per document.
+    # pipeline: if True, parse, embed and upsert documents concurrently. Use --nopipeline to index one document at a time.
+    # parse_workers: the number of processes parsing PDFs in the pipeline.
+    # embed_concurrency: the number of documents encoded concurrently in the pipeline.
+    # upsert_concurrency: the number of documents upserted concurrently in the pipeline.
+    # queue_size: the maximum number of documents waiting between pipeline stages.
+    # window_pages: if set, stream each document in windows of this many pages instead of loading it whole. This disables the pipeline.
+    # page_workers: if > 0, split the windows of a document with a pool of processes.
+    # incremental: if True, also re-index the indexed documents whose PDF or metadata changed, replacing their points.
+    #   The documents imported from an `indexed_docs-*.txt` log have no recorded hash: they are kept as they are, and their current hash is recorded for the next runs.
+    # dedup: if True, do not index the chunks that are near-duplicates of indexed chunks, e.g., boilerplate.
+    #   The docs whose duplicate chunks lost their indexed copy, e.g., removed from a changed document or a failed document, are re-indexed at the end of the run.
+    # dedup_threshold: the minimum estimated Jaccard similarity of the word shingles of near-duplicate chunks.
     path = Path(path)
 
-    if path.is_file():
-        load_doc_to_index(path, strict=strict)
-    else:
-        load_docs_to_index(path, strict=strict)
+    if embed_workers > 0:
+        get_docs_embeddings().start_pool(embed_workers, threads_per_worker=embed_threads)
+
+    try:
+        if path.is_file():
+            load_doc_to_index(
+                path,
+                dedup=get_duplicate_detector(path.parent, dedup_threshold) if dedup else None,
+                strict=strict,
+                upload_workers=upload_workers,
+                window_pages=window_pages,
+                page_workers=page_workers,
+            )
+        else:
+            load_docs_to_index(
+                path,
+                strict=strict,
+                upload_workers=upload_workers,
+                pipeline=pipeline,
+                parse_workers=parse_workers,
+                embed_concurrency=embed_concurrency,
+                upsert_concurrency=upsert_concurrency,
+                queue_size=queue_size,
+                window_pages=window_pages,
+                page_workers=page_workers,
+                incremental=incremental,
+                dedup=get_duplicate_detector(path, dedup_threshold) if dedup else None,
+            )
+    finally:
+        get_docs_embeddings().stop_pool()
 
 
 if __name__ == "__main__":
     # python -m llm4data.scripts.indexing.docs.load_docs --path=data/sources/docs/prwp/pdf --strict
+    # python -m llm4data.scripts.indexing.docs.load_docs --path=data/sources/docs/prwp/pdf --strict --parse_workers=4 --upsert_concurrency=4
+    # python -m llm4data.scripts.indexing.docs.load_docs --path=data/sources/docs/prwp/pdf --strict --embed_workers=4 --embed_threads=2
+    # python -m llm4data.scripts.indexing.docs.load_docs --path=data/sources/docs/prwp/pdf --strict --nopipeline
+    # python -m llm4data.scripts.indexing.docs.load_docs --path=data/sources/docs/prwp/pdf --strict --window_pages=32 --page_workers=4
+    # python -m llm4data.scripts.indexing.docs.load_docs --path=data/sources/docs/prwp/pdf --strict --incremental
+    # python -m llm4data.scripts.indexing.docs.load_docs --path=data/sources/docs/prwp/pdf --strict --dedup --dedup_threshold=0.85
     fire.Fire(main)
@@ -0,0 +1,213 @@
+"""Pipelined ingestion of PDF documents.
+
+The documents go through three stages connected by bounded queues, so that
+parsing, embedding and upserting overlap:
+
+1. parse: a process pool parses and splits the PDFs;
+2. embed: threads encode the chunks with the docs embedding model;
+3. upsert: threads upsert the chunks into the docs collection.
+
+The queues hold at most `queue_size` documents, so a slow stage throttles the
+ones before it and memory stays bounded. A document that fails at any stage
+is reported to `on_failed` and does not stop the pipeline. Errors raised by
+the callbacks themselves are logged, so that a stage never stops consuming
+its queue and the pipeline cannot hang.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+
+from llm4data.embeddings.docs import get_docs_embeddings
+from .dedup import DuplicateDetector
+from .docs import (
+    dedup_pdf_chunks,
+    embed_pdf_chunks,
+    get_doc_key,
+    get_text_splitter_pool,
+    split_pdf_document,
+    upsert_pdf_chunks,
+)
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+def _notify(callback: Callable, path, *args):
+    """Call `on_indexed` or `on_failed`, logging its errors instead of raising them."""
+    try:
+        callback(path, *args)
+    except Exception:
+        logger.exception("The `%s` callback failed for %s.", getattr(callback, "__name__", callback), path)
+
+
+def split_pdf_document_timed(path: str, metadata: Optional[dict], normalize_metadata: bool) -> Tuple[List[Document], float]:
+    start = time.perf_counter()
+    documents = split_pdf_document(path, metadata, normalize_metadata)
+
+    return documents, time.perf_counter() - start
+
+
+def run_pipeline(
+    doc_paths: Iterable[Path],
+    load_metadata: Callable[[Path], Optional[dict]],
+    on_indexed: Callable[[Path, dict], None],
+    on_failed: Callable[[Path, Exception], None],
+    parse_workers: int = 2,
+    embed_concurrency: int = 1,
+    upsert_concurrency: int = 2,
+    queue_size: int = 8,
+    embed_batch_size: int = 32,
+    upload_workers: int = 1,
+    dedup: Optional[DuplicateDetector] = None,
+):
+    """Index the documents with the parse, embed and upsert stages running concurrently.
+
+    Args:
+        doc_paths: The paths of the PDFs.
+        load_metadata: Get the metadata of a document. It may raise to fail the document.
+        on_indexed: Called with the path of each indexed document and a dict
+            with its number of indexed and duplicate chunks, the duration
+            of each stage in seconds and the ids of the upserted points.
+        on_failed: Called with the path and the error of each failed document.
+        parse_workers: The number of processes parsing and splitting PDFs.
+        embed_concurrency: The number of threads encoding documents.
+        upsert_concurrency: The number of threads upserting documents.
+        queue_size: The maximum number of documents waiting between stages.
+        embed_batch_size: The batch size of the embedding model.
+        upload_workers: The number of concurrent upsert requests per document.
+        dedup: If given, the near-duplicates of indexed chunks are not
+            embedded nor indexed. They are found in the embed stage, and
+            the kept chunks are recorded once they are upserted.
+    """
+    embeddings = get_docs_embeddings()
+    normalize_metadata = embeddings.collection_config.normalize_metadata
+
+    embed_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    upsert_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+
+    def embed_stage():
+        while True:
+            item = embed_queue.get()
+            if item is _DONE:
+                break
+
+            path, metadata, documents, durations = item
+            doc_key = None
+            try:
+                doc_key = get_doc_key(path, metadata)
+                duplicate_count = 0
+                if dedup is not None:
+                    start = time.perf_counter()
+                    dedup.remove_document(doc_key)
+                    documents, duplicate_count = dedup_pdf_chunks(doc_key, documents, dedup, source=str(path))
+                    durations["dedup"] = time.perf_counter() - start
+
+                start = time.perf_counter()
+                vectors = embed_pdf_chunks(documents, embed_batch_size=embed_batch_size)
+                durations["embed"] = time.perf_counter() - start
+            except Exception as e:
+                if dedup is not None and doc_key is not None:
+                    dedup.discard(doc_key)
+                _notify(on_failed, path, e)
+                continue
+
+            upsert_queue.put((path, metadata, documents, vectors, duplicate_count, durations))
+
+    def upsert_stage():
+        while True:
+            item = upsert_queue.get()
+            if item is _DONE:
+                break
+
+            path, metadata, documents, vectors, duplicate_count, durations = item
+            doc_key = None
+            try:
+                doc_key = get_doc_key(path, metadata)
+                start = time.perf_counter()
+                point_ids = upsert_pdf_chunks(
+                    doc_key,
+                    metadata,
+                    documents,
+                    vectors,
+                    upload_workers=upload_workers,
+                )
+                durations["upsert"] = time.perf_counter() - start
+
+                if dedup is not None:
+                    # Only the upserted chunks are used to drop duplicates.
+                    dedup.commit(doc_key)
+            except Exception as e:
+                if dedup is not None and doc_key is not None:
+                    dedup.discard(doc_key)
+                _notify(on_failed, path, e)
+                continue
+
+            _notify(
+                on_indexed,
+                path,
+                dict(chunk_count=len(documents), duplicate_count=duplicate_count, durations=durations, point_ids=point_ids),
+            )
+
+    # The threads are daemons so that an interrupted run can exit.
+    embed_threads = [
+        threading.Thread(target=embed_stage, daemon=True) for _ in range(embed_concurrency)
+    ]
+    upsert_threads = [
+        threading.Thread(target=upsert_stage, daemon=True) for _ in range(upsert_concurrency)
+    ]
+    for thread in embed_threads + upsert_threads:
+        thread.start()
+
+    def forward(futures):
+        for future in futures:
+            path, metadata = pending.pop(future)
+            try:
+                documents, parse_seconds = future.result()
+            except Exception as e:
+                _notify(on_failed, path, e)
+                continue
+
+            # Blocks while the embed stage is behind.
+            embed_queue.put((path, metadata, documents, dict(parse=parse_seconds)))
+
+    pool = get_text_splitter_pool(parse_workers)
+    pending: dict = {}
+
+    try:
+        for path in doc_paths:
+            try:
+                metadata = load_metadata(path)
+            except Exception as e:
+                _notify(on_failed, path, e)
+                continue
+
+            future = pool.submit(split_pdf_document_timed, str(path), metadata, normalize_metadata)
+            pending[future] = (path, metadata)
+
+            if len(pending) >= queue_size:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                forward(done)
+
+        forward(list(pending))
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+
+    pool.shutdown()
+
+    for _ in embed_threads:
+        embed_queue.put(_DONE)
+    for thread in embed_threads:
+        thread.join()
+
+    for _ in upsert_threads:
+        upsert_queue.put(_DONE)
+    for thread in upsert_threads:
+        thread.join()
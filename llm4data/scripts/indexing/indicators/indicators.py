@@ -1,12 +1,15 @@
+import time
 from typing import List, Optional, Union
 from langchain.text_splitter import NLTKTextSplitter
 from langchain.docstore.document import Document
 from llm4data import configs
-from llm4data.index import get_indicators_index
+from llm4data.embeddings.indicators import get_indicators_embeddings
+from llm4data.embeddings.sparse import get_sparse_encoder
+from llm4data.index import get_index_registry
+from llm4data.index.qdrant import add_documents_with_vectors
+from llm4data.utils.system.cache import get_uuid
 
 
-# Get access to the Qdrant docs collection
-indicators_index = get_indicators_index()
 text_splitter = NLTKTextSplitter()
 
 
@@ -17,12 +20,66 @@ def build_document(text: str, metadata: dict = None):
     return document
 
 
-def add_indicators(text: Union[str, List[str]], metadata: Optional[Union[dict, List[dict]]] = None):
+def get_indicator_id(document: Document) -> str:
+    """Derive the point id from the series code, or the text if there is no metadata."""
+    metadata = document.metadata.get(configs.METADATA_KEY, {})
+    return get_uuid(metadata.get("series_code", document.page_content))
+
+
+def get_indicator_points_filter(metadata: Optional[dict]) -> Optional[dict]:
+    """Get the payload values that select the point of an indicator, for
+    `llm4data.index.qdrant.delete_points_by_payload`, or None if it has no series code."""
+    if not metadata or not metadata.get("series_code"):
+        return None
+
+    return {f"metadata.{configs.METADATA_KEY}.series_code": metadata["series_code"]}
+
+
+def get_sparse_text(document: Document) -> str:
+    """Get the text of the sparse vector, with the series code and name matched exactly."""
+    metadata = document.metadata.get(configs.METADATA_KEY, {})
+    fields = [metadata.get("series_code"), metadata.get("name"), document.page_content]
+
+    return "\n".join(field for field in fields if field)
+
+
+def add_indicators(text: Union[str, List[str]], metadata: Optional[Union[dict, List[dict]]] = None, embed_batch_size: int = 32, upload_workers: int = 1) -> dict:
+    """Index indicators.
+
+    Returns:
+        dict: The duration of the embed and upsert stages in seconds.
+    """
+    durations = {}
+
     # Load the document
     if isinstance(text, str):
         documents = [build_document(text, metadata)]
     else:
         documents = [build_document(text, meta) for text, meta in zip(text, metadata)]
 
+    start = time.perf_counter()
+    embeddings = get_indicators_embeddings()
+    vectors = embeddings.encode_batch(
+        [doc.page_content for doc in documents], batch_size=embed_batch_size
+    )
+
+    sparse_vectors = None
+    if embeddings.collection_config.sparse_vectors:
+        sparse_vectors = get_sparse_encoder().encode_documents(
+            [get_sparse_text(doc) for doc in documents]
+        )
+    durations["embed"] = time.perf_counter() - start
+
     # Add the document to the collection
-    indicators_index.add_documents(documents)
+    start = time.perf_counter()
+    add_documents_with_vectors(
+        get_index_registry().indicators,
+        documents,
+        vectors,
+        ids=[get_indicator_id(doc) for doc in documents],
+        parallel=upload_workers,
+        sparse_vectors=sparse_vectors,
+    )
+    durations["upsert"] = time.perf_counter() - start
+
+    return durations
@@ -2,22 +2,35 @@
 process them to generate the text for the embedding, extract the metadata
 for the payload, and load them into the vector index.
 """
-from typing import Union
+from typing import Dict, Optional, Union
 from pathlib import Path
 from tqdm.auto import tqdm
 import fire
-from .indicators import add_indicators, indicators_index
+import time
+from llm4data.embeddings.indicators import get_indicators_embeddings
+from llm4data.index import get_index_registry
+from llm4data.scripts.indexing.manifest import MANIFEST_NAME, STATUS_INDEXED, IngestionManifest, get_content_hash
+from llm4data.index.qdrant import delete_points_by_payload
+from .indicators import add_indicators, build_document, get_indicator_id, get_indicator_points_filter
 import json
 from metaschema.indicators2 import IndicatorsSchema
 
 
-def load_indicators(collection_dir: Path):
+def load_indicators(collection_dir: Path, batch_size: int = 64, upload_workers: int = 1, incremental: bool = False):
     """Load the indicators from the collection directory.
 
     Args:
         collection_dir (Path): Path to the collection directory.
+        batch_size (int): Number of indicators encoded and indexed together.
+        upload_workers (int): Number of concurrent upsert requests.
+        incremental (bool): If True, also re-index the indexed indicators
+            whose text or metadata changed, replacing their points. The
+            indicators imported from an `indexed_indicators-*.txt` log have
+            no recorded hash: they are kept as they are, and their current
+            hash is recorded for the next runs.
     """
-    cname = indicators_index.collection_name
+    indicators = get_index_registry().indicators
+    cname = indicators.collection_name
 
     collection_dir = Path(collection_dir)
     text_dir = collection_dir / "text"
@@ -26,58 +39,142 @@ def load_indicators(collection_dir: Path):
     assert metadata_dir.exists(), f"{metadata_dir} does not exist."
     assert collection_dir.exists(), f"{collection_dir} does not exist."
 
-    indexed_indicators_path = collection_dir / f"indexed_indicators-{cname}.txt"
-    failed_indicators_path = collection_dir / f"failed_indicators-{cname}.txt"
+    manifest = IngestionManifest(
+        collection_dir / MANIFEST_NAME,
+        collection_name=cname,
+        model_id=get_indicators_embeddings().model_id,
+    )
 
-    print("Indexed indicators path:", indexed_indicators_path)
+    print("Manifest path:", manifest.path)
 
-    indexed_indicators = set()
-    if indexed_indicators_path.exists():
-        print("Loading indexed indicators...")
-        with open(indexed_indicators_path, "r") as f:
-            for line in f:
-                indexed_indicators.add(line.strip())
+    # Carry over the log of the previous versions.
+    imported = manifest.import_text_log(collection_dir / f"indexed_indicators-{cname}.txt")
+    if imported:
+        print("Imported indexed indicators from the text log:", imported)
 
-    print("Indexed indicators:", len(indexed_indicators))
+    # The failed indicators are included, as they may have points of a
+    # version indexed before they failed.
+    indicator_records = manifest.get_records()
 
+    print("Indexed indicators:", sum(record["status"] == STATUS_INDEXED for record in indicator_records.values()))
+
+    def add_batch(batch: list):
+        if not batch:
+            return
+
+        try:
+            durations = add_indicators(
+                text=[text for _, text, _, _, _ in batch],
+                metadata=[metadata for _, _, metadata, _, _ in batch],
+                upload_workers=upload_workers,
+            )
+
+            # The new versions are upserted, so delete the points of the
+            # changed or previously failed indicators that they did not
+            # overwrite, e.g., after a change of series code.
+            for indicator_path, text, metadata, _, _ in batch:
+                record = indicator_records.get(str(indicator_path))
+                if record is not None and record["points_filter"]:
+                    delete_points_by_payload(
+                        indicators,
+                        record["points_filter"],
+                        keep_ids=[get_indicator_id(build_document(text, metadata))],
+                    )
+
+            # The indicators of a batch are embedded and upserted together,
+            # so each gets an equal share of the batch durations.
+            manifest.mark_indexed_many(
+                dict(
+                    item=indicator_path,
+                    content_hash=content_hash,
+                    chunk_count=1,
+                    durations=dict(
+                        parse=parse_seconds,
+                        **{stage: seconds / len(batch) for stage, seconds in durations.items()},
+                    ),
+                    points_filter=get_indicator_points_filter(metadata),
+                )
+                for indicator_path, text, metadata, content_hash, parse_seconds in batch
+            )
+
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
+
+        except Exception as e:
+            manifest.mark_failed_many([indicator_path for indicator_path, _, _, _, _ in batch], e)
+
+    batch: list = []
+    n_changed = 0
+    # The current hashes of the indexed indicators with an unknown hash.
+    unknown_hashes: Dict[str, str] = {}
 
     for indicator_path in tqdm(sorted(text_dir.glob("*.txt"))):
-        if str(indicator_path) in indexed_indicators:
+        record = indicator_records.get(str(indicator_path))
+        if record is not None and record["status"] != STATUS_INDEXED:
+            # Indexed again, replacing the points it may have.
+            record = None
+        if record is not None and not incremental:
             continue
         metadata_path = metadata_dir / f"{indicator_path.stem}.json"
 
         try:
-            metadata = json.loads(metadata_path.read_text())
+            start = time.perf_counter()
+            metadata_text = metadata_path.read_text()
             text = indicator_path.read_text()
 
-            s = IndicatorsSchema(**metadata)
+            # Hash the files as they are so that unchanged
+            # indicators are skipped before parsing the metadata.
+            content_hash = get_content_hash(text, metadata_text)
+            if record is not None:
+                if record["content_hash"] is None:
+                    # Imported from a text log: assume the indicator is unchanged.
+                    unknown_hashes[str(indicator_path)] = content_hash
+                    continue
+                if content_hash == record["content_hash"]:
+                    continue
+                n_changed += 1
 
-            add_indicators(
-                text=text,
-                metadata=s.dict(exclude_none=True),
-            )
+            s = IndicatorsSchema(**json.loads(metadata_text))
 
-            with open(indexed_indicators_path, "a+") as f:
-                f.write(f"{indicator_path}\n")
+            batch.append((indicator_path, text, s.dict(exclude_none=True), content_hash, time.perf_counter() - start))
 
         except KeyboardInterrupt:
             raise KeyboardInterrupt
 
         except Exception as e:
-            with open(failed_indicators_path, "a+") as f:
-                f.write(f"{indicator_path}\t{e}\n")
+            manifest.mark_failed(indicator_path, e)
             continue
 
+        if len(batch) >= batch_size:
+            add_batch(batch)
+            batch = []
+
+    add_batch(batch)
 
-def main(collection_dir: Union[str, Path]):
+    if incremental:
+        print("Changed indicators:", n_changed)
+
+    if unknown_hashes:
+        print("Recorded the hash of the indicators indexed without one:", manifest.set_content_hashes(unknown_hashes))
+
+
+def main(collection_dir: Union[str, Path], batch_size: int = 64, embed_workers: int = 0, embed_threads: Optional[int] = None, upload_workers: int = 1, incremental: bool = False):
 
     collection_dir = Path(collection_dir).expanduser()
     assert collection_dir.exists(), f"File {collection_dir} does not exist."
 
+    if embed_workers > 0:
+        get_indicators_embeddings().start_pool(embed_workers, threads_per_worker=embed_threads)
+
     print(f"Loading indicators from {collection_dir}...")
-    load_indicators(collection_dir)
+    try:
+        load_indicators(collection_dir, batch_size=batch_size, upload_workers=upload_workers, incremental=incremental)
+    finally:
+        get_indicators_embeddings().stop_pool()
 
 
 if __name__ == "__main__":
     # python -m llm4data.scripts.indexing.indicators.load_indicators --collection_dir=data/sources/indicators/wdi
+    # python -m llm4data.scripts.indexing.indicators.load_indicators --collection_dir=data/sources/indicators/wdi --embed_workers=4 --embed_threads=2
+    # python -m llm4data.scripts.indexing.indicators.load_indicators --collection_dir=data/sources/indicators/wdi --incremental
     fire.Fire(main)
@@ -0,0 +1,273 @@
+"""Ingestion manifest of the indexing scripts.
+
+The manifest is a SQLite database, in WAL mode, with one row per indexed item
+(a document or an indicator) and collection. Each row records the status of
+the item, the hash of its content, the number of indexed chunks, the
+duration of each ingestion stage and the id of the embedding model, as well
+as the payload values that select the points of the item, so that the
+points of a changed item can be deleted before it is re-indexed.
+
+Every thread gets its own connection and every write is a short transaction,
+so the manifest can be updated from parallel workers. Resuming a run is a
+query on the `(collection_name, status, model_id)` index.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Union
+
+MANIFEST_NAME = "ingestion_manifest.sqlite"
+
+STATUS_INDEXED = "indexed"
+STATUS_FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    collection_name TEXT NOT NULL,
+    item TEXT NOT NULL,
+    status TEXT NOT NULL,
+    content_hash TEXT,
+    chunk_count INTEGER,
+    durations TEXT,
+    model_id TEXT,
+    points_filter TEXT,
+    error TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (collection_name, item)
+);
+CREATE INDEX IF NOT EXISTS items_status ON items (collection_name, status, model_id);
+"""
+
+INSERT_ITEM = """
+INSERT INTO items (collection_name, item, status, content_hash, chunk_count, durations, model_id, points_filter, error, updated_at)
+VALUES (:collection_name, :item, :status, :content_hash, :chunk_count, :durations, :model_id, :points_filter, :error, :updated_at)
+"""
+
+UPSERT_ITEM = INSERT_ITEM + """ON CONFLICT (collection_name, item) DO UPDATE SET
+    status = excluded.status,
+    content_hash = COALESCE(excluded.content_hash, items.content_hash),
+    chunk_count = COALESCE(excluded.chunk_count, items.chunk_count),
+    durations = excluded.durations,
+    model_id = excluded.model_id,
+    points_filter = COALESCE(excluded.points_filter, items.points_filter),
+    error = excluded.error,
+    updated_at = excluded.updated_at
+"""
+
+
+def get_file_hash(path: Union[str, Path]) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def get_content_hash(*parts: Union[str, dict, None]) -> str:
+    """Hash texts and JSON-serializable metadata, e.g., of an indicator."""
+    sha = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, str):
+            part = json.dumps(part, sort_keys=True, default=str)
+
+        sha.update(part.encode("utf-8"))
+        sha.update(b"\0")
+
+    return sha.hexdigest()
+
+
+class IngestionManifest:
+    def __init__(self, path: Union[str, Path], collection_name: str, model_id: Optional[str] = None, timeout: float = 60.0):
+        self.path = Path(path)
+        self.collection_name = collection_name
+        self.model_id = model_id
+        self.timeout = timeout
+        self._local = threading.local()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self.connection
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+
+        if conn is None:
+            # Autocommit mode, with explicit transactions for the writes.
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+
+        return conn
+
+    def _write(self, rows: List[dict], statement: str = UPSERT_ITEM) -> int:
+        conn = self.connection
+        # Take the write lock up front so that concurrent writers wait
+        # on `timeout` instead of failing when upgrading a read lock.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = conn.total_changes
+            conn.executemany(statement, rows)
+            changes = conn.total_changes - before
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+        return changes
+
+    def _row(self, item, status: str, **fields) -> dict:
+        row = dict(
+            collection_name=self.collection_name,
+            item=str(item),
+            status=status,
+            content_hash=None,
+            chunk_count=None,
+            durations=None,
+            model_id=self.model_id,
+            points_filter=None,
+            error=None,
+            updated_at=datetime.now().isoformat(),
+        )
+        row.update(fields)
+
+        for key in ("durations", "points_filter"):
+            if row[key] is not None:
+                row[key] = json.dumps(row[key])
+
+        return row
+
+    def mark_indexed(self, item, content_hash: Optional[str] = None, chunk_count: Optional[int] = None, durations: Optional[dict] = None, points_filter: Optional[dict] = None):
+        self._write([
+            self._row(
+                item,
+                STATUS_INDEXED,
+                content_hash=content_hash,
+                chunk_count=chunk_count,
+                durations=durations,
+                points_filter=points_filter,
+            )
+        ])
+
+    def mark_indexed_many(self, items: Iterable[dict]):
+        """Mark items as indexed in one transaction.
+
+        Args:
+            items: Dicts with the `item` and, optionally, the `content_hash`,
+                `chunk_count`, `durations` and `points_filter` of each item.
+        """
+        self._write([self._row(status=STATUS_INDEXED, **item) for item in items])
+
+    def mark_failed(self, item, error: Union[str, Exception], durations: Optional[dict] = None):
+        self.mark_failed_many([item], error, durations=durations)
+
+    def mark_failed_many(self, items: Iterable, error: Union[str, Exception], durations: Optional[dict] = None):
+        self._write([
+            self._row(item, STATUS_FAILED, error=str(error), durations=durations)
+            for item in items
+        ])
+
+    def get_items(self, status: str = STATUS_INDEXED) -> Set[str]:
+        """Get the items with the status for the collection and the embedding model."""
+        rows = self.connection.execute(
+            "SELECT item FROM items WHERE collection_name = ? AND status = ? AND model_id IS ?",
+            (self.collection_name, status, self.model_id),
+        )
+        return {item for item, in rows}
+
+    def get_indexed_items(self) -> Set[str]:
+        return self.get_items(STATUS_INDEXED)
+
+    def get_records(self, status: Optional[str] = None) -> Dict[str, dict]:
+        """Get the status, the content hash and the points filter of the items,
+        of any status by default.
+
+        A failed item keeps the hash and the points filter of its last indexed
+        version, so that its points can be replaced when it is indexed again.
+        """
+        query = "SELECT item, status, content_hash, points_filter FROM items WHERE collection_name = ? AND model_id IS ?"
+        params: tuple = (self.collection_name, self.model_id)
+        if status is not None:
+            query += " AND status = ?"
+            params += (status,)
+
+        return {
+            item: dict(
+                status=item_status,
+                content_hash=content_hash,
+                points_filter=json.loads(points_filter) if points_filter is not None else None,
+            )
+            for item, item_status, content_hash, points_filter in self.connection.execute(query, params)
+        }
+
+    def get_indexed_records(self) -> Dict[str, dict]:
+        """Get the content hash and the points filter of the indexed items,
+        to find the items that changed since they were indexed."""
+        return {
+            item: dict(content_hash=record["content_hash"], points_filter=record["points_filter"])
+            for item, record in self.get_records(STATUS_INDEXED).items()
+        }
+
+    def get_item(self, item) -> Optional[dict]:
+        cursor = self.connection.execute(
+            "SELECT * FROM items WHERE collection_name = ? AND item = ?",
+            (self.collection_name, str(item)),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+
+        row = dict(zip([c[0] for c in cursor.description], row))
+        for key in ("durations", "points_filter"):
+            if row[key] is not None:
+                row[key] = json.loads(row[key])
+
+        return row
+
+    def set_content_hashes(self, content_hashes: Dict[str, str]) -> int:
+        """Record the content hash of the items that have none, e.g., imported
+        from a text log, without changing their status."""
+        return self._write(
+            [
+                dict(collection_name=self.collection_name, item=str(item), content_hash=content_hash)
+                for item, content_hash in content_hashes.items()
+            ],
+            statement=(
+                "UPDATE items SET content_hash = :content_hash "
+                "WHERE collection_name = :collection_name AND item = :item AND content_hash IS NULL"
+            ),
+        )
+
+    def import_text_log(self, path: Union[str, Path], status: str = STATUS_INDEXED) -> int:
+        """Import the items of an `indexed_*.txt` or `failed_*.txt` log of a previous version.
+
+        The items of the log are assumed to have been indexed with the current
+        embedding model. Items already in the manifest are left as they are.
+
+        The log has no content hashes, so the imported items have none. The
+        incremental runs of the indexing scripts assume that these items are
+        unchanged and record their current hash with `set_content_hashes`.
+        """
+        path = Path(path)
+        if not path.exists():
+            return 0
+
+        rows = []
+        with open(path, "r") as f:
+            for line in f:
+                item, _, error = line.rstrip("\n").partition("\t")
+                if item:
+                    rows.append(self._row(item, status, error=error or None))
+
+        return self._write(rows, statement=INSERT_ITEM + "ON CONFLICT (collection_name, item) DO NOTHING")
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
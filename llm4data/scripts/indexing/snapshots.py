@@ -0,0 +1,282 @@
+"""Export and restore snapshots of the docs, indicators and microdata collections.
+
+A snapshot is written with a manifest, `<data_type>.manifest.json`, that
+records the embedding model the vectors were created with and the collection
+config, e.g., the sparse vectors and the quantization. A snapshot is only
+restored if the configured embedding model and collection config of the data
+type match the manifest, so a node never serves vectors from another model
+nor a collection laid out differently from what the code expects.
+
+Snapshots are a Qdrant server feature, so both commands need a server url.
+"""
+import hashlib
+import json
+from dataclasses import asdict
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Sequence, Union
+from urllib.parse import urlsplit
+
+import fire
+# The http client of qdrant-client, so no other dependency is needed.
+import httpx
+
+from llm4data import __version__
+from llm4data.index import IndexRegistry
+from llm4data.index.metadata_store import get_metadata_collection_name
+from llm4data.index.qdrant import (
+    collection_exists,
+    forget_collection,
+    get_client_key,
+    get_index_client,
+)
+
+DATA_TYPES = ("docs", "indicators", "microdata")
+
+# The fields of the manifest that must match the configured embedding model.
+COMPATIBILITY_FIELDS = ("model_id", "encoder_id", "size", "distance", "collection_config")
+
+# The collection options that only apply at search time, so a snapshot
+# created with other values is still compatible.
+SEARCH_OPTIONS = ("rescore_oversampling",)
+
+# The REST port of the Qdrant client when the url has none.
+DEFAULT_REST_PORT = 6333
+
+# Snapshots can be large, and an upload waits for the collection to be
+# recovered, so the transfers have no timeout.
+TRANSFER_TIMEOUT = httpx.Timeout(None)
+
+
+def get_server_url(url: Optional[str] = None) -> str:
+    kind, location, _ = get_client_key(url=url)
+    if kind != "url":
+        raise ValueError(f"Snapshots need a Qdrant server url, got the local path {location}")
+
+    return location
+
+
+def get_rest_url(location: str) -> str:
+    """Normalize a Qdrant location, e.g., `localhost:6333`, to the base url of
+    the REST API, with a scheme and a port, as the client resolves it."""
+    if "://" not in location:
+        location = f"http://{location}"
+
+    parts = urlsplit(location)
+    netloc = parts.netloc
+    if parts.port is None:
+        netloc = f"{netloc}:{DEFAULT_REST_PORT}"
+
+    return f"{parts.scheme}://{netloc}{parts.path}".rstrip("/")
+
+
+def get_sha256(path: Path) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def get_manifest_path(snapshot_dir: Path, data_type: str) -> Path:
+    return snapshot_dir / f"{data_type}.manifest.json"
+
+
+def get_model_fields(embeddings) -> dict:
+    return dict(
+        model_id=embeddings.model_id,
+        encoder_id=embeddings.encoder_id,
+        model_name=embeddings.model_name,
+        collection_name=embeddings.collection_name,
+        size=embeddings.size,
+        distance=getattr(embeddings.distance, "value", embeddings.distance),
+        collection_config=get_collection_config_fields(embeddings.collection_config),
+    )
+
+
+def get_collection_config_fields(collection_config) -> dict:
+    fields = asdict(collection_config)
+    for option in SEARCH_OPTIONS:
+        fields.pop(option, None)
+
+    return fields
+
+
+def check_compatibility(manifest: dict, embeddings):
+    """Raise a ValueError if the snapshot was not created with the embedding model."""
+    current = get_model_fields(embeddings)
+    mismatches = {
+        field: (manifest.get(field), current[field])
+        for field in COMPATIBILITY_FIELDS
+        if field != "collection_config" and manifest.get(field) != current[field]
+    }
+
+    # Report the options that differ rather than the whole collection config.
+    snapshot_config = manifest.get("collection_config") or {}
+    for option, value in current["collection_config"].items():
+        if snapshot_config.get(option) != value:
+            mismatches[f"collection_config.{option}"] = (snapshot_config.get(option), value)
+
+    if mismatches:
+        details = ", ".join(
+            f"{field}: snapshot={old!r} configured={new!r}"
+            for field, (old, new) in mismatches.items()
+        )
+        raise ValueError(
+            f"The `{manifest['data_type']}` snapshot is not compatible with the configured embedding model ({details})"
+        )
+
+
+def download_snapshot(location: str, collection_name: str, snapshot_dir: Path, keep_on_server: bool = False) -> Path:
+    client = get_index_client(url=location)
+    description = client.create_snapshot(collection_name, wait=True)
+
+    snapshot_path = snapshot_dir / description.name
+    print(f"Downloading {collection_name} snapshot to {snapshot_path}...")
+
+    with httpx.stream(
+        "GET",
+        f"{get_rest_url(location)}/collections/{collection_name}/snapshots/{description.name}",
+        timeout=TRANSFER_TIMEOUT,
+    ) as response:
+        response.raise_for_status()
+        with open(snapshot_path, "wb") as f:
+            for block in response.iter_bytes(chunk_size=1 << 20):
+                f.write(block)
+
+    if not keep_on_server:
+        client.delete_snapshot(collection_name, description.name)
+
+    return snapshot_path
+
+
+def upload_snapshot(location: str, collection_name: str, snapshot_path: Path, sha256: str):
+    if get_sha256(snapshot_path) != sha256:
+        raise ValueError(f"The checksum of {snapshot_path} does not match the manifest.")
+
+    print(f"Restoring {collection_name} from {snapshot_path}...")
+
+    with open(snapshot_path, "rb") as f:
+        response = httpx.post(
+            f"{get_rest_url(location)}/collections/{collection_name}/snapshots/upload",
+            params=dict(priority="snapshot", wait="true"),
+            files=dict(snapshot=(snapshot_path.name, f)),
+            timeout=TRANSFER_TIMEOUT,
+        )
+    response.raise_for_status()
+
+    # The collection may have been created by the restore.
+    forget_collection(collection_name, url=location)
+
+
+def create_snapshot(data_type: str, snapshot_dir: Path, url: Optional[str] = None, keep_on_server: bool = False) -> Optional[dict]:
+    """Create a snapshot of the collection and download it with its manifest.
+
+    The document metadata collection of a normalized collection is
+    snapshotted with it.
+
+    Returns:
+        dict: The manifest, or None if the collection does not exist.
+    """
+    location = get_server_url(url)
+    embeddings = IndexRegistry.embeddings_factories[data_type]()
+    collection_name = embeddings.collection_name
+
+    if not collection_exists(collection_name, url=location):
+        print(f"Skipping {data_type}: the collection {collection_name} does not exist.")
+        return None
+
+    points_count = get_index_client(url=location).count(collection_name, exact=True).count
+    snapshot_path = download_snapshot(location, collection_name, snapshot_dir, keep_on_server=keep_on_server)
+
+    manifest = dict(
+        data_type=data_type,
+        snapshot=snapshot_path.name,
+        sha256=get_sha256(snapshot_path),
+        points_count=points_count,
+        created_at=datetime.now().isoformat(),
+        llm4data_version=__version__,
+        **get_model_fields(embeddings),
+    )
+
+    if embeddings.collection_config.normalize_metadata:
+        metadata_path = download_snapshot(
+            location,
+            get_metadata_collection_name(collection_name),
+            snapshot_dir,
+            keep_on_server=keep_on_server,
+        )
+        manifest.update(
+            metadata_snapshot=metadata_path.name,
+            metadata_sha256=get_sha256(metadata_path),
+        )
+
+    get_manifest_path(snapshot_dir, data_type).write_text(json.dumps(manifest, indent=2))
+
+    return manifest
+
+
+def restore_snapshot(data_type: str, snapshot_dir: Path, url: Optional[str] = None) -> dict:
+    """Restore the collection of the data type from a snapshot in `snapshot_dir`.
+
+    The snapshot replaces the collection if it exists.
+    """
+    location = get_server_url(url)
+    manifest = json.loads(get_manifest_path(snapshot_dir, data_type).read_text())
+
+    embeddings = IndexRegistry.embeddings_factories[data_type]()
+    check_compatibility(manifest, embeddings)
+
+    collection_name = manifest["collection_name"]
+    upload_snapshot(location, collection_name, snapshot_dir / manifest["snapshot"], manifest["sha256"])
+
+    if "metadata_snapshot" in manifest:
+        upload_snapshot(
+            location,
+            get_metadata_collection_name(collection_name),
+            snapshot_dir / manifest["metadata_snapshot"],
+            manifest["metadata_sha256"],
+        )
+
+    points_count = get_index_client(url=location).count(collection_name, exact=True).count
+    if points_count != manifest["points_count"]:
+        raise ValueError(
+            f"Restored {points_count} points in {collection_name}, expected {manifest['points_count']}."
+        )
+
+    return manifest
+
+
+def create(snapshot_dir: Union[str, Path], data_types: Sequence[str] = DATA_TYPES, url: Optional[str] = None, keep_on_server: bool = False):
+    if isinstance(data_types, str):
+        data_types = [data_types]
+
+    snapshot_dir = Path(snapshot_dir).expanduser()
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+
+    for data_type in data_types:
+        manifest = create_snapshot(data_type, snapshot_dir, url=url, keep_on_server=keep_on_server)
+        if manifest is not None:
+            print(json.dumps(manifest))
+
+
+def restore(snapshot_dir: Union[str, Path], data_types: Sequence[str] = DATA_TYPES, url: Optional[str] = None):
+    if isinstance(data_types, str):
+        data_types = [data_types]
+
+    snapshot_dir = Path(snapshot_dir).expanduser()
+    assert snapshot_dir.exists(), f"{snapshot_dir} does not exist."
+
+    for data_type in data_types:
+        if not get_manifest_path(snapshot_dir, data_type).exists():
+            print(f"Skipping {data_type}: no manifest in {snapshot_dir}.")
+            continue
+
+        restore_snapshot(data_type, snapshot_dir, url=url)
+
+
+if __name__ == "__main__":
+    # python -m llm4data.scripts.indexing.snapshots create --snapshot_dir=data/snapshots
+    # python -m llm4data.scripts.indexing.snapshots restore --snapshot_dir=data/snapshots --data_types='[docs]'
+    fire.Fire(dict(create=create, restore=restore))
@@ -0,0 +1,28 @@
+"""Refresh the in-process numpy indexes from the Qdrant collections.
+
+The indexes are served by the registry for the data types listed in the
+`LLM4DATA_NUMPY_INDEXES` environment variable.
+"""
+from typing import Sequence
+import fire
+
+from llm4data.index import IndexRegistry
+from llm4data.index.qdrant import sync_numpy_index
+
+
+def main(data_types: Sequence[str] = ("indicators",), dtype: str = "float32", batch_size: int = 1024):
+    # dtype: float32, or float16 to halve the size of the matrix.
+    if isinstance(data_types, str):
+        data_types = [data_types]
+
+    for data_type in data_types:
+        # Read from the Qdrant collection, whatever backend the registry serves.
+        index = IndexRegistry.factories[data_type]()
+        meta = sync_numpy_index(index, dtype=dtype, batch_size=batch_size)
+        print(f"Synced {meta['count']} points of {meta['collection_name']} ({dtype}).")
+
+
+if __name__ == "__main__":
+    # python -m llm4data.scripts.indexing.sync_numpy_index
+    # python -m llm4data.scripts.indexing.sync_numpy_index --data_types='[indicators,microdata]' --dtype=float16
+    fire.Fire(main)
@@ -0,0 +1,118 @@
+"""Benchmark the single-pass `TokenChunker` against the recursive splitter.
+
+The PDFs are loaded once, and both splitters split the same pages with the
+tokenizer and the chunk sizes of the configured docs embedding model. With
+`--embed`, this also times the encoding of the token chunks from their text
+and from their token ids.
+
+Usage:
+    python -m tests.benchmarks.chunker --docs_dir=data/sources/docs/prwp/pdf --max_docs=50
+    python -m tests.benchmarks.chunker --docs_dir=data/sources/docs/prwp/pdf --embed --output=chunker.json
+"""
+import dataclasses
+import json
+import statistics
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+import fire
+from langchain_community.document_loaders import PyMuPDFLoader
+
+from llm4data.embeddings.docs import get_docs_embeddings
+from llm4data.scripts.indexing.docs.chunker import pop_token_ids
+from llm4data.scripts.indexing.docs.docs import build_text_splitter, chunk_overlap
+
+
+def time_split(splitter, pages: list, repeat: int) -> tuple:
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = splitter.split_documents(pages)
+        seconds.append(time.perf_counter() - start)
+
+    return chunks, min(seconds)
+
+
+def main(
+    docs_dir: Union[str, Path],
+    max_docs: int = 20,
+    repeat: int = 3,
+    embed: bool = False,
+    batch_size: int = 32,
+    output: Optional[Union[str, Path]] = None,
+):
+    # Do not read from or write to the persistent embedding cache.
+    embeddings = dataclasses.replace(get_docs_embeddings(), cache_embeddings=False)
+    tokenizer = embeddings.embeddings.client.tokenizer
+
+    doc_paths = sorted(Path(docs_dir).expanduser().glob("*.pdf"))[:max_docs]
+    pages = [page for doc_path in doc_paths for page in PyMuPDFLoader(str(doc_path)).load()]
+
+    recursive = build_text_splitter(
+        tokenizer, chunk_size=embeddings.max_seq_length + chunk_overlap, chunk_overlap=chunk_overlap
+    )
+    token = build_text_splitter(
+        tokenizer,
+        chunk_size=embeddings.max_seq_length - tokenizer.num_special_tokens_to_add(),
+        chunk_overlap=chunk_overlap,
+        chunker="token",
+    )
+
+    recursive_chunks, recursive_seconds = time_split(recursive, pages, repeat)
+    token_chunks, token_seconds = time_split(token, pages, repeat)
+
+    def lengths(chunks):
+        return [len(ids) for ids in tokenizer([c.page_content for c in chunks], add_special_tokens=False)["input_ids"]]
+
+    recursive_lengths = lengths(recursive_chunks)
+    token_lengths = lengths(token_chunks)
+
+    result = dict(
+        n_docs=len(doc_paths),
+        n_pages=len(pages),
+        max_tokens=embeddings.max_seq_length,
+        chunk_overlap=chunk_overlap,
+        recursive=dict(
+            pages_per_second=len(pages) / recursive_seconds,
+            n_chunks=len(recursive_chunks),
+            mean_tokens=statistics.mean(recursive_lengths or [0]),
+            # The tokens beyond the model input are truncated when encoded.
+            truncated_chunks=sum(n > token.max_tokens for n in recursive_lengths),
+        ),
+        token=dict(
+            pages_per_second=len(pages) / token_seconds,
+            n_chunks=len(token_chunks),
+            mean_tokens=statistics.mean(token_lengths or [0]),
+            truncated_chunks=sum(n > token.max_tokens for n in token_lengths),
+        ),
+        split_speedup=recursive_seconds / token_seconds,
+    )
+
+    if embed:
+        texts = [chunk.page_content for chunk in token_chunks]
+        token_ids = pop_token_ids(token_chunks)
+
+        start = time.perf_counter()
+        embeddings.encode_batch(texts, batch_size=batch_size)
+        text_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        embeddings.encode_batch(texts, batch_size=batch_size, token_ids=token_ids)
+        ids_seconds = time.perf_counter() - start
+
+        result.update(
+            embed_from_text_chunks_per_second=len(texts) / text_seconds,
+            embed_from_token_ids_chunks_per_second=len(texts) / ids_seconds,
+        )
+
+    print(json.dumps(result))
+
+    if output is not None:
+        Path(output).write_text(json.dumps(result, indent=2))
+
+    return result
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
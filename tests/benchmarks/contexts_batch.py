@@ -0,0 +1,76 @@
+"""Benchmark `get_contexts_batch` against calling `get_contexts` in a loop.
+
+This uses the configured docs and indicators collections, so they should
+already be populated. The query cache is cleared before each run so that both
+approaches encode every prompt.
+
+Usage:
+    python -m tests.benchmarks.contexts_batch --n_prompts=256 --output=contexts_batch.json
+"""
+import json
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+import fire
+
+from llm4data.embeddings.query_cache import get_query_cache
+from llm4data.index import get_index_registry
+from llm4data.prompts.context import get_contexts, get_contexts_batch
+from tests.benchmarks.corpus import make_corpus
+
+
+def main(
+    n_prompts: int = 128,
+    k_docs: int = 5,
+    k_indicators: int = 10,
+    indicators_mode: str = "dense",
+    seed: int = 0,
+    output: Optional[Union[str, Path]] = None,
+):
+    prompts = make_corpus("queries", n_prompts, seed=seed)
+
+    # Load the models and the clients before timing.
+    registry = get_index_registry()
+    registry.docs.embeddings.embed_query("warm up")
+    registry.indicators.embeddings.embed_query("warm up")
+
+    get_query_cache().clear()
+    start = time.perf_counter()
+    loop_results = [
+        get_contexts(prompt, k_docs=k_docs, k_indicators=k_indicators, indicators_mode=indicators_mode)
+        for prompt in prompts
+    ]
+    loop_seconds = time.perf_counter() - start
+
+    get_query_cache().clear()
+    start = time.perf_counter()
+    batch_results = get_contexts_batch(prompts, k_docs=k_docs, k_indicators=k_indicators, indicators_mode=indicators_mode)
+    batch_seconds = time.perf_counter() - start
+
+    same_results = all(
+        [r["id"] for r in a["doc_context_records"] + a["indicators_context_records"]]
+        == [r["id"] for r in b["doc_context_records"] + b["indicators_context_records"]]
+        for a, b in zip(loop_results, batch_results)
+    )
+
+    result = dict(
+        n_prompts=n_prompts,
+        k_docs=k_docs,
+        k_indicators=k_indicators,
+        indicators_mode=indicators_mode,
+        loop_prompts_per_second=n_prompts / loop_seconds,
+        batch_prompts_per_second=n_prompts / batch_seconds,
+        speedup=loop_seconds / batch_seconds,
+        same_results=same_results,
+    )
+    print(json.dumps(result))
+
+    if output is not None:
+        Path(output).write_text(json.dumps(result, indent=2))
+
+    return result
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
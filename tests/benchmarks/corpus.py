@@ -0,0 +1,55 @@
+"""Synthetic corpora for the embedding benchmarks.
+
+The texts are drawn from a development economics vocabulary with word counts
+following log-normal distributions that approximate the lengths seen in
+practice: short user prompts, indicator descriptions, and document chunks
+that are mostly close to the chunk size with a tail of short chunks at page
+and section ends.
+"""
+import random
+from typing import Dict, List
+
+VOCABULARY = (
+    "gdp growth poverty inequality income household consumption survey "
+    "education health water sanitation electricity access trade exports "
+    "imports tariff inflation exchange rate debt fiscal revenue expenditure "
+    "employment labor informal sector agriculture rural urban migration "
+    "climate emissions energy renewable forest land gender women youth "
+    "population fertility mortality child nutrition stunting school "
+    "enrollment learning remittances finance credit bank investment "
+    "infrastructure roads transport digital internet mobile governance "
+    "conflict fragility resilience disaster risk social protection transfers "
+    "the of and in to for on with by from as at per percent annual rate "
+    "country region world development report policy program project indicator"
+).split()
+
+# (mean of log word count, std of log word count, max word count)
+LENGTH_PROFILES: Dict[str, tuple] = {
+    "queries": (2.4, 0.5, 64),
+    "indicators": (4.0, 0.6, 256),
+    "docs": (5.2, 0.4, 400),
+}
+
+
+def make_corpus(profile: str, n: int, seed: int = 0) -> List[str]:
+    """Generate `n` synthetic texts with the length profile of a data type.
+
+    Args:
+        profile (str): One of `LENGTH_PROFILES`.
+        n (int): The number of texts.
+        seed (int): The random seed.
+    """
+    if profile not in LENGTH_PROFILES:
+        raise ValueError(
+            f"Unknown profile `{profile}`, expected one of {list(LENGTH_PROFILES)}"
+        )
+
+    mu, sigma, max_words = LENGTH_PROFILES[profile]
+    rng = random.Random(seed)
+
+    texts = []
+    for _ in range(n):
+        n_words = min(max(1, int(rng.lognormvariate(mu, sigma))), max_words)
+        texts.append(" ".join(rng.choices(VOCABULARY, k=n_words)))
+
+    return texts
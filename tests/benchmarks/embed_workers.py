@@ -0,0 +1,73 @@
+"""Benchmark the chunks/s of `EmbeddingModel.encode_batch` from 1 to N CPU workers.
+
+Usage:
+    python -m tests.benchmarks.embed_workers --max_workers=8 --threads_per_worker=1
+    python -m tests.benchmarks.embed_workers --max_workers=8 --output=embed_workers.json
+
+The `workers=0` row is the in-process baseline without a pool.
+"""
+import dataclasses
+import json
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+import fire
+
+from llm4data.embeddings.docs import get_docs_embeddings
+from tests.benchmarks.corpus import make_corpus
+
+
+def benchmark_workers(
+    max_workers: int = 4,
+    threads_per_worker: Optional[int] = 1,
+    n_texts: int = 2000,
+    batch_size: int = 32,
+    model_name: Optional[str] = None,
+    output: Optional[Union[str, Path]] = None,
+):
+    embeddings = get_docs_embeddings()
+    overrides: dict = dict(cache_embeddings=False)
+
+    if model_name is not None:
+        overrides.update(model_name=model_name, kwargs=None, collection_name=None)
+
+    # Do not read from or write to the persistent embedding cache.
+    embeddings = dataclasses.replace(embeddings, **overrides)
+    texts = make_corpus("docs", n_texts)
+
+    results = []
+    for workers in range(0, max_workers + 1):
+        if workers > 0:
+            embeddings.start_pool(workers, threads_per_worker=threads_per_worker)
+            # Warm up the workers so that model loading is not timed.
+            embeddings.encode_batch(texts[: batch_size * workers], batch_size=batch_size)
+
+        try:
+            start = time.perf_counter()
+            embeddings.encode_batch(texts, batch_size=batch_size)
+            elapsed = time.perf_counter() - start
+        finally:
+            embeddings.stop_pool()
+
+        result = dict(
+            workers=workers,
+            threads_per_worker=threads_per_worker if workers else None,
+            n_texts=n_texts,
+            batch_size=batch_size,
+            seconds=elapsed,
+            chunks_per_second=n_texts / elapsed,
+        )
+        results.append(result)
+        print(json.dumps(result))
+
+    if output is not None:
+        Path(output).write_text(
+            json.dumps(dict(model_id=embeddings.model_id, results=results), indent=2)
+        )
+
+    return results
+
+
+if __name__ == "__main__":
+    fire.Fire(benchmark_workers)
@@ -0,0 +1,220 @@
+"""Embedding throughput and latency benchmarks.
+
+For each configured embedding, this measures:
+
+- the encode throughput (texts/s) of `EmbeddingModel.encode_batch` on a
+  synthetic corpus with the length profile of the data type, for every
+  combination of batch size and torch thread count;
+- the single-query latency (p50/p95/p99, in ms) of the embedding backend.
+
+The persistent embedding cache and the query cache are bypassed so that every
+text is actually encoded. The results are written to a JSON file together with
+the machine details so that runs can be compared over time.
+
+Usage:
+    python -m tests.benchmarks.embeddings run --output=bench.json
+    python -m tests.benchmarks.embeddings run --data_types='[indicators]' --threads='[1,4]'
+    python -m tests.benchmarks.embeddings compare old.json new.json
+"""
+import dataclasses
+import json
+import os
+import platform
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+import fire
+import numpy as np
+
+from llm4data import __version__
+from llm4data.embeddings import (
+    get_docs_embeddings,
+    get_indicators_embeddings,
+    get_microdata_embeddings,
+)
+from tests.benchmarks.corpus import make_corpus
+
+EMBEDDINGS: Dict[str, Callable] = {
+    "docs": get_docs_embeddings,
+    "indicators": get_indicators_embeddings,
+    "microdata": get_microdata_embeddings,
+}
+
+# The synthetic corpus profile used for the documents of each data type.
+CORPUS_PROFILES = {
+    "docs": "docs",
+    "indicators": "indicators",
+    "microdata": "indicators",
+}
+
+
+def get_machine_info() -> dict:
+    import torch
+
+    return dict(
+        llm4data_version=__version__,
+        python=platform.python_version(),
+        platform=platform.platform(),
+        processor=platform.processor(),
+        cpu_count=os.cpu_count(),
+        torch=torch.__version__,
+        torch_threads=torch.get_num_threads(),
+    )
+
+
+def benchmark_throughput(
+    embeddings, texts: List[str], batch_size: int, repeats: int = 1
+) -> dict:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        embeddings.encode_batch(texts, batch_size=batch_size)
+        timings.append(time.perf_counter() - start)
+
+    seconds = min(timings)
+    return dict(seconds=seconds, texts_per_second=len(texts) / seconds)
+
+
+def benchmark_latency(embeddings, queries: List[str], warmup: int = 5) -> dict:
+    # Call the backend directly to bypass the query cache.
+    backend = embeddings.embeddings
+
+    for query in queries[:warmup]:
+        backend.embed_query(query)
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        backend.embed_query(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return dict(
+        n_queries=len(queries),
+        mean_ms=float(np.mean(latencies)),
+        p50_ms=float(p50),
+        p95_ms=float(p95),
+        p99_ms=float(p99),
+    )
+
+
+def run(
+    data_types: Sequence[str] = ("docs", "indicators", "microdata"),
+    batch_sizes: Sequence[int] = (8, 32, 64),
+    threads: Optional[Sequence[int]] = None,
+    n_texts: int = 512,
+    n_queries: int = 200,
+    repeats: int = 1,
+    seed: int = 0,
+    output: Optional[Union[str, Path]] = None,
+):
+    """Run the benchmarks and optionally write the results to `output`.
+
+    Args:
+        data_types: The configured embeddings to benchmark.
+        batch_sizes: The batch sizes used for the throughput benchmark.
+        threads: The torch thread counts. Defaults to the current setting.
+        n_texts: The number of texts in the throughput corpus.
+        n_queries: The number of queries in the latency benchmark.
+        repeats: The throughput is the best of this many runs.
+        seed: The random seed of the synthetic corpora.
+        output: The path of the JSON results file.
+    """
+    import torch
+
+    if isinstance(data_types, str):
+        data_types = [data_types]
+
+    default_threads = torch.get_num_threads()
+    threads = list(threads or [default_threads])
+
+    report = dict(
+        created_at=datetime.now().isoformat(),
+        machine=get_machine_info(),
+        params=dict(
+            batch_sizes=list(batch_sizes),
+            threads=threads,
+            n_texts=n_texts,
+            n_queries=n_queries,
+            repeats=repeats,
+            seed=seed,
+        ),
+        results=[],
+    )
+
+    queries = make_corpus("queries", n_queries, seed=seed)
+
+    try:
+        for data_type in data_types:
+            # Do not read from or write to the persistent embedding cache.
+            embeddings = dataclasses.replace(
+                EMBEDDINGS[data_type](), cache_embeddings=False
+            )
+            texts = make_corpus(CORPUS_PROFILES[data_type], n_texts, seed=seed)
+
+            for n_threads in threads:
+                torch.set_num_threads(n_threads)
+
+                result = dict(
+                    data_type=data_type,
+                    model_id=embeddings.model_id,
+                    encoder_id=embeddings.encoder_id,
+                    threads=n_threads,
+                    latency=benchmark_latency(embeddings, queries),
+                    throughput=[],
+                )
+
+                for batch_size in batch_sizes:
+                    result["throughput"].append(
+                        dict(
+                            batch_size=batch_size,
+                            **benchmark_throughput(
+                                embeddings, texts, batch_size, repeats=repeats
+                            ),
+                        )
+                    )
+
+                report["results"].append(result)
+                print(json.dumps(result))
+    finally:
+        torch.set_num_threads(default_threads)
+
+    if output is not None:
+        Path(output).write_text(json.dumps(report, indent=2))
+
+    return report
+
+
+def compare(baseline: Union[str, Path], candidate: Union[str, Path]):
+    """Print the relative change of each metric between two result files."""
+    baseline_report = json.loads(Path(baseline).read_text())
+    candidate_report = json.loads(Path(candidate).read_text())
+
+    def index(report: dict) -> dict:
+        metrics = {}
+        for result in report["results"]:
+            key = (result["data_type"], result["threads"])
+            for name in ["p50_ms", "p95_ms", "p99_ms"]:
+                metrics[key + (name,)] = result["latency"][name]
+            for row in result["throughput"]:
+                metrics[key + (f"texts_per_second@{row['batch_size']}",)] = row[
+                    "texts_per_second"
+                ]
+        return metrics
+
+    baseline_metrics = index(baseline_report)
+    candidate_metrics = index(candidate_report)
+
+    for key in sorted(set(baseline_metrics) & set(candidate_metrics)):
+        old, new = baseline_metrics[key], candidate_metrics[key]
+        change = (new - old) / old * 100 if old else float("nan")
+        data_type, n_threads, name = key
+        print(
+            f"{data_type:<12} threads={n_threads:<3} {name:<26} {old:>12.2f} -> {new:>12.2f} ({change:+.1f}%)"
+        )
+
+
+if __name__ == "__main__":
+    fire.Fire(dict(run=run, compare=compare))
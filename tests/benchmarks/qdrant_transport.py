@@ -0,0 +1,124 @@
+"""Benchmark REST against gRPC for Qdrant upserts and searches.
+
+This needs a running Qdrant server. The url is read from `QDRANT_URL` and
+`QDRANT_PORT` unless `--url` is given, and the gRPC port from
+`QDRANT_GRPC_PORT` (default 6334). A temporary collection with random vectors
+is created and deleted for each transport.
+
+Usage:
+    python -m tests.benchmarks.qdrant_transport --n_points=20000 --output=transport.json
+"""
+import json
+import time
+import uuid
+from pathlib import Path
+from typing import Optional, Union
+
+import fire
+import numpy as np
+from qdrant_client.http import models
+
+from llm4data.index.qdrant import forget_collection, get_client_key, get_index_client
+
+
+def benchmark_transport(
+    url: Optional[str],
+    prefer_grpc: bool,
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    batch_size: int,
+    k: int,
+) -> dict:
+    client = get_index_client(url=url, prefer_grpc=prefer_grpc)
+    collection_name = f"llm4data_benchmark_{uuid.uuid4().hex[:8]}"
+
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config=models.VectorParams(
+            size=vectors.shape[1], distance=models.Distance.COSINE
+        ),
+    )
+
+    try:
+        start = time.perf_counter()
+        for i in range(0, len(vectors), batch_size):
+            batch = vectors[i : i + batch_size]
+            client.upsert(
+                collection_name=collection_name,
+                points=models.Batch(
+                    ids=list(range(i, i + len(batch))),
+                    vectors=batch.tolist(),
+                    payloads=[{"i": j} for j in range(i, i + len(batch))],
+                ),
+                wait=True,
+            )
+        upsert_seconds = time.perf_counter() - start
+
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            client.search(
+                collection_name=collection_name, query_vector=query.tolist(), limit=k
+            )
+            latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        client.delete_collection(collection_name)
+        forget_collection(collection_name, url=url, prefer_grpc=prefer_grpc)
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return dict(
+        transport="grpc" if prefer_grpc else "rest",
+        upsert_points_per_second=len(vectors) / upsert_seconds,
+        search_p50_ms=float(p50),
+        search_p95_ms=float(p95),
+        search_p99_ms=float(p99),
+    )
+
+
+def main(
+    url: Optional[str] = None,
+    n_points: int = 10000,
+    n_queries: int = 500,
+    size: int = 384,
+    batch_size: int = 256,
+    k: int = 10,
+    seed: int = 0,
+    output: Optional[Union[str, Path]] = None,
+):
+    kind, location, _ = get_client_key(url=url)
+    if kind != "url":
+        raise ValueError("The transport benchmark needs a Qdrant server url.")
+
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n_points, size), dtype=np.float32)
+    queries = rng.standard_normal((n_queries, size), dtype=np.float32)
+
+    results = []
+    for prefer_grpc in (False, True):
+        result = benchmark_transport(location, prefer_grpc, vectors, queries, batch_size, k)
+        results.append(result)
+        print(json.dumps(result))
+
+    if output is not None:
+        Path(output).write_text(
+            json.dumps(
+                dict(
+                    url=location,
+                    params=dict(
+                        n_points=n_points,
+                        n_queries=n_queries,
+                        size=size,
+                        batch_size=batch_size,
+                        k=k,
+                    ),
+                    results=results,
+                ),
+                indent=2,
+            )
+        )
+
+    return results
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,77 @@
+"""Check that the ONNX backend reproduces the torch embeddings.
+
+The model is downloaded from the Hugging Face hub on the first run. Use the
+`LLM4DATA_TEST_EMBEDDING_MODEL` environment variable to test another model.
+"""
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("sentence_transformers")
+
+from langchain_community.embeddings import HuggingFaceEmbeddings  # noqa: E402
+
+from llm4data.embeddings.onnx import ONNXEmbeddings  # noqa: E402
+
+MODEL_NAME = os.getenv(
+    "LLM4DATA_TEST_EMBEDDING_MODEL", "avsolatorio/GIST-small-Embedding-v0"
+)
+
+# Maximum absolute difference per dimension for the fp32 model, and minimum
+# cosine similarity to the torch vectors for the int8 model.
+FP32_ATOL = 1e-4
+INT8_MIN_COSINE = 0.95
+
+TEXTS = [
+    "What is the GDP per capita of the Philippines?",
+    "NY.GDP.PCAP.CD",
+    "Access to electricity (% of population)",
+    "This report analyses the impact of climate shocks on rural household "
+    "consumption and poverty in Sub-Saharan Africa over the last two decades.",
+    "",
+]
+
+
+@pytest.fixture(scope="module")
+def torch_vectors():
+    embeddings = HuggingFaceEmbeddings(
+        model_name=MODEL_NAME, model_kwargs={"device": "cpu"}
+    )
+    return np.array(embeddings.embed_documents(TEXTS))
+
+
+def test_onnx_matches_torch(tmp_path_factory, torch_vectors):
+    embeddings = ONNXEmbeddings(
+        model_name=MODEL_NAME, cache_folder=tmp_path_factory.mktemp("onnx")
+    )
+    onnx_vectors = np.array(embeddings.embed_documents(TEXTS))
+
+    assert onnx_vectors.shape == torch_vectors.shape
+    np.testing.assert_allclose(onnx_vectors, torch_vectors, atol=FP32_ATOL)
+
+
+def test_quantized_onnx_close_to_torch(tmp_path_factory, torch_vectors):
+    embeddings = ONNXEmbeddings(
+        model_name=MODEL_NAME,
+        quantize=True,
+        cache_folder=tmp_path_factory.mktemp("onnx"),
+    )
+    onnx_vectors = np.array(embeddings.embed_documents(TEXTS))
+
+    cosine = (onnx_vectors * torch_vectors).sum(axis=1) / (
+        np.linalg.norm(onnx_vectors, axis=1) * np.linalg.norm(torch_vectors, axis=1)
+    )
+
+    assert cosine.min() >= INT8_MIN_COSINE
+
+
+def test_onnx_query_matches_documents(tmp_path_factory):
+    embeddings = ONNXEmbeddings(
+        model_name=MODEL_NAME, cache_folder=tmp_path_factory.mktemp("onnx")
+    )
+
+    np.testing.assert_allclose(
+        embeddings.embed_query(TEXTS[0]), embeddings.embed_documents(TEXTS[:1])[0]
+    )
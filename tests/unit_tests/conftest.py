@@ -0,0 +1,15 @@
+"""Shared setup of the unit tests.
+
+`llm4data.configs` requires some environment variables at import time. The
+data directories are pointed to a temporary directory unless already set,
+e.g., by a `.env` file.
+"""
+import os
+import tempfile
+
+_LLM4DATA_DIR = tempfile.mkdtemp(prefix="llm4data-tests-")
+
+os.environ.setdefault("LLM4DATA_DIR", _LLM4DATA_DIR)
+os.environ.setdefault("LLM4DATA_CACHE_DIR", "cache")
+os.environ.setdefault("OPENAI_PAYLOAD_DIR", "openai_payload")
+os.environ.setdefault("TASK_LABEL_WDI_SQL", "prompt2wdiSQL")
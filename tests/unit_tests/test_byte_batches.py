@@ -0,0 +1,26 @@
+"""Tests of the size-bounded upsert batches of the Qdrant index."""
+from llm4data.index.qdrant import get_byte_batches, get_point_bytes
+
+
+def test_point_bytes():
+    assert get_point_bytes({"a": 1}, [0.0] * 8) == len('{"a": 1}') + 32
+
+
+def test_batches_at_the_byte_limit():
+    # A batch of exactly `max_batch_bytes` is kept, one more byte starts a new one.
+    assert get_byte_batches([4, 6, 5], max_batch_bytes=10, max_batch_size=10) == [(0, 2), (2, 3)]
+    assert get_byte_batches([4, 7, 5], max_batch_bytes=10, max_batch_size=10) == [(0, 1), (1, 2), (2, 3)]
+
+
+def test_batches_at_the_size_limit():
+    assert get_byte_batches([1] * 5, max_batch_bytes=100, max_batch_size=2) == [(0, 2), (2, 4), (4, 5)]
+
+
+def test_oversized_point():
+    # A point larger than the limit is sent alone, never in an empty batch.
+    assert get_byte_batches([50], max_batch_bytes=10, max_batch_size=10) == [(0, 1)]
+    assert get_byte_batches([3, 50, 3, 3], max_batch_bytes=10, max_batch_size=10) == [(0, 1), (1, 2), (2, 4)]
+
+
+def test_no_points():
+    assert get_byte_batches([], max_batch_bytes=10, max_batch_size=10) == []
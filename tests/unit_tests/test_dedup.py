@@ -0,0 +1,131 @@
+"""Tests of the near-duplicate chunk suppression of the docs ingestion."""
+from langchain.docstore.document import Document
+
+from llm4data.scripts.indexing.docs.dedup import DuplicateDetector, MinHasher, get_similarity
+
+WORDS = [f"word{i}" for i in range(100)]
+TEXT = " ".join(WORDS)
+# One word in a hundred changed: 5 of the 96 shingles differ.
+NEAR_TEXT = " ".join(WORDS[:50] + ["other"] + WORDS[51:])
+OTHER_TEXT = " ".join(f"term{i}" for i in range(100))
+
+
+def get_detector(tmp_path, **kwargs) -> DuplicateDetector:
+    return DuplicateDetector(tmp_path / "signatures.sqlite", **kwargs)
+
+
+def chunk(text: str, page: int = 0) -> Document:
+    return Document(page_content=text, metadata=dict(page=page))
+
+
+def test_minhash_similarity():
+    hasher = MinHasher()
+    signature = hasher.signature(hasher.words(TEXT))
+
+    # The permutations are seeded, so signatures are stable across runs.
+    assert (signature == MinHasher().signature(hasher.words(TEXT.upper()))).all()
+    assert signature.shape == (128,)
+
+    near = get_similarity(signature, hasher.signature(hasher.words(NEAR_TEXT)))
+    other = get_similarity(signature, hasher.signature(hasher.words(OTHER_TEXT)))
+    assert 0.85 <= near < 1
+    assert other < 0.1
+
+
+def test_threshold(tmp_path):
+    for threshold, n_duplicates in [(0.85, 1), (0.99, 0)]:
+        detector = get_detector(tmp_path / str(threshold), threshold=threshold)
+        detector.filter_duplicates("D1", [chunk(TEXT)], ["a"])
+        detector.commit("D1")
+
+        kept, duplicates = detector.filter_duplicates("D2", [chunk(NEAR_TEXT), chunk(OTHER_TEXT)], ["b", "c"])
+        assert duplicates == n_duplicates
+        assert len(kept) == 2 - n_duplicates
+
+
+def test_short_chunks_are_kept(tmp_path):
+    detector = get_detector(tmp_path)
+    kept, duplicates = detector.filter_duplicates("D1", [chunk("A title"), chunk("A title")], ["a", "b"])
+    assert (len(kept), duplicates) == (2, 0)
+
+
+def test_duplicates_within_document(tmp_path):
+    detector = get_detector(tmp_path)
+    kept, duplicates = detector.filter_duplicates("D1", [chunk(TEXT), chunk(NEAR_TEXT, page=1)], ["a", "b"])
+    assert [doc.page_content for doc in kept] == [TEXT]
+    assert duplicates == 1
+
+    detector.commit("D1")
+    assert [(row["chunk_id"], row["page"], row["duplicate_of"]) for row in detector.get_duplicates("D1")] == [("b", 1, "a")]
+
+
+def test_nothing_stored_before_commit(tmp_path):
+    detector = get_detector(tmp_path)
+    detector.filter_duplicates("D1", [chunk(TEXT)], ["a"])
+
+    # The pending chunks are not in the store, e.g., for another process.
+    other = get_detector(tmp_path)
+    kept, duplicates = other.filter_duplicates("D2", [chunk(TEXT)], ["b"])
+    assert (len(kept), duplicates) == (1, 0)
+
+    detector.commit("D1")
+    kept, duplicates = get_detector(tmp_path).filter_duplicates("D3", [chunk(TEXT)], ["c"])
+    assert (len(kept), duplicates) == (0, 1)
+
+
+def test_duplicates_across_pending_documents(tmp_path):
+    detector = get_detector(tmp_path)
+    kept, _ = detector.filter_duplicates("D1", [chunk(TEXT), chunk(OTHER_TEXT)], ["a1", "a2"], source="D1.pdf")
+    assert len(kept) == 2
+
+    # D1 is not upserted yet, but its chunks are not indexed twice.
+    kept, duplicates = detector.filter_duplicates("D2", [chunk(NEAR_TEXT)], ["b1"], source="D2.pdf")
+    assert (len(kept), duplicates) == (0, 1)
+
+    detector.commit("D2")
+    detector.commit("D1")
+    assert detector.get_duplicates("D2")[0]["duplicate_of"] == "a1"
+    assert detector.get_orphaned_sources() == []
+
+
+def test_discard_orphans_duplicates(tmp_path):
+    detector = get_detector(tmp_path)
+    detector.filter_duplicates("D1", [chunk(TEXT)], ["a1"], source="D1.pdf")
+    detector.filter_duplicates("D2", [chunk(TEXT)], ["b1"], source="D2.pdf")
+    detector.commit("D2")
+
+    # D1 fails, so D2 must be re-indexed to index the chunk.
+    detector.discard("D1")
+    assert detector.get_orphaned_sources() == ["D2.pdf"]
+
+    # The discarded chunks are no longer used to drop duplicates.
+    kept, duplicates = detector.filter_duplicates("D3", [chunk(TEXT)], ["c1"])
+    assert (len(kept), duplicates) == (1, 0)
+
+
+def test_remove_document_orphans_duplicates(tmp_path):
+    detector = get_detector(tmp_path)
+    detector.filter_duplicates("D1", [chunk(TEXT), chunk(OTHER_TEXT)], ["a1", "a2"], source="D1.pdf")
+    detector.commit("D1")
+    detector.filter_duplicates("D2", [chunk(TEXT)], ["b1"], source="D2.pdf")
+    detector.commit("D2")
+    assert detector.get_orphaned_sources() == []
+
+    # D1 is re-indexed and still has the chunk that D2 duplicates.
+    detector.remove_document("D1")
+    kept, _ = detector.filter_duplicates("D1", [chunk(TEXT)], ["a1"], source="D1.pdf")
+    assert len(kept) == 1
+    detector.commit("D1")
+    assert detector.get_orphaned_sources() == []
+
+    # D1 changed and lost the chunk, so D2 must be re-indexed to index it.
+    detector.remove_document("D1")
+    detector.filter_duplicates("D1", [chunk(OTHER_TEXT)], ["a2"], source="D1.pdf")
+    detector.commit("D1")
+    assert detector.get_orphaned_sources() == ["D2.pdf"]
+
+    detector.remove_document("D2")
+    kept, duplicates = detector.filter_duplicates("D2", [chunk(TEXT)], ["b1"], source="D2.pdf")
+    assert (len(kept), duplicates) == (1, 0)
+    detector.commit("D2")
+    assert detector.get_orphaned_sources() == []
@@ -0,0 +1,97 @@
+"""Tests of the persistent embedding cache."""
+import numpy as np
+import pytest
+
+from llm4data.embeddings.cache import EmbeddingCache
+
+SIZE = 4
+
+
+def get_vectors(n: int, offset: int = 0) -> np.ndarray:
+    return np.arange(offset, offset + n * SIZE, dtype=np.float32).reshape(n, SIZE)
+
+
+def test_put_and_get(tmp_path):
+    cache = EmbeddingCache(tmp_path, size=SIZE)
+    cache.put_many(["a", "b"], get_vectors(2))
+
+    a, missing, b = cache.get_many(["a", "c", "b"])
+
+    assert missing is None
+    np.testing.assert_array_equal(a, get_vectors(2)[0])
+    np.testing.assert_array_equal(b, get_vectors(2)[1])
+
+
+def test_put_skips_cached_and_repeated_texts(tmp_path):
+    cache = EmbeddingCache(tmp_path, size=SIZE)
+    cache.put_many(["a", "a"], get_vectors(2))
+    cache.put_many(["a", "b"], get_vectors(2, offset=100))
+
+    assert len(cache) == 2
+    assert cache.vectors_path.stat().st_size == 2 * cache.row_bytes
+    np.testing.assert_array_equal(cache.get_many(["a"])[0], get_vectors(1)[0])
+
+
+def test_put_rejects_wrong_size(tmp_path):
+    cache = EmbeddingCache(tmp_path, size=SIZE)
+
+    with pytest.raises(ValueError):
+        cache.put_many(["a"], [[0.0] * (SIZE + 1)])
+
+
+def test_reopen(tmp_path):
+    EmbeddingCache(tmp_path, size=SIZE).put_many(["a", "b"], get_vectors(2))
+
+    cache = EmbeddingCache(tmp_path, size=SIZE)
+
+    assert len(cache) == 2
+    assert "a" in cache and "b" in cache
+    np.testing.assert_array_equal(cache.get_many(["b"])[0], get_vectors(2)[1])
+
+
+def test_picks_up_writes_of_other_instances(tmp_path):
+    first = EmbeddingCache(tmp_path, size=SIZE)
+    second = EmbeddingCache(tmp_path, size=SIZE)
+
+    first.put_many(["a"], get_vectors(1))
+    second.put_many(["a", "b"], get_vectors(2, offset=100))
+
+    # `a` was already cached by the other instance, so it is not appended again.
+    assert second.vectors_path.stat().st_size == 2 * second.row_bytes
+    np.testing.assert_array_equal(second.get_many(["a"])[0], get_vectors(1)[0])
+
+
+def test_recovers_from_truncated_writes(tmp_path):
+    cache = EmbeddingCache(tmp_path, size=SIZE)
+    cache.put_many(["a", "b"], get_vectors(2))
+
+    # Simulate an interrupted write: a partial row and a partial index line.
+    with cache.vectors_path.open("ab") as f:
+        f.write(b"\0" * (cache.row_bytes // 2))
+    with cache.index_path.open("a") as f:
+        f.write("partial")
+
+    cache = EmbeddingCache(tmp_path, size=SIZE)
+    assert len(cache) == 2
+
+    cache.put_many(["c"], get_vectors(1, offset=100))
+
+    assert cache.vectors_path.stat().st_size == 3 * cache.row_bytes
+    reopened = EmbeddingCache(tmp_path, size=SIZE)
+    assert len(reopened) == 3
+    np.testing.assert_array_equal(reopened.get_many(["c"])[0], get_vectors(1, offset=100)[0])
+    np.testing.assert_array_equal(reopened.get_many(["b"])[0], get_vectors(2)[1])
+
+
+def test_ignores_index_entries_without_rows(tmp_path):
+    cache = EmbeddingCache(tmp_path, size=SIZE)
+    cache.put_many(["a", "b"], get_vectors(2))
+
+    # The index refers to a row that was lost.
+    with cache.vectors_path.open("r+b") as f:
+        f.truncate(cache.row_bytes)
+
+    reopened = EmbeddingCache(tmp_path, size=SIZE)
+
+    assert "a" in reopened
+    assert "b" not in reopened
@@ -0,0 +1,44 @@
+"""Tests of the embedding model configs that do not load the models."""
+import pytest
+
+from llm4data.embeddings.base import EmbeddingModel
+
+
+def get_model(**kwargs) -> EmbeddingModel:
+    return EmbeddingModel(
+        model_name="all-MiniLM-L6-v2",
+        distance="Cosine",
+        embedding_cls="HuggingFaceEmbeddings",
+        is_instruct=False,
+        data_type="docs",
+        collection_name="docs",
+        cache_embeddings=False,
+        **kwargs,
+    )
+
+
+@pytest.fixture
+def no_model_load(monkeypatch):
+    def load(self):
+        raise AssertionError("The model was loaded.")
+
+    monkeypatch.setattr(EmbeddingModel, "_create_embeddings", load)
+
+
+def test_ids_do_not_load_the_model(no_model_load):
+    model = get_model()
+
+    assert model.size == 384
+    assert model.model_id == "docs_all-MiniLM-L6-v2_docs_Cosine_384_None_False"
+    assert model.encoder_id.startswith("all-MiniLM-L6-v2_HuggingFaceEmbeddings_384_None_")
+    assert model.dict()["max_tokens"] is None
+
+
+def test_max_tokens(no_model_load):
+    model = get_model(max_tokens=128)
+
+    assert model.max_seq_length == 128
+    assert model.encoder_id != get_model().encoder_id
+
+    with pytest.raises(AssertionError, match="loaded"):
+        get_model().max_seq_length
@@ -0,0 +1,100 @@
+"""Tests of the fusion of the dense, sparse and pinned searches of the hybrid search."""
+from qdrant_client.http import models
+
+from llm4data.embeddings.sparse import SparseEncoder
+from llm4data.index.qdrant import (
+    _fuse_hybrid_results,
+    hybrid_search_batch_by_vectors,
+    reciprocal_rank_fusion,
+)
+
+
+def points(*ids):
+    return [models.ScoredPoint(id=point_id, version=0, score=0.0) for point_id in ids]
+
+
+class StubIndex:
+    """The attributes of the langchain Qdrant store used by the hybrid search,
+    returning the point ids as documents."""
+
+    collection_name = "indicators"
+    content_payload_key = "page_content"
+    metadata_payload_key = "metadata"
+
+    def __init__(self, results=None):
+        self.results = results
+        self.requests = None
+        self.client = self
+
+    def search_batch(self, collection_name, requests):
+        self.requests = requests
+        return self.results
+
+    @staticmethod
+    def _document_from_scored_point(point, collection_name, content_payload_key, metadata_payload_key):
+        return point.id
+
+    @staticmethod
+    def _qdrant_filter_from_dict(filter):
+        return models.Filter(
+            must=[models.FieldCondition(key=f"metadata.{key}", match=models.MatchValue(value=value)) for key, value in filter.items()]
+        )
+
+
+def test_reciprocal_rank_fusion():
+    # b is second in both rankings, d is fourth in one and first in the other.
+    fused = reciprocal_rank_fusion([points("a", "b", "c", "d"), points("d", "b")], k=4)
+    assert [point.id for point in fused] == ["b", "d", "a", "c"]
+
+    assert [point.id for point in reciprocal_rank_fusion([points("a", "b", "c")], k=2)] == ["a", "b"]
+
+
+def test_reciprocal_rank_fusion_keeps_first_point():
+    dense = [models.ScoredPoint(id=1, version=0, score=0.9)]
+    sparse = [models.ScoredPoint(id=1, version=0, score=12.0)]
+
+    (point,) = reciprocal_rank_fusion([dense, sparse], k=4)
+    assert point.score == 0.9
+
+
+def test_fuse_pinned_first():
+    results = [points(1, 2), points(2, 3), points(4)]
+    assert _fuse_hybrid_results(StubIndex(), results, k=2, group_sizes=[3]) == [[4, 2]]
+
+
+def test_fuse_pinned_not_repeated():
+    results = [points(1, 2), points(2, 3), points(3)]
+    assert _fuse_hybrid_results(StubIndex(), results, k=3, group_sizes=[3]) == [[3, 2, 1]]
+
+
+def test_fuse_groups():
+    results = [points(1, 2), points(2, 3), points(5), points(6, 7), points(7)]
+    assert _fuse_hybrid_results(StubIndex(), results, k=2, group_sizes=[3, 2]) == [[5, 2], [7, 6]]
+
+
+def test_hybrid_search_pins_series_codes():
+    encoder = SparseEncoder()
+    index = StubIndex(results=[points(1, 2), points(2, 1), points(9), points(1), points(1)])
+
+    found = hybrid_search_batch_by_vectors(
+        index,
+        [[0.1, 0.2], [0.3, 0.4]],
+        [encoder.encode_query("NY.GDP.PCAP.CD"), encoder.encode_query("poverty")],
+        k=2,
+        filter=dict(source="wdi"),
+        pin_key="metadata.series_code",
+        pin_values=[["NY.GDP.PCAP.CD"], []],
+    )
+    assert found == [[9, 1], [1]]
+
+    # The dense, sparse and pinned searches of the first query, the dense
+    # and sparse searches of the second.
+    assert len(index.requests) == 5
+    assert [request.limit for request in index.requests] == [4, 4, 1, 4, 4]
+
+    pin_filter = index.requests[2].filter
+    assert pin_filter.must[0] == models.FieldCondition(
+        key="metadata.series_code", match=models.MatchAny(any=["NY.GDP.PCAP.CD"])
+    )
+    # The pinned search also applies the filter of the query.
+    assert pin_filter.must[1] == index.requests[0].filter
@@ -0,0 +1,79 @@
+"""Import-time budget tests for the `llm4data` package.
+
+Each check runs in a fresh interpreter with `python -X importtime` so that
+modules already loaded by pytest do not hide startup regressions. The budget
+can be relaxed on slow machines with the `LLM4DATA_IMPORT_BUDGET_MS`
+environment variable.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+IMPORT_BUDGET_MS = float(os.getenv("LLM4DATA_IMPORT_BUDGET_MS", "250"))
+HEAVY_MODULES = ["torch", "langchain", "langchain_community", "sentence_transformers"]
+
+
+def run_importtime(code: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def get_cumulative_us(stderr: str, module: str) -> int:
+    """Get the cumulative import time of a module from the `-X importtime` output."""
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if name.strip() == module:
+            return int(cumulative)
+
+    raise ValueError(f"Module `{module}` not found in the import time output.")
+
+
+def test_import_llm4data_within_budget():
+    result = run_importtime("import llm4data")
+    cumulative_ms = get_cumulative_us(result.stderr, "llm4data") / 1000
+
+    assert cumulative_ms < IMPORT_BUDGET_MS, (
+        f"`import llm4data` took {cumulative_ms:.1f}ms, budget is {IMPORT_BUDGET_MS}ms"
+    )
+
+
+def test_import_llm4data_does_not_load_heavy_modules():
+    code = (
+        "import sys, llm4data; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    result = run_importtime(code)
+
+    assert result.stdout.strip() == ""
+
+
+def test_indicator2name_is_loaded_on_first_access():
+    code = (
+        "import llm4data; "
+        "assert 'indicator2name' not in vars(llm4data); "
+        "print(len(llm4data.indicator2name['wdi']))"
+    )
+    result = run_importtime(code)
+
+    assert int(result.stdout.strip()) > 0
+
+
+def test_embeddings_import_does_not_load_torch_or_langchain():
+    pytest.importorskip("qdrant_client")
+
+    code = (
+        "import sys, llm4data.embeddings, llm4data.index; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    result = run_importtime(code)
+
+    assert result.stdout.strip() == ""
@@ -0,0 +1,48 @@
+"""Tests of the selection of the documents to index by load_docs."""
+import json
+
+from llm4data.scripts.indexing.docs.load_docs import get_doc_hash, get_pending_docs
+from llm4data.scripts.indexing.manifest import IngestionManifest
+
+POINTS_FILTER = {"metadata.doc_id": "D1"}
+
+
+def write_doc(tmp_path, name: str, title: str):
+    doc_path = tmp_path / "pdf" / f"{name}.pdf"
+    doc_path.parent.mkdir(exist_ok=True)
+    doc_path.write_bytes(b"%PDF " + name.encode())
+
+    metadata_path = tmp_path / "pdf" / f"{name}.metadata.json"
+    metadata_path.write_text(json.dumps({"title": title}))
+
+    return doc_path
+
+
+def test_retry_of_failed_change_deletes_stale_points(tmp_path):
+    manifest = IngestionManifest(tmp_path / "manifest.sqlite", collection_name="docs", model_id="model")
+    doc_path = write_doc(tmp_path, "D1", "v1")
+    manifest.mark_indexed(doc_path, content_hash=get_doc_hash(doc_path, {"title": "v1"}), points_filter=POINTS_FILTER)
+
+    pending, stale_filters, _, _ = get_pending_docs([doc_path], manifest.get_records(), incremental=True)
+    assert (pending, stale_filters) == ([], {})
+
+    # The document changes and its re-index fails.
+    write_doc(tmp_path, "D1", "v2")
+    pending, stale_filters, doc_states, _ = get_pending_docs([doc_path], manifest.get_records(), incremental=True)
+    assert (pending, stale_filters) == ([doc_path], {str(doc_path): POINTS_FILTER})
+    assert doc_states[str(doc_path)][0] == {"title": "v2"}
+    manifest.mark_failed(doc_path, ValueError("broken"))
+
+    # The retry, incremental or not, still replaces the points of v1.
+    for incremental in (True, False):
+        pending, stale_filters, _, _ = get_pending_docs([doc_path], manifest.get_records(), incremental=incremental)
+        assert (pending, stale_filters) == ([doc_path], {str(doc_path): POINTS_FILTER})
+
+
+def test_failed_document_without_points(tmp_path):
+    manifest = IngestionManifest(tmp_path / "manifest.sqlite", collection_name="docs", model_id="model")
+    doc_path = write_doc(tmp_path, "D2", "v1")
+    manifest.mark_failed(doc_path, ValueError("broken"))
+
+    pending, stale_filters, _, _ = get_pending_docs([doc_path], manifest.get_records())
+    assert (pending, stale_filters) == ([doc_path], {})
@@ -0,0 +1,152 @@
+"""Tests of the ingestion manifest of the indexing scripts."""
+import sqlite3
+import threading
+
+from llm4data.scripts.indexing.manifest import (
+    STATUS_FAILED,
+    STATUS_INDEXED,
+    IngestionManifest,
+    get_content_hash,
+)
+
+
+def get_manifest(tmp_path, **kwargs) -> IngestionManifest:
+    kwargs.setdefault("collection_name", "docs")
+    kwargs.setdefault("model_id", "model")
+    return IngestionManifest(tmp_path / "manifest.sqlite", **kwargs)
+
+
+def test_content_hash():
+    assert get_content_hash("a", {"x": 1, "y": 2}) == get_content_hash("a", {"y": 2, "x": 1})
+    assert get_content_hash("a", "b") != get_content_hash("ab", "")
+    assert get_content_hash("a", None) != get_content_hash("a", {})
+
+
+def test_mark_indexed(tmp_path):
+    manifest = get_manifest(tmp_path)
+    manifest.mark_indexed(
+        "D1.pdf",
+        content_hash="h1",
+        chunk_count=3,
+        durations=dict(embed=1.5),
+        points_filter={"metadata.doc_id": "D1"},
+    )
+
+    row = manifest.get_item("D1.pdf")
+    assert row["status"] == STATUS_INDEXED
+    assert row["chunk_count"] == 3
+    assert row["durations"] == dict(embed=1.5)
+    assert manifest.get_indexed_records() == {
+        "D1.pdf": dict(content_hash="h1", points_filter={"metadata.doc_id": "D1"})
+    }
+
+
+def test_upsert_keeps_known_values(tmp_path):
+    manifest = get_manifest(tmp_path)
+    manifest.mark_indexed("D1.pdf", content_hash="h1", chunk_count=3, points_filter={"metadata.doc_id": "D1"})
+
+    # A failure does not erase the hash nor the points filter of the indexed version.
+    manifest.mark_failed("D1.pdf", ValueError("broken"))
+    row = manifest.get_item("D1.pdf")
+    assert row["status"] == STATUS_FAILED
+    assert row["error"] == "broken"
+    assert (row["content_hash"], row["chunk_count"]) == ("h1", 3)
+    assert row["points_filter"] == {"metadata.doc_id": "D1"}
+
+    manifest.mark_indexed("D1.pdf", content_hash="h2", chunk_count=4)
+    row = manifest.get_item("D1.pdf")
+    assert row["status"] == STATUS_INDEXED
+    assert row["error"] is None
+    assert (row["content_hash"], row["chunk_count"]) == ("h2", 4)
+
+
+def test_items_are_scoped_by_collection_and_model(tmp_path):
+    get_manifest(tmp_path).mark_indexed_many([dict(item="D1.pdf"), dict(item="D2.pdf")])
+    get_manifest(tmp_path, collection_name="other").mark_indexed("D3.pdf")
+    get_manifest(tmp_path, model_id="other").mark_indexed("D4.pdf")
+
+    assert get_manifest(tmp_path).get_indexed_items() == {"D1.pdf", "D2.pdf"}
+
+
+def test_reopen(tmp_path):
+    get_manifest(tmp_path).mark_indexed("D1.pdf", content_hash="h1")
+
+    manifest = get_manifest(tmp_path)
+
+    assert manifest.get_indexed_records()["D1.pdf"]["content_hash"] == "h1"
+    mode, = sqlite3.connect(manifest.path).execute("PRAGMA journal_mode").fetchone()
+    assert mode == "wal"
+
+
+def test_import_text_log(tmp_path):
+    manifest = get_manifest(tmp_path)
+    manifest.mark_indexed("D1.pdf", content_hash="h1")
+
+    log_path = tmp_path / "indexed_docs-docs.txt"
+    log_path.write_text("D1.pdf\nD2.pdf\n\nD3.pdf\n")
+
+    # The items already in the manifest are left as they are.
+    assert manifest.import_text_log(log_path) == 2
+    assert manifest.import_text_log(log_path) == 0
+    assert manifest.import_text_log(tmp_path / "missing.txt") == 0
+
+    records = manifest.get_indexed_records()
+    assert set(records) == {"D1.pdf", "D2.pdf", "D3.pdf"}
+    assert records["D1.pdf"]["content_hash"] == "h1"
+    assert records["D2.pdf"]["content_hash"] is None
+
+
+def test_import_failed_text_log(tmp_path):
+    manifest = get_manifest(tmp_path)
+
+    log_path = tmp_path / "failed_docs-docs.txt"
+    log_path.write_text("D1.pdf\tNo metadata\n")
+    manifest.import_text_log(log_path, status=STATUS_FAILED)
+
+    assert manifest.get_items(STATUS_FAILED) == {"D1.pdf"}
+    assert manifest.get_item("D1.pdf")["error"] == "No metadata"
+
+
+def test_set_content_hashes_only_fills_unknown_hashes(tmp_path):
+    manifest = get_manifest(tmp_path)
+    manifest.mark_indexed("D1.pdf", content_hash="h1")
+    manifest.mark_indexed("D2.pdf")
+
+    assert manifest.set_content_hashes({"D1.pdf": "new", "D2.pdf": "h2"}) == 1
+
+    records = manifest.get_indexed_records()
+    assert records["D1.pdf"]["content_hash"] == "h1"
+    assert records["D2.pdf"]["content_hash"] == "h2"
+    assert manifest.get_item("D2.pdf")["status"] == STATUS_INDEXED
+
+
+def test_concurrent_writes(tmp_path):
+    manifest = get_manifest(tmp_path)
+
+    def mark(worker: int):
+        for i in range(50):
+            manifest.mark_indexed(f"{worker}-{i}", content_hash=str(i))
+
+    threads = [threading.Thread(target=mark, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(manifest.get_indexed_items()) == 200
+
+
+def test_failed_item_keeps_its_indexed_record(tmp_path):
+    manifest = get_manifest(tmp_path)
+    manifest.mark_indexed("D1.pdf", content_hash="h1", points_filter={"metadata.doc_id": "D1"})
+    manifest.mark_failed("D2.pdf", ValueError("broken"))
+
+    # The re-index of the changed D1 fails.
+    manifest.mark_failed("D1.pdf", ValueError("broken"))
+
+    assert manifest.get_indexed_records() == {}
+    assert manifest.get_records() == {
+        "D1.pdf": dict(status=STATUS_FAILED, content_hash="h1", points_filter={"metadata.doc_id": "D1"}),
+        "D2.pdf": dict(status=STATUS_FAILED, content_hash=None, points_filter=None),
+    }
+    assert set(manifest.get_records(STATUS_FAILED)) == {"D1.pdf", "D2.pdf"}
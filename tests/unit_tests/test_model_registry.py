@@ -0,0 +1,77 @@
+"""Tests of the shared registry of the loaded embedding models."""
+from llm4data.embeddings.registry import ModelKey, ModelRegistry, estimate_model_bytes
+
+MB = 1024 * 1024
+
+
+class StubModel:
+    def __init__(self, megabytes: float):
+        self.memory_bytes = int(megabytes * MB)
+
+
+def get_key(name: str) -> ModelKey:
+    return ModelKey(model_name=name, embedding_cls="HuggingFaceEmbeddings", device="cpu")
+
+
+def test_models_are_loaded_once():
+    registry = ModelRegistry()
+    loads = []
+
+    def load():
+        loads.append(1)
+        return StubModel(1)
+
+    first = registry.get(get_key("a"), load)
+    assert registry.get(get_key("a"), load) is first
+    assert len(loads) == 1
+
+    # Other instructions or options are another model.
+    registry.get(ModelKey(model_name="a", embedding_cls="HuggingFaceEmbeddings", device="cpu", options="{}"), load)
+    assert len(loads) == 2
+
+
+def test_lru_eviction_under_budget():
+    registry = ModelRegistry(memory_budget_mb=10)
+    registry.get(get_key("a"), lambda: StubModel(4))
+    registry.get(get_key("b"), lambda: StubModel(4))
+
+    # Using a makes b the least recently used, which is unloaded for c.
+    registry.get(get_key("a"), lambda: StubModel(4))
+    registry.get(get_key("c"), lambda: StubModel(4))
+
+    assert get_key("b") not in registry
+    assert get_key("a") in registry and get_key("c") in registry
+    assert registry.memory_bytes == 8 * MB
+
+
+def test_model_over_budget_is_kept():
+    registry = ModelRegistry(memory_budget_mb=10)
+    registry.get(get_key("a"), lambda: StubModel(4))
+    registry.get(get_key("big"), lambda: StubModel(20))
+
+    # The new model alone exceeds the budget, so all the others are unloaded.
+    assert len(registry) == 1
+    assert get_key("big") in registry
+
+
+def test_set_memory_budget():
+    registry = ModelRegistry()
+    for name in "abc":
+        registry.get(get_key(name), lambda: StubModel(4))
+    assert len(registry) == 3
+
+    registry.set_memory_budget(5)
+    assert [key in registry for key in map(get_key, "abc")] == [False, False, True]
+
+    assert registry.unload(get_key("c"))
+    assert not registry.unload(get_key("c"))
+    assert registry.memory_bytes == 0
+
+
+def test_estimate_model_bytes():
+    class Wrapper:
+        client = StubModel(2)
+
+    assert estimate_model_bytes(StubModel(1)) == MB
+    assert estimate_model_bytes(Wrapper()) == 2 * MB
+    assert estimate_model_bytes(object()) == 0
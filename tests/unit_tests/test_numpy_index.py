@@ -0,0 +1,108 @@
+"""Tests of the in-process numpy index of small collections."""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from qdrant_client.http import models
+
+from llm4data.index.qdrant import NumpyIndex, sync_numpy_index
+
+VECTORS = [[1.0, 0.0], [0.6, 0.8], [0.0, 2.0], [-1.0, 0.0]]
+
+
+class ScrollClient:
+    """Scroll the records in pages, like the Qdrant client."""
+
+    def __init__(self, records):
+        self.records = records
+
+    def scroll(self, collection_name, limit, offset=None, **kwargs):
+        start = offset or 0
+        end = start + limit
+        return self.records[start:end], end if end < len(self.records) else None
+
+
+def get_embeddings(distance: models.Distance):
+    return SimpleNamespace(model_id=f"model_{distance.value}", size=2, distance=distance)
+
+
+def get_index(tmp_path, distance=models.Distance.COSINE, dtype="float32") -> NumpyIndex:
+    vectors = np.array(VECTORS)
+    if distance == models.Distance.COSINE:
+        # Qdrant stores normalized vectors for cosine collections.
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    records = [
+        models.Record(id=i, payload=dict(page_content=f"text {i}", metadata=dict(row=i)), vector=vector.tolist())
+        for i, vector in enumerate(vectors)
+    ]
+    embeddings = get_embeddings(distance)
+    index = SimpleNamespace(collection_name="docs", client=ScrollClient(records), embeddings=embeddings)
+    sync_numpy_index(index, dtype=dtype, batch_size=3, directory=tmp_path / "index")
+
+    return NumpyIndex(tmp_path / "index", embeddings)
+
+
+def test_sync(tmp_path):
+    index = get_index(tmp_path, dtype="float16")
+    assert len(index) == 4
+    assert index.vectors.dtype == np.float16
+    assert index.meta["count"] == 4
+    assert index.ids == [0, 1, 2, 3]
+
+
+def test_search_cosine(tmp_path):
+    index = get_index(tmp_path)
+
+    # The query is normalized, so its norm does not change the scores.
+    assert [row for row, _ in index.search([3.0, 2.0], k=4)] == [1, 0, 2, 3]
+
+    (row, score), = index.search([0.0, 5.0], k=1)
+    assert row == 2
+    assert score == pytest.approx(1.0)
+
+
+def test_search_euclid(tmp_path):
+    index = get_index(tmp_path, distance=models.Distance.EUCLID)
+
+    # [0, 2] has the largest dot product with the query, but is the farthest of the three.
+    assert [row for row, _ in index.search([1.2, 0.9], k=3)] == [1, 0, 2]
+    assert [row for row, _ in index.search([-0.9, 0.1], k=1)] == [3]
+
+
+def test_search_float16(tmp_path):
+    query = [0.2, 0.9]
+    float32 = get_index(tmp_path / "float32").search(query, k=4)
+    float16 = get_index(tmp_path / "float16", dtype="float16").search(query, k=4)
+
+    assert [row for row, _ in float16] == [row for row, _ in float32]
+    assert [score for _, score in float16] == pytest.approx([score for _, score in float32], rel=1e-3)
+
+
+def test_search_k(tmp_path):
+    index = get_index(tmp_path)
+    assert len(index.search([1.0, 0.0], k=10)) == 4
+    assert index.search([1.0, 0.0], k=0) == []
+
+
+def test_similarity_search(tmp_path):
+    index = get_index(tmp_path)
+
+    (doc, score), = index.similarity_search_with_score_by_vector([1.0, 0.0], k=1)
+    assert doc.page_content == "text 0"
+    assert doc.metadata == dict(row=0, _id=0, _collection_name="docs")
+    assert score == pytest.approx(1.0)
+
+
+def test_filters_are_not_supported(tmp_path):
+    index = get_index(tmp_path)
+
+    with pytest.raises(ValueError, match="filters"):
+        index.similarity_search_by_vector([1.0, 0.0], filter={"row": 0})
+
+
+def test_model_mismatch(tmp_path):
+    get_index(tmp_path)
+
+    with pytest.raises(ValueError, match="synced for"):
+        NumpyIndex(tmp_path / "index", get_embeddings(models.Distance.DOT))
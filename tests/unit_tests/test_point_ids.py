@@ -0,0 +1,61 @@
+"""Tests of the deterministic point ids of the indexed chunks and indicators."""
+import uuid
+
+from langchain.docstore.document import Document
+
+from llm4data import configs
+from llm4data.scripts.indexing.docs.docs import get_chunk_ids
+from llm4data.scripts.indexing.indicators.indicators import get_indicator_id
+
+
+def get_chunks():
+    return [
+        Document(page_content="Poverty fell in 2019.", metadata=dict(page=0)),
+        Document(page_content="Poverty fell in 2019.", metadata=dict(page=1)),
+        Document(page_content="Growth was slow.", metadata=dict(page=1)),
+    ]
+
+
+def test_chunk_ids_are_deterministic():
+    assert get_chunk_ids(get_chunks(), "doc-1") == get_chunk_ids(get_chunks(), "doc-1")
+
+
+def test_chunk_ids_are_valid_uuids():
+    for chunk_id in get_chunk_ids(get_chunks(), "doc-1"):
+        uuid.UUID(chunk_id)
+
+
+def test_chunk_ids_depend_on_document_page_and_text():
+    ids = get_chunk_ids(get_chunks(), "doc-1")
+
+    # The same text on another page, and another text on the same page.
+    assert len(set(ids)) == 3
+    assert set(ids).isdisjoint(get_chunk_ids(get_chunks(), "doc-2"))
+
+
+def test_chunk_ids_ignore_other_metadata():
+    chunk = Document(page_content="Growth was slow.", metadata=dict(page=1, source="a.pdf"))
+
+    assert get_chunk_ids([chunk], "doc-1") == get_chunk_ids(get_chunks()[2:], "doc-1")
+
+
+def test_indicator_id_uses_series_code():
+    first = Document(
+        page_content="GDP (current US$)",
+        metadata={configs.METADATA_KEY: dict(series_code="NY.GDP.MKTP.CD")},
+    )
+    updated = Document(
+        page_content="GDP (current US$), updated",
+        metadata={configs.METADATA_KEY: dict(series_code="NY.GDP.MKTP.CD")},
+    )
+
+    assert get_indicator_id(first) == get_indicator_id(updated)
+
+
+def test_indicator_id_falls_back_to_text():
+    first = Document(page_content="GDP (current US$)", metadata={})
+    same = Document(page_content="GDP (current US$)", metadata={})
+    other = Document(page_content="GDP per capita", metadata={})
+
+    assert get_indicator_id(first) == get_indicator_id(same)
+    assert get_indicator_id(first) != get_indicator_id(other)
@@ -0,0 +1,104 @@
+"""Tests of the LRU cache of query vectors."""
+import pytest
+
+from llm4data.embeddings import query_cache, registry
+from llm4data.embeddings.base import EmbeddingModel
+from llm4data.embeddings.query_cache import QueryCache, get_query_cache
+
+
+class StubEmbeddings:
+    """Count the queries encoded by the model."""
+
+    def __init__(self):
+        self.queries = []
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return [float(len(text)), 1.0]
+
+
+@pytest.fixture
+def stub_model(monkeypatch):
+    monkeypatch.setattr(registry, "MODEL_REGISTRY", None)
+    monkeypatch.setattr(query_cache, "QUERY_CACHE", None)
+    monkeypatch.setattr(EmbeddingModel, "_create_embeddings", lambda self: StubEmbeddings())
+
+
+def get_model(**kwargs) -> EmbeddingModel:
+    kwargs.setdefault("model_name", "all-MiniLM-L6-v2")
+    kwargs.setdefault("data_type", "docs")
+    return EmbeddingModel(
+        distance="Cosine",
+        embedding_cls="HuggingFaceEmbeddings",
+        is_instruct=False,
+        cache_embeddings=False,
+        **kwargs,
+    )
+
+
+def test_hits_and_misses():
+    cache = QueryCache(maxsize=4)
+    key = ("encoder", None, "poverty")
+
+    assert cache.get(key) is None
+    cache.put(key, [1.0, 2.0])
+    assert cache.get(key) == [1.0, 2.0]
+    assert cache.get(("encoder", "Represent the query", "poverty")) is None
+
+    assert cache.stats() == dict(hits=1, misses=2, hit_rate=1 / 3, size=1, maxsize=4)
+
+    cache.clear()
+    assert cache.stats() == dict(hits=0, misses=0, hit_rate=0.0, size=0, maxsize=4)
+
+
+def test_lru_eviction():
+    cache = QueryCache(maxsize=2)
+    cache.put(("e", None, "a"), [1.0])
+    cache.put(("e", None, "b"), [2.0])
+
+    # Reading a makes b the least recently used.
+    cache.get(("e", None, "a"))
+    cache.put(("e", None, "c"), [3.0])
+
+    assert len(cache) == 2
+    assert cache.get(("e", None, "b")) is None
+    assert cache.get(("e", None, "a")) == [1.0]
+
+
+def test_disabled():
+    cache = QueryCache(maxsize=0)
+    cache.put(("e", None, "a"), [1.0])
+    assert cache.get(("e", None, "a")) is None
+
+
+def test_vectors_are_copies():
+    cache = QueryCache()
+    cache.put(("e", None, "a"), [1.0])
+    cache.get(("e", None, "a")).append(2.0)
+    assert cache.get(("e", None, "a")) == [1.0]
+
+
+def test_shared_by_collections_of_an_encoder(stub_model):
+    docs = get_model(data_type="docs")
+    indicators = get_model(data_type="indicators")
+    assert docs.encoder_id == indicators.encoder_id
+
+    assert docs.embed_query("poverty") == indicators.embed_query("poverty")
+    assert docs.embeddings.queries == ["poverty"]
+    assert get_query_cache().stats()["hits"] == 1
+
+
+def test_keyed_by_encoder_id(stub_model):
+    mini = get_model()
+    mpnet = get_model(model_name="multi-qa-mpnet-base-dot-v1")
+
+    mini.embed_query("poverty")
+    mpnet.embed_query("poverty")
+    assert mini.embeddings.queries == mpnet.embeddings.queries == ["poverty"]
+
+    # The same model with other options encodes the queries differently.
+    other = get_model(max_tokens=128)
+    other.embed_query("poverty")
+    assert other.embeddings is mini.embeddings
+    assert mini.embeddings.queries == ["poverty", "poverty"]
+    assert get_query_cache().stats()["misses"] == 3
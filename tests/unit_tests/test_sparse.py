@@ -0,0 +1,61 @@
+"""Tests of the sparse lexical vectors of the hybrid search."""
+from llm4data.embeddings.sparse import SparseEncoder, get_code_terms
+
+
+def get_score(query, document) -> float:
+    weights = dict(zip(document.indices, document.values))
+    return sum(weights.get(index, 0.0) * value for index, value in zip(query.indices, query.values))
+
+
+def test_tokenize_dotted_codes():
+    tokens = SparseEncoder().tokenize("GDP per capita (NY.GDP.PCAP.CD) of the country")
+
+    # The code is one term, in addition to its parts, and stopwords are dropped.
+    assert tokens == ["gdp", "per", "capita", "ny.gdp.pcap.cd", "ny", "gdp", "pcap", "cd", "country"]
+
+
+def test_tokenize_is_case_insensitive():
+    encoder = SparseEncoder()
+    assert encoder.tokenize("ny.gdp.pcap.cd") == encoder.tokenize("NY.GDP.PCAP.CD")
+    assert encoder.encode_query("Ny.Gdp.Pcap.Cd") == encoder.encode_query("NY.GDP.PCAP.CD")
+
+
+def test_exact_code_ranks_first():
+    encoder = SparseEncoder()
+    query = encoder.encode_query("NY.GDP.PCAP.CD")
+
+    exact = encoder.encode_document("GDP per capita (current US$) NY.GDP.PCAP.CD")
+    partial = encoder.encode_document("GDP per capita (constant LCU) NY.GDP.PCAP.KN")
+
+    assert get_score(query, exact) > get_score(query, partial) > 0
+
+
+def test_encode_document():
+    encoder = SparseEncoder()
+    vector = encoder.encode_document("poverty poverty growth")
+
+    assert vector.indices == sorted(vector.indices)
+    weights = dict(zip(vector.indices, vector.values))
+    assert weights[encoder.token_index("poverty")] > weights[encoder.token_index("growth")]
+
+    # Longer documents get lower weights for the same term frequency.
+    longer = encoder.encode_document("poverty " + " ".join(f"word{i}" for i in range(200)))
+    assert dict(zip(longer.indices, longer.values))[encoder.token_index("poverty")] < weights[encoder.token_index("growth")]
+
+
+def test_encode_query():
+    vector = SparseEncoder().encode_query("poverty poverty of growth")
+    assert len(vector.indices) == 2
+    assert vector.values == [1.0, 1.0]
+
+
+def test_get_code_terms():
+    assert get_code_terms("What is ny.gdp.pcap.cd and SP.POP.TOTL in 2020?") == [
+        "ny.gdp.pcap.cd",
+        "NY.GDP.PCAP.CD",
+        "SP.POP.TOTL",
+    ]
+
+
+def test_get_code_terms_skips_numbers():
+    assert get_code_terms("Growth was 2.5 percent in 2019, for 1.000.000 people.") == []
@@ -0,0 +1,108 @@
+"""Tests of the single-pass token chunker of the docs ingestion."""
+import pytest
+
+from langchain.docstore.document import Document
+
+from llm4data.scripts.indexing.docs.chunker import TOKEN_IDS_KEY, TokenChunker, pop_token_ids
+
+tokenizers = pytest.importorskip("tokenizers")
+transformers = pytest.importorskip("transformers")
+
+WORDS = "the poverty rate fell in most countries during growth years while inequality rose".split()
+TEXT = " ".join(WORDS[i % len(WORDS)] for i in range(120)) + "."
+
+
+def get_tokenizer():
+    """A fast WordPiece tokenizer whose long words are split into subwords."""
+    vocab = {"[UNK]": 0, "[CLS]": 1, "[SEP]": 2, "[PAD]": 3, ".": 4}
+    for word in WORDS:
+        # Split the words of more than 4 letters into two pieces.
+        pieces = [word] if len(word) <= 4 else [word[:4], "##" + word[4:]]
+        for piece in pieces:
+            vocab.setdefault(piece, len(vocab))
+
+    backend = tokenizers.Tokenizer(tokenizers.models.WordPiece(vocab, unk_token="[UNK]"))
+    backend.pre_tokenizer = tokenizers.pre_tokenizers.BertPreTokenizer()
+
+    return transformers.PreTrainedTokenizerFast(
+        tokenizer_object=backend, unk_token="[UNK]", cls_token="[CLS]", sep_token="[SEP]", pad_token="[PAD]"
+    )
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    return get_tokenizer()
+
+
+def encode(tokenizer, text):
+    return tokenizer(text, add_special_tokens=False)["input_ids"]
+
+
+def test_requires_a_fast_tokenizer():
+    with pytest.raises(ValueError):
+        TokenChunker(object(), max_tokens=16)
+
+
+def test_rejects_overlap_larger_than_chunks(tokenizer):
+    with pytest.raises(ValueError):
+        TokenChunker(tokenizer, max_tokens=16, chunk_overlap=16)
+
+
+def test_chunks_fit_and_round_trip(tokenizer):
+    chunker = TokenChunker(tokenizer, max_tokens=24, chunk_overlap=6)
+    chunks = chunker.split_text_with_ids(TEXT)
+
+    assert len(chunks) > 1
+    for text, token_ids in chunks:
+        assert len(token_ids) <= 24
+        # The ids are those of the chunk text, so it needs no tokenization.
+        assert encode(tokenizer, text) == token_ids
+        assert text in TEXT
+
+    assert chunks[0][0].startswith("the poverty")
+    assert chunks[-1][0].endswith(".")
+
+
+def test_chunks_overlap_on_word_boundaries(tokenizer):
+    chunker = TokenChunker(tokenizer, max_tokens=24, chunk_overlap=6)
+    chunks = chunker.split_text_with_ids(TEXT)
+    words = set(WORDS) | {WORDS[(120 - 1) % len(WORDS)] + "."}
+
+    for (text, token_ids), (next_text, next_ids) in zip(chunks, chunks[1:]):
+        # Consecutive chunks share at least `chunk_overlap` tokens.
+        shared = next((n for n in range(len(next_ids), 0, -1) if token_ids[-n:] == next_ids[:n]), 0)
+        assert shared >= 6
+        # No chunk starts or ends within a word.
+        assert text.split()[-1] in words
+        assert next_text.split()[0] in words
+
+
+def test_without_overlap_the_chunks_cover_the_text(tokenizer):
+    chunker = TokenChunker(tokenizer, max_tokens=20, chunk_overlap=0)
+    chunks = chunker.split_text_with_ids(TEXT)
+
+    assert [i for _, ids in chunks for i in ids] == encode(tokenizer, TEXT)
+    assert " ".join(text for text, _ in chunks) == TEXT
+
+
+def test_empty_text(tokenizer):
+    chunker = TokenChunker(tokenizer, max_tokens=16, chunk_overlap=4)
+
+    assert chunker.split_text("") == []
+    assert chunker.split_text("   \n ") == []
+
+
+def test_split_documents_keeps_metadata(tokenizer):
+    chunker = TokenChunker(tokenizer, max_tokens=24, chunk_overlap=6)
+    pages = [Document(page_content=TEXT, metadata=dict(page=0)), Document(page_content="", metadata=dict(page=1))]
+
+    chunks = chunker.split_documents(pages)
+
+    assert chunks and all(chunk.metadata["page"] == 0 for chunk in chunks)
+    assert all(TOKEN_IDS_KEY in chunk.metadata for chunk in chunks)
+    assert "page" in pages[0].metadata and TOKEN_IDS_KEY not in pages[0].metadata
+
+    token_ids = pop_token_ids(chunks)
+    assert token_ids == [encode(tokenizer, chunk.page_content) for chunk in chunks]
+    assert all(TOKEN_IDS_KEY not in chunk.metadata for chunk in chunks)
+    assert pop_token_ids(chunks) is None